@@ -1,6 +1,6 @@
 import threading
 import tkinter as tk
-from tkinter import messagebox, scrolledtext, ttk, simpledialog
+from tkinter import messagebox, scrolledtext, ttk, simpledialog, filedialog
 import gspread
 import os
 import time
@@ -8,6 +8,31 @@ import datetime
 import pandas as pd
 import json
 import sys
+import bisect
+import gzip
+import csv
+import argparse
+from collections import deque
+import multiprocessing
+import tempfile
+import shutil
+import re
+import unicodedata
+import hashlib
+import uuid
+import cProfile
+import pstats
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from openpyxl import Workbook, load_workbook
+try:
+    import msvcrt   # Windows
+    fcntl = None
+except ImportError:
+    import fcntl
+    msvcrt = None
 from zk import ZK
 
 # --- LIBRERÍAS GOOGLE OAUTH ---
@@ -19,16 +44,28 @@ from google.oauth2.credentials import Credentials
 # ⚙️ CONFIGURACIÓN GLOBAL
 # ==========================================
 ARCHIVO_CONFIG = "config_app.json"
-ARCHIVO_EXCEL_LOCAL = "Reporte_Asistencia.xlsx"
+ARCHIVO_EXCEL_LOCAL = "Reporte_Asistencia.xlsx"  # legado: ahora se particiona por mes (Reporte_Asistencia_YYYY-MM.xlsx)
+ARCHIVO_PARTICIONES = "particiones.json"          # índice de particiones mensuales (local y nube)
 NOMBRE_HOJA_NUBE = "Asistencia_ZKTeco"
+NOMBRE_PESTANA_ESTADO = "Estado_Actual"    # una fila por UID, se actualiza en bloque
 
 # Nuevos archivos
 ARCHIVO_USUARIOS = "usuarios_config.json"   # perfiles editables
 ARCHIVO_ESTADOS = "estados.json"            # persistir últimos estados
+ARCHIVO_ESTANCIAS = "estancias.jsonl"       # estancias cerradas (una por línea)
+CARPETA_ARCHIVO_ESTADOS = "archivo_estados"  # estados inactivos (segmentos .jsonl.gz)
+ARCHIVO_OUTBOX_NUBE = "outbox_nube.jsonl"   # filas pendientes de subir a Google
+ARCHIVO_ROLLUPS = "rollups_diarios.json"    # resumen diario de checadas
+ARCHIVO_FILAS_ESTADO = "estado_actual_filas.json"  # caché UID -> fila en la pestaña Estado_Actual
+ARCHIVO_AUDITORIA_DEBOUNCE = "debounce_auditoria.jsonl"  # checadas repetidas colapsadas (un archivo por mes: debounce_auditoria_YYYY-MM.jsonl)
+CARPETA_PAQUETES = "paquetes_sync"          # paquetes de sincronización aún no copiados a la carpeta compartida
+ARCHIVO_PADRON = "padron_reloj.json"        # última foto del padrón del reloj + huellas
+ARCHIVO_RECIENTES = "checadas_recientes.json"  # últimas filas del día (arranque en caliente de la tabla)
 
 # --- MEMORIA RAM (Para evitar duplicados) ---
-HISTORIAL_PROCESADO = set()
-ESTADOS_USUARIOS = {}  # { uid: {"nombre": str, "tipo": str, "ultimo_estado": str, "ultima_actividad": "YYYY-MM-DD HH:MM:SS", "alerta": bool} }
+HISTORIAL_PROCESADO = None  # HistorialParticionado (se crea abajo): llaves "uid_fecha" por mes
+ROLLUPS_DIARIOS = {}   # { "YYYY-MM-DD": {"entradas", "salidas", "retardos", "anticipadas", "por_tipo": {tipo: n}} }
+ESTADOS_USUARIOS = {}  # { uid: EstadoUsuario } -> en JSON: {"nombre", "tipo", "ultimo_estado", "ultima_actividad": "YYYY-MM-DD HH:MM:SS", "alerta", "sucursal"}
 
 HORARIOS_CONFIG = {
     'entrada': datetime.time(9, 0),
@@ -40,6 +77,52 @@ HORARIOS_CONFIG = {
 ALERTA_HORAS_SIN_SALIDA = 4
 ALERTA_CHECK_SECONDS = 60  # cada cuánto checar visitantes
 
+# RETENCIÓN: visitantes/externos con Salida más vieja que N días se archivan
+# (se puede sobreescribir con "retencion_dias" en config_app.json)
+RETENCION_DIAS_INACTIVOS = 90
+RETENCION_CHECK_SECONDS = 3600
+
+# DEBOUNCE: checadas repetidas del mismo modo dentro de N segundos cuentan como una
+# ("debounce_segundos" en config_app.json o por usuario en usuarios_config.json)
+DEBOUNCE_SEGUNDOS = 60
+
+# API LOCAL (solo lectura): "api_puerto"/"api_host" en config_app.json
+API_PUERTO = 8765
+API_HOST = "127.0.0.1"
+API_HILOS = 4
+API_TAM_PAGINA = 100
+API_TAM_PAGINA_MAX = 1000
+
+# SONDEO ADAPTATIVO: intervalo entre lecturas del reloj (segundos)
+SONDEO_MIN_SECONDS = 10
+SONDEO_BASE_SECONDS = 60
+SONDEO_MAX_SECONDS = 300
+SONDEO_VENTANA_TURNO_MIN = 20   # minutos alrededor de entrada/salida con sondeo rápido
+SONDEO_TASA_ALTA = 2.0          # checadas/minuto a partir de las cuales se acelera
+
+# EXPORTACIÓN: filas entre avisos de progreso y filas por hoja del .xlsx (límite de Excel: 1,048,576)
+EXPORTAR_AVISO_FILAS = 5000
+EXPORTAR_MAX_FILAS_HOJA = 1_000_000
+
+# TABLA PRINCIPAL: filas visibles (y cuántas del día se recuperan al arrancar)
+TABLA_MAX_FILAS = 200
+
+# PIPELINE: cuántas checadas fluyen juntas por las etapas (memoria acotada)
+TAM_LOTE_PIPELINE = 500
+# Destinos que escriben de golpe (Excel mensual, paquetes) vacían su buffer al llegar a este tope
+MAX_FILAS_BUFFER_DESTINO = 50_000
+
+# DIAGNÓSTICO: perfilado bajo demanda (ACCESSPRO_PERFIL=1 o =N ciclos, o Ctrl+Shift+P en la ventana)
+CARPETA_DIAGNOSTICO = "diagnostico"
+PERFIL_CICLOS = 10                  # ciclos por archivo .prof acumulado
+PERFIL_CICLO_LENTO_SECONDS = 30     # ciclos más lentos se guardan aparte
+PERFIL_MEMORIA_SECONDS = 900        # cada cuánto tomar instantánea de tracemalloc
+PERFIL_TOP = 30
+PERFIL_MARCOS = 10
+
+# OCUPACIÓN: cada cuánto recalcular contadores contra ESTADOS_USUARIOS completo
+OCUPACION_RECONCILIAR_SECONDS = 300
+
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
 
 # ==========================================
@@ -52,6 +135,163 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
+FORMATO_FECHA = "%Y-%m-%d %H:%M:%S"
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def a_epoch(fecha):
+    """Convierte datetime o 'YYYY-MM-DD HH:MM:SS' a segundos epoch (int, hora de pared del reloj)."""
+    if isinstance(fecha, str):
+        fecha = datetime.datetime.strptime(fecha, FORMATO_FECHA)
+    return int((fecha.replace(tzinfo=None) - _EPOCH).total_seconds())
+
+def desde_epoch(segundos):
+    return (_EPOCH + datetime.timedelta(seconds=segundos)).strftime(FORMATO_FECHA)
+
+class _BloqueoArchivo:
+    """Candado consultivo entre procesos sobre '<archivo>.lock' (msvcrt en Windows, fcntl en el resto)."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta + ".lock"
+
+    def __enter__(self):
+        self.f = open(self.ruta, 'a+')
+        if msvcrt:
+            self.f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        else:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if msvcrt:
+                self.f.seek(0)
+                msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.f.close()
+
+class PersistenciaJSON:
+    """
+    Escrituras de JSON a prueba de cortes de luz: temporal + fsync + os.replace,
+    serializadas por archivo (hilos) y con candado consultivo (procesos).
+    Si mientras se escribe un archivo llegan más versiones, solo se escribe la
+    última; si el contenido no cambió desde la última escritura, no se toca el disco.
+    Con esperar=True, guardar() no regresa hasta que su versión (o una posterior)
+    está en disco, aunque la escriba otro hilo; si esa escritura falló, relanza el error.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.pendientes = {}    # ruta -> (versión, texto) más reciente aún sin escribir
+        self.escribiendo = set()
+        self.versiones = {}     # ruta -> última versión pedida
+        self.resultados = {}    # ruta -> (última versión procesada, excepción o None)
+        self.ultimo = {}        # ruta -> (hash del texto, mtime_ns) de lo último escrito
+
+    def guardar(self, ruta, datos, esperar=False, **opciones_json):
+        texto = json.dumps(datos, **opciones_json)
+        with self.cond:
+            v = self.versiones[ruta] = self.versiones.get(ruta, 0) + 1
+            self.pendientes[ruta] = (v, texto)
+            while ruta in self.escribiendo:
+                if not esperar:
+                    return  # el hilo que ya escribe este archivo se lleva esta versión
+                self.cond.wait()
+                procesada, error = self.resultados.get(ruta, (0, None))
+                if procesada >= v:
+                    if error is not None:
+                        raise error
+                    return
+            # nadie escribe (o el escritor anterior falló antes de llegar aquí): escribe este hilo
+            self.escribiendo.add(ruta)
+        try:
+            while True:
+                with self.cond:
+                    pendiente = self.pendientes.pop(ruta, None)
+                    if pendiente is None:
+                        self.escribiendo.discard(ruta)
+                        self.cond.notify_all()
+                        return
+                version, texto = pendiente
+                h = hash(texto)
+                previo = self.ultimo.get(ruta)
+                if not (previo and previo[0] == h and self._mtime(ruta) == previo[1]):
+                    try:
+                        self._escribir(ruta, texto)
+                    except BaseException as e:
+                        with self.cond:
+                            self.resultados[ruta] = (version, e)
+                        raise
+                    self.ultimo[ruta] = (h, self._mtime(ruta))
+                with self.cond:
+                    self.resultados[ruta] = (version, None)
+                    self.cond.notify_all()
+        except BaseException:
+            with self.cond:
+                self.escribiendo.discard(ruta)
+                self.cond.notify_all()
+            raise
+
+    @staticmethod
+    def _mtime(ruta):
+        try:
+            return os.stat(ruta).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _escribir(ruta, texto):
+        carpeta = os.path.dirname(os.path.abspath(ruta))
+        with _BloqueoArchivo(ruta):
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(ruta) + ".", suffix=".tmp", dir=carpeta)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(texto)
+                    f.flush()
+                    os.fsync(f.fileno())
+                for intento in range(5):
+                    try:
+                        os.replace(tmp, ruta)
+                        break
+                    except PermissionError:
+                        # Windows: otro proceso (antivirus, Excel) tiene el archivo abierto un instante
+                        if intento == 4:
+                            raise
+                        time.sleep(0.1)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+        if hasattr(os, "O_DIRECTORY"):
+            dfd = os.open(carpeta, os.O_DIRECTORY)
+            try:
+                os.fsync(dfd)
+            finally:
+                os.close(dfd)
+
+PERSISTENCIA = PersistenciaJSON()
+
+def guardar_json(ruta, datos, esperar=False, **opciones_json):
+    PERSISTENCIA.guardar(ruta, datos, esperar=esperar, **opciones_json)
+
+def apartar_corrupto(ruta, error):
+    """Un JSON ilegible se conserva como <archivo>.corrupto antes de que lo pise una escritura nueva."""
+    try:
+        os.replace(ruta, ruta + ".corrupto")
+        print(f"⚠️ {ruta} ilegible ({error}); se apartó como {ruta}.corrupto")
+    except OSError:
+        pass
+
 def cargar_config():
     if os.path.exists(ARCHIVO_CONFIG):
         try:
@@ -63,9 +303,10 @@ def cargar_config():
 
 def guardar_config(ip, sucursal):
     try:
-        data = {"ip": ip, "sucursal": sucursal}
-        with open(ARCHIVO_CONFIG, 'w') as f:
-            json.dump(data, f)
+        # conservar claves extra (p.ej. retencion_dias) que el usuario haya agregado
+        data = cargar_config()
+        data.update({"ip": ip, "sucursal": sucursal})
+        guardar_json(ARCHIVO_CONFIG, data)
     except:
         pass
 
@@ -80,22 +321,19 @@ def ensure_files_exist():
             ejemplo = {
                 "1": {"nombre": "Admin Ejemplo", "tipo": "empleado", "hora_entrada": "09:00", "hora_salida": "18:00"}
             }
-            with open(ARCHIVO_USUARIOS, 'w', encoding='utf-8') as f:
-                json.dump(ejemplo, f, indent=2, ensure_ascii=False)
+            guardar_json(ARCHIVO_USUARIOS, ejemplo, indent=2, ensure_ascii=False)
         except:
             pass
     # estados.json
     if not os.path.exists(ARCHIVO_ESTADOS):
         try:
-            with open(ARCHIVO_ESTADOS, 'w', encoding='utf-8') as f:
-                json.dump({}, f, indent=2, ensure_ascii=False)
+            guardar_json(ARCHIVO_ESTADOS, {}, indent=2, ensure_ascii=False)
         except:
             pass
     # config_app.json
     if not os.path.exists(ARCHIVO_CONFIG):
         try:
-            with open(ARCHIVO_CONFIG, 'w', encoding='utf-8') as f:
-                json.dump({"ip": "192.168.1.201", "sucursal": "Matriz"}, f, indent=2)
+            guardar_json(ARCHIVO_CONFIG, {"ip": "192.168.1.201", "sucursal": "Matriz"}, indent=2)
         except:
             pass
     # Reporte Excel: opcional, no lo creamos vacío aquí (se crea al guardar).
@@ -114,6 +352,9 @@ def cargar_usuarios():
         try:
             with open(ARCHIVO_USUARIOS, 'r', encoding='utf-8') as f:
                 return json.load(f)
+        except ValueError as e:
+            apartar_corrupto(ARCHIVO_USUARIOS, e)
+            return {}
         except Exception:
             return {}
     else:
@@ -121,28 +362,391 @@ def cargar_usuarios():
 
 def guardar_usuarios(usuarios):
     try:
-        with open(ARCHIVO_USUARIOS, 'w', encoding='utf-8') as f:
-            json.dump(usuarios, f, indent=2, ensure_ascii=False)
+        # esperar: quien llama (RepositorioUsuarios) se marca limpio al regresar
+        guardar_json(ARCHIVO_USUARIOS, usuarios, esperar=True, indent=2, ensure_ascii=False)
         return True
     except Exception as e:
         print("Error guardando usuarios:", e)
         return False
 
+def validar_hhmm(h):
+    if not h:
+        return True
+    try:
+        parts = h.split(":")
+        if len(parts) != 2:
+            return False
+        hh = int(parts[0])
+        mm = int(parts[1])
+        return 0 <= hh < 24 and 0 <= mm < 60
+    except:
+        return False
+
+def normalizar_texto(texto):
+    """Minúsculas y sin acentos: 'José Núñez' -> 'jose nunez'."""
+    texto = unicodedata.normalize("NFKD", str(texto or ""))
+    return "".join(ch for ch in texto if not unicodedata.combining(ch)).lower().strip()
+
+class RepositorioUsuarios:
+    """
+    usuarios_config.json en memoria con índices para el Gestor de Usuarios:
+      - por ID (el dict) y lista ordenada de IDs para buscar por prefijo
+      - por palabra del nombre normalizada, ordenada: [(palabra, uid)]
+      - por tipo: {tipo: {uid}}
+    Los cambios se acumulan (sucio) y se escriben en un solo guardar().
+    """
+
+    CAMPOS_CSV = ["id", "nombre", "tipo", "hora_entrada", "hora_salida"]
+
+    def __init__(self, archivo=ARCHIVO_USUARIOS):
+        self.archivo = archivo
+        self.usuarios = {}
+        self.ids = []
+        self.palabras = []
+        self.por_tipo = {}
+        self.sucio = False
+
+    def cargar(self):
+        self.usuarios = cargar_usuarios()
+        self.ids = sorted(self.usuarios)
+        self.palabras = sorted((p, uid) for uid, u in self.usuarios.items() for p in self._palabras(u))
+        self.por_tipo = {}
+        for uid, u in self.usuarios.items():
+            self.por_tipo.setdefault(u.get("tipo", "visitante"), set()).add(uid)
+        self.sucio = False
+        return self
+
+    @staticmethod
+    def _palabras(perfil):
+        return set(normalizar_texto(perfil.get("nombre", "")).split())
+
+    def __len__(self):
+        return len(self.usuarios)
+
+    def __contains__(self, uid):
+        return uid in self.usuarios
+
+    def obtener(self, uid):
+        return self.usuarios.get(uid)
+
+    def _desindexar(self, uid):
+        u = self.usuarios[uid]
+        for p in self._palabras(u):
+            i = bisect.bisect_left(self.palabras, (p, uid))
+            if i < len(self.palabras) and self.palabras[i] == (p, uid):
+                del self.palabras[i]
+        self.por_tipo.get(u.get("tipo", "visitante"), set()).discard(uid)
+
+    def poner(self, uid, perfil):
+        uid = str(uid).strip()
+        if uid in self.usuarios:
+            self._desindexar(uid)
+        else:
+            bisect.insort(self.ids, uid)
+        self.usuarios[uid] = perfil
+        for p in self._palabras(perfil):
+            bisect.insort(self.palabras, (p, uid))
+        self.por_tipo.setdefault(perfil.get("tipo", "visitante"), set()).add(uid)
+        self.sucio = True
+
+    def quitar(self, uid):
+        if uid not in self.usuarios:
+            return False
+        self._desindexar(uid)
+        del self.ids[bisect.bisect_left(self.ids, uid)]
+        del self.usuarios[uid]
+        self.sucio = True
+        return True
+
+    @staticmethod
+    def _prefijo(lista, prefijo, clave=lambda x: x):
+        """Elementos de una lista ordenada que empiezan con prefijo (búsqueda binaria)."""
+        i = bisect.bisect_left(lista, clave(prefijo))
+        while i < len(lista):
+            x = lista[i]
+            if not (x[0] if isinstance(x, tuple) else x).startswith(prefijo):
+                break
+            yield x
+            i += 1
+
+    def buscar(self, texto="", tipo=None, limite=None):
+        """
+        UIDs cuyo ID empieza con el texto o cuyo nombre tiene, para cada palabra
+        del texto, una palabra que empiece con ella ('jo nu' -> 'José Núñez').
+        """
+        consulta = normalizar_texto(texto).split()
+        if not consulta:
+            encontrados = set(self.usuarios)
+        else:
+            encontrados = None
+            for palabra in consulta:
+                uids = {uid for _, uid in self._prefijo(self.palabras, palabra, clave=lambda p: (p,))}
+                encontrados = uids if encontrados is None else encontrados & uids
+            if len(consulta) == 1:
+                encontrados |= set(self._prefijo(self.ids, texto.strip()))
+        if tipo:
+            encontrados &= self.por_tipo.get(tipo, set())
+        orden = sorted(encontrados, key=lambda u: (len(u), u))
+        return orden[:limite] if limite else orden
+
+    def guardar(self):
+        """Una sola escritura (atómica) con todos los cambios acumulados."""
+        if not self.sucio:
+            return True
+        if guardar_usuarios(self.usuarios):
+            self.sucio = False
+            return True
+        return False
+
+    def exportar_csv(self, ruta):
+        extras = sorted({k for u in self.usuarios.values() for k in u} - set(self.CAMPOS_CSV))
+        with open(ruta, 'w', newline='', encoding='utf-8-sig') as f:
+            w = csv.writer(f)
+            w.writerow(self.CAMPOS_CSV + extras)
+            for uid in sorted(self.usuarios, key=lambda u: (len(u), u)):
+                u = self.usuarios[uid]
+                w.writerow([uid] + [u.get(k, "") for k in self.CAMPOS_CSV[1:] + extras])
+        return len(self.usuarios)
+
+    def importar_csv(self, ruta):
+        """
+        Alta/actualización masiva (columnas como en exportar_csv; 'id' y 'nombre'
+        obligatorias). Regresa (nuevos, actualizados, [errores]); no guarda.
+        """
+        nuevos, actualizados, errores = 0, 0, []
+        with open(ruta, 'r', newline='', encoding='utf-8-sig') as f:
+            for n, fila in enumerate(csv.DictReader(f), start=2):
+                fila = {(k or "").strip().lower(): (v or "").strip() for k, v in fila.items()}
+                uid, nombre = fila.get("id", ""), fila.get("nombre", "")
+                if not uid or not nombre:
+                    errores.append(f"línea {n}: falta id o nombre")
+                    continue
+                if not (validar_hhmm(fila.get("hora_entrada")) and validar_hhmm(fila.get("hora_salida"))):
+                    errores.append(f"línea {n}: hora inválida (HH:MM)")
+                    continue
+                perfil = {"nombre": nombre, "tipo": fila.get("tipo") or "visitante"}
+                for k, v in fila.items():
+                    if k not in ("id", "nombre", "tipo") and v:
+                        perfil[k] = int(v) if k == "debounce_segundos" and v.isdigit() else v
+                if uid in self.usuarios:
+                    actualizados += 1
+                else:
+                    nuevos += 1
+                self.poner(uid, perfil)
+        return nuevos, actualizados, errores
+
+def huella(datos):
+    """Hash estable de un dict (orden de llaves irrelevante)."""
+    return hashlib.sha1(json.dumps(datos, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def diferencias_padron(mapa_reloj, usuarios):
+    """
+    Una pasada: padrón del reloj {uid: nombre} contra usuarios_config.
+      altas:     {uid: nombre} en el reloj y no en la configuración
+      renombres: {uid: (nombre_config, nombre_reloj)}
+      bajas:     [uid] configurados que ya no están en el reloj
+    """
+    altas, renombres = {}, {}
+    for uid, nombre in mapa_reloj.items():
+        u = usuarios.get(uid)
+        if u is None:
+            altas[uid] = nombre
+        elif nombre and u.get("nombre") != nombre:
+            renombres[uid] = (u.get("nombre"), nombre)
+    bajas = sorted((uid for uid in usuarios if uid not in mapa_reloj), key=lambda u: (len(u), u))
+    return {"altas": altas, "renombres": renombres, "bajas": bajas}
+
+def aplicar_padron(repo, dif, altas=True, renombres=False, bajas=False):
+    """Aplica en bloque sobre un RepositorioUsuarios (sin guardar). Regresa cuántos cambios hizo."""
+    n = 0
+    if altas:
+        for uid, nombre in dif["altas"].items():
+            repo.poner(uid, {"nombre": nombre or f"Usuario {uid}", "tipo": "visitante"})
+            n += 1
+    if renombres:
+        for uid, (_, nombre) in dif["renombres"].items():
+            repo.poner(uid, dict(repo.obtener(uid), nombre=nombre))
+            n += 1
+    if bajas:
+        for uid in dif["bajas"]:
+            n += repo.quitar(uid)
+    return n
+
+class PadronReloj:
+    """
+    Huellas del padrón del reloj (get_users) y de usuarios_config.json. El ciclo
+    solo re-sincroniza nombres cuando alguna cambia; la última foto del reloj se
+    guarda para conciliar desde la GUI sin volver a conectarse.
+    """
+
+    def __init__(self, archivo=ARCHIVO_PADRON):
+        self.archivo = archivo
+        self.hash_reloj = self.hash_config = None
+        self.reloj = {}
+        self.tomado = None
+        try:
+            with open(archivo, 'r', encoding='utf-8') as f:
+                d = json.load(f)
+            self.reloj, self.tomado, self.hash_reloj = d.get("reloj", {}), d.get("tomado"), d.get("hash")
+        except Exception:
+            pass
+
+    def cambio(self, mapa_reloj, usuarios):
+        """True si el padrón o la configuración cambiaron desde la última llamada."""
+        h_reloj, h_config = huella(mapa_reloj), huella(usuarios)
+        cambio = h_reloj != self.hash_reloj or h_config != self.hash_config
+        if h_reloj != self.hash_reloj:
+            self.reloj = dict(mapa_reloj)
+            self.tomado = datetime.datetime.now().strftime(FORMATO_FECHA)
+            self.hash_reloj = h_reloj
+            try:
+                guardar_json(self.archivo, {"hash": h_reloj, "tomado": self.tomado, "reloj": self.reloj}, ensure_ascii=False)
+            except Exception as e:
+                print("Error guardando padrón del reloj:", e)
+        self.hash_config = h_config
+        return cambio
+
+PADRON = PadronReloj()
+
+# ==========================================
+# 🧱 REGISTRO COMPACTO DE ESTADOS
+# ==========================================
+class _Catalogo:
+    """Internado de cadenas repetidas (tipo, estado, sucursal) como enteros pequeños."""
+
+    def __init__(self, valores=()):
+        self.valores = []
+        self.codigos = {}
+        for v in valores:
+            self.codigo(v)
+
+    def codigo(self, valor):
+        if valor is None:
+            return None
+        c = self.codigos.get(valor)
+        if c is None:
+            c = self.codigos[valor] = len(self.valores)
+            self.valores.append(sys.intern(valor) if isinstance(valor, str) else valor)
+        return c
+
+    def valor(self, codigo):
+        return None if codigo is None else self.valores[codigo]
+
+TIPOS = _Catalogo(("empleado", "visitante", "recluso", "externo"))
+MODOS = _Catalogo(("Entrada", "Salida"))
+SUCURSALES = _Catalogo()
+
+class EstadoUsuario:
+    """
+    Último estado de un UID en ~260-280 bytes (contra ~660 del dict anterior; ver
+    bench_estados.py): slots en lugar de dict, tipo/estado/sucursal como códigos de
+    catálogo y ultima_actividad como epoch (int). Se comporta como el dict de antes
+    (get, [], keys) para que el resto del código no cambie, y a_dict() produce el
+    mismo formato JSON de estados.json, incluidos los campos guardados como null.
+    """
+    __slots__ = ("nombre", "tipo_c", "estado_c", "ts", "alerta", "sucursal_c", "extra")
+    CAMPOS = ("nombre", "tipo", "ultimo_estado", "ultima_actividad", "alerta", "sucursal")
+
+    def __init__(self, nombre=None, tipo=None, ultimo_estado=None, ultima_actividad=None, alerta=False, sucursal=None):
+        self.nombre = nombre
+        self.tipo_c = TIPOS.codigo(tipo)
+        self.estado_c = MODOS.codigo(ultimo_estado)
+        self.ts = a_epoch(ultima_actividad) if ultima_actividad else None
+        self.alerta = bool(alerta)
+        self.sucursal_c = SUCURSALES.codigo(sucursal) if sucursal else None
+        self.extra = None
+
+    @classmethod
+    def desde_dict(cls, d):
+        r = cls()
+        for k, v in d.items():
+            if v is None and k in cls.CAMPOS:
+                # null explícito ("tipo": null): se recuerda para devolverlo igual
+                r.extra = r.extra or {}
+                r.extra[k] = None
+                continue
+            try:
+                r[k] = v
+            except ValueError:
+                # fecha ilegible: se conserva tal cual para no perder datos
+                r.extra = r.extra or {}
+                r.extra[k] = v
+        return r
+
+    def __getitem__(self, k):
+        if k == "nombre":
+            v = self.nombre
+        elif k == "tipo":
+            v = TIPOS.valor(self.tipo_c)
+        elif k == "ultimo_estado":
+            v = MODOS.valor(self.estado_c)
+        elif k == "ultima_actividad":
+            v = desde_epoch(self.ts) if self.ts is not None else None
+        elif k == "alerta":
+            return self.alerta
+        elif k == "sucursal":
+            v = SUCURSALES.valor(self.sucursal_c)
+        else:
+            v = None
+        if v is None:
+            if self.extra and k in self.extra:
+                return self.extra[k]
+            raise KeyError(k)
+        return v
+
+    def __setitem__(self, k, v):
+        if k == "nombre":
+            self.nombre = v
+        elif k == "tipo":
+            self.tipo_c = TIPOS.codigo(v)
+        elif k == "ultimo_estado":
+            self.estado_c = MODOS.codigo(v)
+        elif k == "ultima_actividad":
+            self.ts = a_epoch(v) if v else None
+        elif k == "alerta":
+            self.alerta = bool(v)
+        elif k == "sucursal":
+            self.sucursal_c = SUCURSALES.codigo(v) if v else None
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[k] = v
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    def __contains__(self, k):
+        return self.get(k) is not None
+
+    def keys(self):
+        extra = self.extra or {}
+        return [k for k in self.CAMPOS if k in self or k in extra] + [k for k in extra if k not in self.CAMPOS]
+
+    def a_dict(self):
+        return {k: self[k] for k in self.keys()}
+
 def cargar_estados():
     global ESTADOS_USUARIOS
+    crudo = {}
     if os.path.exists(ARCHIVO_ESTADOS):
         try:
             with open(ARCHIVO_ESTADOS, 'r', encoding='utf-8') as f:
-                ESTADOS_USUARIOS = json.load(f)
+                crudo = json.load(f)
+        except ValueError as e:
+            apartar_corrupto(ARCHIVO_ESTADOS, e)
+            crudo = {}
         except:
-            ESTADOS_USUARIOS = {}
-    else:
-        ESTADOS_USUARIOS = {}
+            crudo = {}
+    ESTADOS_USUARIOS = {sys.intern(str(uid)): EstadoUsuario.desde_dict(d) for uid, d in crudo.items()}
+    ESTANCIAS.cargar(ESTADOS_USUARIOS)
+    OCUPACION.reconstruir(ESTADOS_USUARIOS)
 
 def guardar_estados():
     try:
-        with open(ARCHIVO_ESTADOS, 'w', encoding='utf-8') as f:
-            json.dump(ESTADOS_USUARIOS, f, indent=2, ensure_ascii=False)
+        guardar_json(ARCHIVO_ESTADOS, {uid: r.a_dict() for uid, r in list(ESTADOS_USUARIOS.items())}, indent=2, ensure_ascii=False)
     except Exception as e:
         print("Error guardando estados:", e)
 
@@ -161,28 +765,86 @@ def sync_nombres_con_usuarios(usuarios_local):
                 ESTADOS_USUARIOS[uid]["nombre"] = nombre_conf
                 updated = True
             if tipo_conf and ESTADOS_USUARIOS[uid].get("tipo") != tipo_conf:
+                anterior = dict(ESTADOS_USUARIOS[uid])
                 ESTADOS_USUARIOS[uid]["tipo"] = tipo_conf
+                OCUPACION.actualizar(anterior, ESTADOS_USUARIOS[uid])
                 updated = True
             if updated:
                 changed = True
+                HOJA_ESTADO.marcar(uid)
     if changed:
         guardar_estados()
 
 # ==========================================
 # 🧠 LÓGICA ANTI-DUPLICADOS (NUEVO)
 # ==========================================
+class HistorialParticionado:
+    """
+    Llaves anti-duplicados "uid_YYYY-MM-DD HH:MM:SS". Cada mes se carga de su
+    partición local solo la primera vez que aparece una checada de ese mes, así
+    el arranque no lee años de historia que el reloj ya no tiene. Otras fuentes de
+    llaves por mes (la auditoría del debounce) se leen junto con la partición.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.llaves = set()
+        self.meses_cargados = set()
+        self.fuentes = []   # callables mes -> llaves de ese mes
+
+    def agregar_fuente(self, fuente):
+        """Registra fuente(mes) -> llaves; se aplica ya a los meses cargados y después a cada mes nuevo."""
+        with self.lock:
+            self.fuentes.append(fuente)
+            for mes in self.meses_cargados:
+                self.llaves.update(fuente(mes))
+
+    @staticmethod
+    def mes_de(llave):
+        return llave.split("_", 1)[1][:7]
+
+    def cargar_mes(self, mes):
+        with self.lock:
+            if mes in self.meses_cargados:
+                return
+            self.meses_cargados.add(mes)
+            ruta = ruta_particion_local(mes)
+            if os.path.exists(ruta):
+                try:
+                    df = pd.read_excel(ruta, usecols=["ID", "Fecha"])
+                    self.llaves.update(f"{i}_{f}" for i, f in zip(df["ID"], df["Fecha"]))
+                except Exception as e:
+                    print(f"No se pudo leer partición {ruta}:", e)
+            for fuente in self.fuentes:
+                self.llaves.update(fuente(mes))
+
+    def __contains__(self, llave):
+        self.cargar_mes(self.mes_de(llave))
+        return llave in self.llaves
+
+    def add(self, llave):
+        self.cargar_mes(self.mes_de(llave))
+        with self.lock:
+            self.llaves.add(llave)
+
+    def update(self, llaves):
+        for llave in llaves:
+            self.add(llave)
+
+    def __len__(self):
+        return len(self.llaves)
+
+HISTORIAL_PROCESADO = HistorialParticionado()
+
 def cargar_historial_existente(log_func):
-    """ Lee el Excel local al inicio para saber qué ya tenemos """
-    global HISTORIAL_PROCESADO
-    if os.path.exists(ARCHIVO_EXCEL_LOCAL):
-        try:
-            df = pd.read_excel(ARCHIVO_EXCEL_LOCAL)
-            for index, row in df.iterrows():
-                llave = f"{row['ID']}_{row['Fecha']}"
-                HISTORIAL_PROCESADO.add(llave)
-            log_func(f"🧠 Memoria cargada: {len(HISTORIAL_PROCESADO)} registros previos ignorados.")
-        except Exception as e:
-            log_func(f"⚠️ No se pudo leer historial previo: {e}")
+    """ Prepara el anti-duplicados: migra el Excel único viejo y precarga el mes en curso """
+    migrar_excel_legado(log_func)
+    mes = datetime.date.today().strftime("%Y-%m")
+    HISTORIAL_PROCESADO.cargar_mes(mes)
+    # las repetidas colapsadas no están en el Excel: sin esto volverían a entrar tras reiniciar
+    DEBOUNCE.cargar(log_func)
+    log_func(f"🧠 Memoria cargada: {len(HISTORIAL_PROCESADO)} registros previos de {mes} "
+             f"({len(PARTICIONES.local)} meses en disco, se leen bajo demanda).")
 
 # ==========================================
 # 🧠 LÓGICA DE NEGOCIO (EL JUEZ)
@@ -232,38 +894,814 @@ def analizar_registro(uid, fecha, punch, usuarios_local):
 
     return modo, estado
 
-def actualizar_estado_usuario(uid, nombre, tipo, modo, fecha_str):
-    """ Actualiza ESTADOS_USUARIOS y persiste """
+def actualizar_estado_usuario(uid, nombre, tipo, modo, fecha_str, manual=False, sucursal=None, persistir=True):
+    """
+    Actualiza ESTADOS_USUARIOS y persiste (persistir=False: el llamador guarda al final del lote).
+    Una checada anterior a la última actividad guardada (backfill, reloj atrasado) no
+    toca estado ni ocupación y regresa False; DestinoEstados la empareja aparte con
+    ESTANCIAS.registrar_historica para que su estancia sí quede registrada.
+    """
     # nombre ya debe venir con preferencia a usuarios_config si aplica
-    ESTADOS_USUARIOS[uid] = {
-        "nombre": nombre,
-        "tipo": tipo,
-        "ultimo_estado": modo,
-        "ultima_actividad": fecha_str,
-        "alerta": ESTADOS_USUARIOS.get(uid, {}).get("alerta", False)
-    }
+    anterior = ESTADOS_USUARIOS.get(uid)
+    if anterior is not None and anterior.ts is not None and a_epoch(fecha_str) < anterior.ts:
+        return False
+    ESTADOS_USUARIOS[uid] = EstadoUsuario(
+        nombre=nombre,
+        tipo=tipo,
+        ultimo_estado=modo,
+        ultima_actividad=fecha_str,
+        alerta=(anterior or {}).get("alerta", False),
+        sucursal=sucursal or (anterior or {}).get("sucursal", "")
+    )
+    # contadores de ocupación: O(1) por checada
+    OCUPACION.actualizar(anterior, ESTADOS_USUARIOS[uid])
+    HOJA_ESTADO.marcar(uid)
+    if persistir:
+        guardar_estados()
+    # emparejar Entrada/Salida en estancias consultables por fecha
+    ESTANCIAS.registrar(uid, tipo, modo, fecha_str, manual=manual)
+    return True
+
+# ==========================================
+# 🗄️ ARCHIVO DE ESTADOS INACTIVOS (TTL)
+# ==========================================
+class ArchivoEstados:
+    """
+    Segmentos comprimidos (gzip, una línea JSON por UID) con los estados que ya
+    no necesitan estar en memoria. Cada corrida agrega un miembro gzip al segmento
+    del mes; indice.json guarda por UID [segmento, offset del miembro, offset de la
+    línea dentro del miembro], así buscar() descomprime solo hasta esa línea.
+    """
+
+    def __init__(self, carpeta):
+        self.carpeta = carpeta
+        self.lock = threading.Lock()
+        self._indice = None  # uid -> [segmento, miembro, posición] (o solo el segmento, formato anterior)
+
+    def _ruta(self, nombre):
+        return os.path.join(self.carpeta, nombre)
+
+    def indice(self):
+        if self._indice is None:
+            self._indice = {}
+            try:
+                with open(self._ruta("indice.json"), 'r', encoding='utf-8') as f:
+                    self._indice = json.load(f)
+            except Exception:
+                pass
+        return self._indice
+
+    def __len__(self):
+        with self.lock:
+            return len(self.indice())
+
+    def archivar(self, registros):
+        """registros: {uid: dict}. Agrega al segmento del mes actual y actualiza el índice."""
+        if not registros:
+            return
+        segmento = "estados_" + datetime.date.today().strftime("%Y%m") + ".jsonl.gz"
+        with self.lock:
+            os.makedirs(self.carpeta, exist_ok=True)
+            ubicaciones = {}
+            with open(self._ruta(segmento), 'ab') as crudo:
+                miembro = crudo.tell()
+                with gzip.GzipFile(fileobj=crudo, mode='wb') as f:
+                    pos = 0
+                    for uid, d in registros.items():
+                        linea = (json.dumps({"uid": uid, **d}, ensure_ascii=False) + "\n").encode('utf-8')
+                        f.write(linea)
+                        ubicaciones[uid] = [segmento, miembro, pos]
+                        pos += len(linea)
+            indice = self.indice()
+            indice.update(ubicaciones)
+            guardar_json(self._ruta("indice.json"), indice)
+
+    def buscar(self, uid):
+        """Último estado archivado de un UID (dict) o None."""
+        with self.lock:
+            ubicacion = self.indice().get(uid)
+            if not ubicacion:
+                return None
+            if not isinstance(ubicacion, str):
+                segmento, miembro, pos = ubicacion
+                try:
+                    with open(self._ruta(segmento), 'rb') as crudo:
+                        crudo.seek(miembro)
+                        with gzip.GzipFile(fileobj=crudo, mode='rb') as f:
+                            f.seek(pos)
+                            d = json.loads(f.readline().decode('utf-8'))
+                    return d if d.get("uid") == uid else None
+                except Exception as e:
+                    print("Error leyendo archivo de estados:", e)
+                    return None
+            # índice anterior (solo el segmento): se recorre el segmento completo
+            encontrado = None
+            try:
+                with gzip.open(self._ruta(ubicacion), 'rt', encoding='utf-8') as f:
+                    for linea in f:
+                        d = json.loads(linea)
+                        if d.get("uid") == uid:
+                            encontrado = d
+            except Exception as e:
+                print("Error leyendo archivo de estados:", e)
+            return encontrado
+
+ARCHIVO_INACTIVOS = ArchivoEstados(CARPETA_ARCHIVO_ESTADOS)
+
+def archivar_inactivos(log_func, dias=None):
+    """Mueve al archivo los no-empleados con Salida más vieja que 'dias'. Regresa cuántos movió."""
+    if dias is None:
+        dias = cargar_config().get("retencion_dias", RETENCION_DIAS_INACTIVOS)
+    try:
+        dias = int(dias)
+    except (TypeError, ValueError):
+        dias = RETENCION_DIAS_INACTIVOS
+    if dias <= 0:
+        return 0
+    limite = a_epoch(datetime.datetime.now()) - dias * 86400
+    salida_c = MODOS.codigo("Salida")
+    empleado_c = TIPOS.codigo("empleado")
+    viejos = {uid: info for uid, info in list(ESTADOS_USUARIOS.items())
+              if info.tipo_c != empleado_c and info.estado_c == salida_c
+              and info.ts is not None and info.ts < limite}
+    if not viejos:
+        return 0
+    try:
+        ARCHIVO_INACTIVOS.archivar({uid: info.a_dict() for uid, info in viejos.items()})
+    except Exception as e:
+        log_func(f"⚠️ No se pudo archivar estados inactivos: {e}")
+        return 0
+    for uid, info in viejos.items():
+        # solo si nadie lo actualizó mientras archivábamos
+        if ESTADOS_USUARIOS.get(uid) is info:
+            ESTADOS_USUARIOS.pop(uid, None)
+            # y fuera de los índices vivos: ocupación, estancia abierta, pestaña Estado_Actual
+            OCUPACION.actualizar(info, None)
+            ESTANCIAS.descartar_abierta(uid)
+            HOJA_ESTADO.olvidar(uid)
     guardar_estados()
+    log_func(f"🗄️ {len(viejos)} estados inactivos (> {dias} días) movidos al archivo.")
+    return len(viejos)
 
-def guardar_excel_local(datos):
+# ==========================================
+# 🕒 ESTANCIAS (Entrada/Salida emparejadas)
+# ==========================================
+class _NodoIntervalos:
+    """Nodo de un árbol de intervalos centrado (intervalos cerrados [inicio, fin])."""
+    __slots__ = ("centro", "por_inicio", "por_fin", "izq", "der")
+
+    def __init__(self, intervalos):
+        extremos = sorted(e for iv in intervalos for e in (iv[0], iv[1]))
+        self.centro = extremos[len(extremos) // 2]
+        izq, der, aqui = [], [], []
+        for iv in intervalos:
+            if iv[1] < self.centro:
+                izq.append(iv)
+            elif iv[0] > self.centro:
+                der.append(iv)
+            else:
+                aqui.append(iv)
+        self.por_inicio = sorted(aqui, key=lambda iv: iv[0])
+        self.por_fin = sorted(aqui, key=lambda iv: iv[1], reverse=True)
+        self.izq = _NodoIntervalos(izq) if izq else None
+        self.der = _NodoIntervalos(der) if der else None
+
+    def consultar(self, a, b, out):
+        """Agrega a out los intervalos que se traslapan con [a, b]."""
+        nodo = self
+        while nodo:
+            if b < nodo.centro:
+                for iv in nodo.por_inicio:
+                    if iv[0] > b:
+                        break
+                    out.append(iv)
+                nodo = nodo.izq
+            elif a > nodo.centro:
+                for iv in nodo.por_fin:
+                    if iv[1] < a:
+                        break
+                    out.append(iv)
+                nodo = nodo.der
+            else:
+                out.extend(nodo.por_inicio)
+                if nodo.izq:
+                    nodo.izq.consultar(a, b, out)
+                nodo = nodo.der
+
+class _PeriodoEstancias:
+    """Estancias cerradas que empiezan en un mes: árbol + buffer de las aún no indexadas."""
+    __slots__ = ("arbol", "indexadas", "pendientes", "desde", "hasta", "reconstruyendo")
+
+    def __init__(self):
+        self.arbol = None
+        self.indexadas = []
+        self.pendientes = []
+        self.desde = self.hasta = None
+        self.reconstruyendo = False
+
+class IndiceEstancias:
+    """
+    Empareja Entrada/Salida por UID y guarda cada estancia como intervalo
+    (inicio, fin, uid, tipo, manual) en epoch. Las estancias cerradas se agrupan
+    por mes de inicio con un árbol de intervalos por mes: una consulta solo baja
+    a los meses cuyo rango la toca, O(log n + k) en cada uno. Las nuevas se
+    acumulan en el buffer de su mes y, al llenarse, solo ese árbol se reconstruye,
+    en un hilo aparte (se arma fuera del candado y se intercambia al final), así
+    el colector nunca espera una reconstrucción.
+    Las estancias abiertas (gente dentro ahora) viven aparte en self.abiertas,
+    con una lista ordenada por inicio para responder "dentro en T" por bisect.
+    """
+    MAX_PENDIENTES = 512
+
+    def __init__(self, archivo=None):
+        self.archivo = archivo
+        self.lock = threading.Lock()
+        self.abiertas = {}          # uid -> (inicio, tipo)
+        self._abiertas_orden = []   # [(inicio, uid)] ordenada
+        self.por_uid = {}           # uid -> [intervalos ordenados por inicio]
+        self.periodos = {}          # "YYYY-MM" -> _PeriodoEstancias
+        self.salidas_huerfanas = 0
+
+    def __len__(self):
+        return sum(len(p.indexadas) + len(p.pendientes) for p in list(self.periodos.values()))
+
+    # --- carga / persistencia ---
+    def cargar(self, estados):
+        """Lee estancias cerradas del archivo y abre las de quien sigue 'Entrada' en estados."""
+        with self.lock:
+            self.abiertas.clear()
+            self._abiertas_orden = []
+            self.por_uid.clear()
+            self.periodos = {}
+            if self.archivo and os.path.exists(self.archivo):
+                try:
+                    with open(self.archivo, 'r', encoding='utf-8') as f:
+                        for linea in f:
+                            linea = linea.strip()
+                            if not linea:
+                                continue
+                            try:
+                                d = json.loads(linea)
+                                self._agregar((d["inicio"], d["fin"], str(d["uid"]), d.get("tipo", ""), d.get("manual", False)),
+                                              diferir=False)
+                            except Exception:
+                                continue
+                except Exception as e:
+                    print("Error leyendo estancias:", e)
+            for uid, info in estados.items():
+                if info.get("ultimo_estado") == "Entrada" and info.get("ultima_actividad"):
+                    try:
+                        self.abiertas[uid] = (a_epoch(info["ultima_actividad"]), info.get("tipo", ""))
+                    except Exception:
+                        pass
+            self._abiertas_orden = sorted((ini, uid) for uid, (ini, _) in self.abiertas.items())
+            # arranque: todos los árboles de una vez, sin hilos
+            for p in self.periodos.values():
+                p.indexadas, p.pendientes = p.pendientes, []
+                p.arbol = _NodoIntervalos(p.indexadas) if p.indexadas else None
+
+    def _persistir(self, iv):
+        if not self.archivo:
+            return
+        try:
+            with open(self.archivo, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"uid": iv[2], "tipo": iv[3], "inicio": iv[0], "fin": iv[1], "manual": iv[4]}) + "\n")
+        except Exception as e:
+            print("Error guardando estancia:", e)
+
+    # --- inserción ---
+    def _agregar(self, iv, diferir=True):
+        lista = self.por_uid.setdefault(iv[2], [])
+        if not lista or lista[-1][0] <= iv[0]:
+            lista.append(iv)
+        else:
+            bisect.insort(lista, iv)
+        mes = desde_epoch(iv[0])[:7]
+        p = self.periodos.get(mes)
+        if p is None:
+            p = self.periodos[mes] = _PeriodoEstancias()
+            p.desde, p.hasta = iv[0], iv[1]
+        p.desde, p.hasta = min(p.desde, iv[0]), max(p.hasta, iv[1])
+        p.pendientes.append(iv)
+        if diferir and len(p.pendientes) >= self.MAX_PENDIENTES and not p.reconstruyendo:
+            p.reconstruyendo = True
+            threading.Thread(target=self._reconstruir, args=(p,), daemon=True).start()
+
+    def _reconstruir(self, p):
+        """Rearma el árbol de un mes fuera del candado y lo intercambia al terminar."""
+        try:
+            with self.lock:
+                intervalos = p.indexadas + p.pendientes
+                n = len(p.pendientes)
+            arbol = _NodoIntervalos(intervalos)
+            with self.lock:
+                p.arbol, p.indexadas = arbol, intervalos
+                del p.pendientes[:n]
+        except Exception as e:
+            print("Error reindexando estancias:", e)
+        finally:
+            p.reconstruyendo = False
+
+    def _abrir(self, uid, t, tipo):
+        self.abiertas[uid] = (t, tipo)
+        bisect.insort(self._abiertas_orden, (t, uid))
+
+    def _cerrar(self, uid):
+        ini, tipo = self.abiertas.pop(uid)
+        i = bisect.bisect_left(self._abiertas_orden, (ini, uid))
+        if i < len(self._abiertas_orden) and self._abiertas_orden[i] == (ini, uid):
+            del self._abiertas_orden[i]
+        return ini, tipo
+
+    def registrar(self, uid, tipo, modo, fecha, manual=False):
+        """Procesa una checada. Entrada abre estancia; Salida cierra la abierta (si hay)."""
+        t = a_epoch(fecha)
+        with self.lock:
+            if modo == "Entrada":
+                # doble Entrada: se conserva la primera (la persona sigue dentro)
+                if uid not in self.abiertas:
+                    self._abrir(uid, t, tipo)
+                return None
+            abierta = self.abiertas.get(uid)
+            if abierta is None or t < abierta[0]:
+                # Salida sin estancia abierta, o anterior a su inicio (checada atrasada
+                # o de backfill): la persona sigue dentro, la estancia no se toca
+                self.salidas_huerfanas += 1
+                return None
+            self._cerrar(uid)
+            iv = (abierta[0], t, uid, tipo or abierta[1], manual)
+            self._agregar(iv)
+        self._persistir(iv)
+        return iv
+
+    def descartar_abierta(self, uid):
+        """Quita la estancia abierta de un UID sin cerrarla (su estado salió de memoria)."""
+        with self.lock:
+            if uid in self.abiertas:
+                self._cerrar(uid)
+
+    def registrar_historica(self, abiertas, uid, tipo, modo, fecha, manual=False):
+        """
+        Como registrar(), para checadas más viejas que el estado vivo (backfill):
+        se emparejan entre sí con su propio mapa de abiertas (el del llamador, que
+        las pasa en orden cronológico) y solo las estancias cerradas entran al índice.
+        """
+        t = a_epoch(fecha)
+        if modo == "Entrada":
+            abiertas.setdefault(uid, (t, tipo))
+            return None
+        abierta = abiertas.get(uid)
+        if abierta is None or t < abierta[0]:
+            with self.lock:
+                self.salidas_huerfanas += 1
+            return None
+        del abiertas[uid]
+        iv = (abierta[0], t, uid, tipo or abierta[1], manual)
+        with self.lock:
+            self._agregar(iv)
+        self._persistir(iv)
+        return iv
+
+    # --- consultas ---
+    def _traslapes(self, a, b):
+        out = []
+        for p in self.periodos.values():
+            if p.desde <= b and p.hasta >= a:
+                if p.arbol:
+                    p.arbol.consultar(a, b, out)
+                out.extend(iv for iv in p.pendientes if iv[0] <= b and iv[1] >= a)
+        return out
+
+    def _abiertas_antes(self, limite):
+        """Abiertas con inicio < limite (bisect sobre la lista ordenada)."""
+        i = bisect.bisect_left(self._abiertas_orden, (limite,))
+        return [(uid, ini, None, self.abiertas[uid][1]) for ini, uid in self._abiertas_orden[:i]]
+
+    def dentro_en(self, momento):
+        """UIDs que estaban dentro en 'momento' (datetime o str) -> [(uid, inicio, fin|None, tipo)]."""
+        t = a_epoch(momento)
+        with self.lock:
+            res = [(iv[2], iv[0], iv[1], iv[3]) for iv in self._traslapes(t, t) if iv[0] <= t < iv[1]]
+            res.extend(self._abiertas_antes(t + 1))
+        return res
+
+    def traslapes(self, desde, hasta):
+        """Estancias que se traslapan con [desde, hasta) -> [(uid, inicio, fin|None, tipo)]."""
+        a, b = a_epoch(desde), a_epoch(hasta)
+        with self.lock:
+            res = [(iv[2], iv[0], iv[1], iv[3]) for iv in self._traslapes(a, b) if iv[0] < b and iv[1] > a]
+            res.extend(self._abiertas_antes(b))
+        return res
+
+    def estancias_de(self, uid):
+        """Estancias cerradas de un UID (ordenadas) más la abierta, si existe."""
+        with self.lock:
+            res = [(iv[0], iv[1], iv[4]) for iv in self.por_uid.get(uid, [])]
+            if uid in self.abiertas:
+                res.append((self.abiertas[uid][0], None, False))
+        return res
+
+    def duracion_total(self, uid, ahora=None):
+        """Segundos totales dentro del sitio (la estancia abierta cuenta hasta 'ahora')."""
+        fin_abierta = a_epoch(ahora or datetime.datetime.now())
+        return sum((fin if fin is not None else fin_abierta) - ini for ini, fin, _ in self.estancias_de(uid))
+
+ESTANCIAS = IndiceEstancias(ARCHIVO_ESTANCIAS)
+
+# ==========================================
+# 📊 OCUPACIÓN EN VIVO (contadores incrementales)
+# ==========================================
+class ContadorOcupacion:
+    """
+    Cuántas personas hay dentro por (tipo, sucursal). Se mantiene con cada
+    cambio de estado (O(1)) y se reconcilia periódicamente contra ESTADOS_USUARIOS.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conteos = {}   # (tipo, sucursal) -> personas dentro
+        self.total = 0
+
+    @staticmethod
+    def _llave(info):
+        if not info or info.get("ultimo_estado") != "Entrada":
+            return None
+        return (info.get("tipo") or "visitante", info.get("sucursal") or "")
+
+    def _sumar(self, llave, delta):
+        n = self.conteos.get(llave, 0) + delta
+        if n > 0:
+            self.conteos[llave] = n
+        else:
+            self.conteos.pop(llave, None)
+        self.total += delta
+
+    def actualizar(self, anterior, nuevo):
+        """Aplica la transición de estado de un UID (anterior/nuevo son dicts de ESTADOS_USUARIOS o None)."""
+        antes, despues = self._llave(anterior), self._llave(nuevo)
+        if antes == despues:
+            return
+        with self.lock:
+            if antes:
+                self._sumar(antes, -1)
+            if despues:
+                self._sumar(despues, +1)
+
+    def _calcular(self, estados):
+        conteos = {}
+        for info in list(estados.values()):
+            llave = self._llave(info)
+            if llave:
+                conteos[llave] = conteos.get(llave, 0) + 1
+        return conteos
+
+    def reconstruir(self, estados):
+        conteos = self._calcular(estados)
+        with self.lock:
+            self.conteos = conteos
+            self.total = sum(conteos.values())
+
+    def reconciliar(self, estados):
+        """Recalcula desde cero; regresa True si los contadores incrementales se habían desviado."""
+        conteos = self._calcular(estados)
+        with self.lock:
+            desviado = conteos != self.conteos
+            self.conteos = conteos
+            self.total = sum(conteos.values())
+        return desviado
+
+    def por_tipo(self):
+        res = {}
+        with self.lock:
+            for (tipo, _), n in self.conteos.items():
+                res[tipo] = res.get(tipo, 0) + n
+        return res
+
+    def resumen(self):
+        """Snapshot para GUI/métricas: {"total", "por_tipo", "por_sucursal": {sucursal: {tipo: n}}}."""
+        with self.lock:
+            conteos = dict(self.conteos)
+            total = self.total
+        por_tipo, por_sucursal = {}, {}
+        for (tipo, suc), n in conteos.items():
+            por_tipo[tipo] = por_tipo.get(tipo, 0) + n
+            por_sucursal.setdefault(suc, {})[tipo] = n
+        return {"total": total, "por_tipo": por_tipo, "por_sucursal": por_sucursal}
+
+OCUPACION = ContadorOcupacion()
+
+def reconciliador_ocupacion(log_func, stop_event):
+    """Hilo de fondo: cada OCUPACION_RECONCILIAR_SECONDS compara contadores con el estado completo."""
+    while not stop_event.wait(OCUPACION_RECONCILIAR_SECONDS):
+        try:
+            if OCUPACION.reconciliar(ESTADOS_USUARIOS):
+                log_func("🔁 Contadores de ocupación corregidos tras reconciliación.")
+        except Exception as e:
+            try:
+                log_func(f"Reconciliación error: {e}")
+            except:
+                print("Reconciliación error:", e)
+
+# ==========================================
+# 🗓️ PARTICIONES MENSUALES (Excel local y nube)
+# ==========================================
+COLUMNAS_EXCEL = ["ID", "Nombre", "Fecha", "Modo", "Estado", "Sucursal", "Tipo", "Ultimo_Estado", "Ultima_Actividad"]
+ENCABEZADO_NUBE = ["ID", "Nombre", "Fecha y Hora", "Evento", "Análisis", "Sucursal", "Tipo", "Ultimo_Estado", "Ultima_Actividad"]
+
+def ruta_particion_local(mes):
+    base, ext = os.path.splitext(ARCHIVO_EXCEL_LOCAL)
+    return f"{base}_{mes}{ext}"
+
+def agrupar_por_mes(filas, col_fecha=2):
+    grupos = {}
+    for fila in filas:
+        grupos.setdefault(str(fila[col_fecha])[:7], []).append(fila)
+    return grupos
+
+class IndiceParticiones:
+    """
+    particiones.json:
+      {"local": {"YYYY-MM": {"archivo", "filas", "desde", "hasta"}},
+       "nube":  {"YYYY-MM": {"libro", "pestana"}}}
+    """
+
+    def __init__(self, archivo=ARCHIVO_PARTICIONES):
+        self.archivo = archivo
+        self.lock = threading.Lock()
+        self.local, self.nube = {}, {}
+        try:
+            with open(archivo, 'r', encoding='utf-8') as f:
+                d = json.load(f)
+            self.local, self.nube = d.get("local", {}), d.get("nube", {})
+        except Exception:
+            pass
+
+    def guardar(self):
+        with self.lock:
+            d = {"local": self.local, "nube": self.nube}
+        try:
+            guardar_json(self.archivo, d, indent=2, ensure_ascii=False)
+        except Exception as e:
+            print("Error guardando índice de particiones:", e)
+
+    def registrar_local(self, mes, filas_nuevas, desde, hasta):
+        with self.lock:
+            p = self.local.setdefault(mes, {"archivo": ruta_particion_local(mes), "filas": 0, "desde": desde, "hasta": hasta})
+            p["filas"] += filas_nuevas
+            p["desde"] = min(p["desde"], desde)
+            p["hasta"] = max(p["hasta"], hasta)
+
+    def meses_entre(self, desde, hasta):
+        """Meses locales cuyo rango [desde, hasta] se traslapa con el pedido (fechas 'YYYY-MM-DD...')."""
+        with self.lock:
+            return sorted(m for m, p in self.local.items() if p["desde"] <= hasta and p["hasta"] >= desde)
+
+PARTICIONES = IndiceParticiones()
+
+def guardar_excel_local(datos, omitir_existentes=False):
     """
     Ahora columnas extendidas:
     ID, Nombre, Fecha, Modo, Estado, Sucursal, Tipo, Ultimo_Estado, Ultima_Actividad
     datos viene como [uid, nom, fecha_str, modo, est, sucursal, tipo, modo, fecha_str]
+    Cada fila va al archivo de su mes: solo se reescribe la partición del mes, vía
+    archivo temporal + os.replace (un corte nunca deja la partición a medias).
+    omitir_existentes=True descarta filas cuya llave "ID_Fecha" ya está en la partición.
     """
     try:
-        col = ["ID", "Nombre", "Fecha", "Modo", "Estado", "Sucursal", "Tipo", "Ultimo_Estado", "Ultima_Actividad"]
-        df_new = pd.DataFrame(datos, columns=col)
-        if os.path.exists(ARCHIVO_EXCEL_LOCAL):
-            df_old = pd.read_excel(ARCHIVO_EXCEL_LOCAL)
-            df_final = pd.concat([df_old, df_new], ignore_index=True)
-        else:
-            df_final = df_new
-        df_final.to_excel(ARCHIVO_EXCEL_LOCAL, index=False)
+        for mes, filas in agrupar_por_mes(datos).items():
+            ruta = ruta_particion_local(mes)
+            df_old = pd.read_excel(ruta) if os.path.exists(ruta) else None
+            if omitir_existentes and df_old is not None:
+                llaves = {f"{i}_{f}" for i, f in zip(df_old["ID"], df_old["Fecha"])}
+                filas = [f for f in filas if f"{f[0]}_{f[2]}" not in llaves]
+                if not filas:
+                    continue
+            df_new = pd.DataFrame(filas, columns=COLUMNAS_EXCEL)
+            df_final = df_new if df_old is None else pd.concat([df_old, df_new], ignore_index=True)
+            base, ext = os.path.splitext(ruta)
+            tmp = f"{base}.tmp{ext}"
+            df_final.to_excel(tmp, index=False)
+            os.replace(tmp, ruta)
+            fechas = [f[2] for f in filas]
+            PARTICIONES.registrar_local(mes, len(filas), min(fechas), max(fechas))
+        PARTICIONES.guardar()
         return True
     except Exception as e:
         print("Error guardando excel:", e)
         return False
 
+def migrar_excel_legado(log_func):
+    """
+    Parte el Reporte_Asistencia.xlsx único en particiones mensuales (una sola vez).
+    Si se corta antes de renombrar el legado, la siguiente corrida lo reintenta sin
+    duplicar: las filas que ya están en su partición se omiten.
+    """
+    if not os.path.exists(ARCHIVO_EXCEL_LOCAL):
+        return
+    try:
+        df = pd.read_excel(ARCHIVO_EXCEL_LOCAL)
+        df = df.reindex(columns=COLUMNAS_EXCEL).astype(object)
+        df = df.where(df.notna(), None)
+        df["Fecha"] = df["Fecha"].astype(str)
+        filas = df.values.tolist()
+        if filas and not guardar_excel_local(filas, omitir_existentes=True):
+            return
+        os.replace(ARCHIVO_EXCEL_LOCAL, ARCHIVO_EXCEL_LOCAL + ".migrado")
+        log_func(f"🗓️ {ARCHIVO_EXCEL_LOCAL} migrado a {len(PARTICIONES.local)} particiones mensuales.")
+    except Exception as e:
+        log_func(f"⚠️ No se pudo migrar {ARCHIVO_EXCEL_LOCAL}: {e}")
+
+class HojasMensuales:
+    """
+    Una pestaña por mes ("YYYY-MM") dentro de un libro por año
+    ("Asistencia_ZKTeco_YYYY"), así ni las pestañas ni los libros se acercan al
+    límite de celdas de Google. sheet1 del libro original queda como histórico.
+    Vive entre ciclos (HOJAS_MENSUALES) para no volver a buscar los libros cada vez.
+    """
+
+    def __init__(self, sheet=None):
+        self.sheet = sheet
+        self.cache = {}   # mes -> worksheet
+
+    def conectar(self, sheet):
+        """Usa 'sheet' (sheet1 del libro original); con otra conexión se vacía la caché."""
+        if sheet is not self.sheet:
+            self.sheet, self.cache = sheet, {}
+        return self
+
+    def hoja(self, mes):
+        ws = self.cache.get(mes)
+        if ws is not None:
+            return ws
+        client = self.sheet.spreadsheet.client
+        nombre_libro = f"{NOMBRE_HOJA_NUBE}_{mes[:4]}"
+        # solo se crea si Google confirma que no existe: un 429 o un corte de red se
+        # propaga (las filas van al outbox) en lugar de crear un libro duplicado
+        try:
+            libro = client.open(nombre_libro)
+            nuevo = False
+        except gspread.SpreadsheetNotFound:
+            libro = client.create(nombre_libro)
+            nuevo = True
+        try:
+            ws = libro.worksheet(mes)
+        except gspread.WorksheetNotFound:
+            if nuevo:
+                # el libro recién creado trae una hoja vacía: se reutiliza
+                ws = libro.sheet1
+                ws.update_title(mes)
+            else:
+                ws = libro.add_worksheet(title=mes, rows=1000, cols=len(ENCABEZADO_NUBE))
+            ws.append_row(ENCABEZADO_NUBE)
+        self.cache[mes] = ws
+        with PARTICIONES.lock:
+            PARTICIONES.nube[mes] = {"libro": nombre_libro, "pestana": mes}
+        PARTICIONES.guardar()
+        return ws
+
+    def agregar_filas(self, filas):
+        """append_rows por mes. Regresa las filas que NO se pudieron subir."""
+        pendientes = []
+        error = None
+        for mes, grupo in sorted(agrupar_por_mes(filas).items()):
+            if error is None:
+                try:
+                    self.hoja(mes).append_rows(grupo)
+                    continue
+                except Exception as e:
+                    error = e
+            pendientes.extend(grupo)
+        if error is not None:
+            raise ErrorSubidaParcial(error, pendientes)
+        return []
+
+HOJAS_MENSUALES = HojasMensuales()
+
+class ErrorSubidaParcial(Exception):
+    def __init__(self, causa, pendientes):
+        super().__init__(str(causa))
+        self.pendientes = pendientes
+
+# ==========================================
+# 🌱 ARRANQUE DEL ANTI-DUPLICADOS DESDE LA NUBE
+# ==========================================
+class ArranqueDesdeNube:
+    """
+    Si no hay reporte local (PC nueva o Excel borrado), HISTORIAL_PROCESADO
+    arrancaría vacío y el primer ciclo volvería a subir todo el log del reloj.
+    Aquí se leen solo las columnas ID y Fecha y Hora de cada pestaña, con un
+    values_batch_get por libro, y se siembran en el anti-duplicados. Corre en un
+    hilo: mientras tanto la ingesta local sigue y lo que va a la nube espera en
+    el outbox, que al final se filtra contra estas llaves.
+    Si rollups_diarios.json sobrevivió, las filas que ya están en la nube ya están
+    contadas: lo que llega mientras se siembra se difiere y al terminar solo se
+    suma lo que no estaba en la nube (ver diferir_rollup).
+    """
+
+    def __init__(self):
+        self.listo = threading.Event()
+        self.listo.set()
+        self.lock = threading.Lock()
+        self.llaves = set()
+        self.sembrar = True
+        self.rollups_previos = False
+        self.diferidas = []   # checadas retenidas del resumen diario mientras se siembra
+        self.llaves_rollups = set()
+
+    @staticmethod
+    def necesario():
+        return not PARTICIONES.local and not os.path.exists(ARCHIVO_EXCEL_LOCAL)
+
+    def iniciar(self, sheet, log_func, esperar=False, sembrar=True):
+        """sembrar=False: solo se filtra lo que se sube (el backfill sí quiere reconstruir el reporte local)."""
+        if not sheet or not self.necesario():
+            return False
+        self.sembrar = sembrar
+        self.rollups_previos = bool(ROLLUPS_DIARIOS)
+        self.llaves_rollups = set()
+        self.listo.clear()
+        if esperar:
+            self._correr(sheet, log_func)
+        else:
+            threading.Thread(target=self._correr, args=(sheet, log_func), daemon=True).start()
+        return True
+
+    @staticmethod
+    def _pestanas(sheet):
+        """[(libro, [títulos])]: el sheet1 original más los libros anuales conocidos o probables."""
+        libros = [(sheet.spreadsheet, [sheet.title])]
+        client = sheet.spreadsheet.client
+        anio = datetime.date.today().year
+        nombres = {p["libro"] for p in PARTICIONES.nube.values()}
+        nombres |= {f"{NOMBRE_HOJA_NUBE}_{anio}", f"{NOMBRE_HOJA_NUBE}_{anio - 1}"}
+        for nombre in sorted(nombres):
+            try:
+                libro = client.open(nombre)
+            except Exception:
+                continue
+            libros.append((libro, [ws.title for ws in libro.worksheets()]))
+        return libros
+
+    def _correr(self, sheet, log_func):
+        t0 = time.time()
+        try:
+            log_func("🌱 Sin reporte local: leyendo IDs/fechas existentes en la nube...")
+            for libro, titulos in self._pestanas(sheet):
+                rangos = []
+                for t in titulos:
+                    rangos += [f"'{t}'!A2:A", f"'{t}'!C2:C"]
+                resp = libro.values_batch_get(rangos)
+                valores = resp.get("valueRanges", [])
+                for ids, fechas in zip(valores[0::2], valores[1::2]):
+                    ids, fechas = ids.get("values", []), fechas.get("values", [])
+                    for fila_id, fila_fecha in zip(ids, fechas):
+                        if fila_id and fila_fecha:
+                            self.llaves.add(f"{fila_id[0]}_{fila_fecha[0]}")
+            if self.sembrar:
+                HISTORIAL_PROCESADO.update(self.llaves)
+            log_func(f"🌱 {len(self.llaves)} registros existentes en la nube leídos en {time.time() - t0:.1f}s.")
+        except Exception as e:
+            log_func(f"⚠️ No se pudo leer la nube para anti-duplicados: {e}")
+        finally:
+            with self.lock:
+                if self.rollups_previos:
+                    # sembrando, lo que está en la nube ya no pasa el anti-duplicados; sin
+                    # sembrar (backfill) sí pasa, y el outbox puede vaciar self.llaves: copia
+                    self.llaves_rollups = set() if self.sembrar else set(self.llaves)
+                    diferidas, self.diferidas = self.diferidas, []
+                    nuevas = [c for c in diferidas if f"{c.uid}_{c.fecha_str}" not in self.llaves]
+                    if diferidas:
+                        for c in nuevas:
+                            sumar_a_rollups(c)
+                        try:
+                            guardar_json(ARCHIVO_ROLLUPS, ROLLUPS_DIARIOS, esperar=True, indent=2, ensure_ascii=False)
+                        except Exception as e:
+                            log_func(f"⚠️ No se pudo guardar el resumen diario: {e}")
+                        log_func(f"🌱 Resumen diario: {len(diferidas) - len(nuevas)} checadas ya contadas se omitieron.")
+                self.listo.set()
+
+    def diferir_rollup(self, c):
+        """
+        ¿Debe DestinoRollups omitir esta checada por ahora? Mientras se siembra y ya
+        había resumen, se retiene (se decide al terminar); después, se omite si ya
+        estaba en la nube (el resumen sobreviviente ya la contó).
+        """
+        with self.lock:
+            if not self.rollups_previos:
+                return False
+            if not self.listo.is_set():
+                self.diferidas.append(c)
+                return True
+            return f"{c.uid}_{c.fecha_str}" in self.llaves_rollups
+
+    def filtrar(self, filas):
+        """Quita filas que ya estaban en la nube antes del arranque."""
+        if not self.llaves:
+            return filas
+        return [f for f in filas if f"{f[0]}_{f[2]}" not in self.llaves]
+
+ARRANQUE_NUBE = ArranqueDesdeNube()
+
 # ==========================================
 # 🔐 CONEXIÓN GOOGLE
 # ==========================================
@@ -287,8 +1725,7 @@ def conectar_google(log_func):
                 flow = InstalledAppFlow.from_client_secrets_file(client_secret_path, SCOPES)
                 creds = flow.run_local_server(port=0)
                 try:
-                    with open(token_path, 'w') as token:
-                        token.write(creds.to_json())
+                    guardar_json(token_path, json.loads(creds.to_json()))
                 except:
                     pass
             else:
@@ -317,32 +1754,155 @@ def conectar_google(log_func):
         log_func(f"Error Google: {e}")
         return None
 
+# ==========================================
+# 📋 PESTAÑA "ESTADO ACTUAL" EN LA NUBE
+# ==========================================
+def _letra_columna(n):
+    letras = ""
+    while n:
+        n, r = divmod(n - 1, 26)
+        letras = chr(65 + r) + letras
+    return letras
+
+class HojaEstadoActual:
+    """
+    Pestaña con una fila por UID (estado vigente). Los UIDs que cambian se marcan
+    y en cada ciclo se escriben todos con UN solo batch_update. La fila de cada UID
+    se guarda en estado_actual_filas.json para no tener que buscarla en la hoja.
+    """
+    ENCABEZADO = ["ID", "Nombre", "Tipo", "Sucursal", "Ultimo_Estado", "Ultima_Actividad", "Alerta"]
+    CRECIMIENTO = 1000  # filas que se agregan de golpe cuando la pestaña se llena
+
+    def __init__(self, archivo_filas=ARCHIVO_FILAS_ESTADO):
+        self.archivo_filas = archivo_filas
+        self.lock = threading.Lock()
+        self.sheet = None
+        self.ws = None
+        self.filas = {}
+        self.pendientes = set()
+
+    def marcar(self, uid):
+        with self.lock:
+            self.pendientes.add(uid)
+
+    def olvidar(self, uid):
+        """El UID salió de ESTADOS_USUARIOS (archivado): deja de estar pendiente; su fila queda como está."""
+        with self.lock:
+            self.pendientes.discard(uid)
+
+    def _guardar_filas(self):
+        try:
+            guardar_json(self.archivo_filas, self.filas)
+        except Exception as e:
+            print("Error guardando filas de Estado_Actual:", e)
+
+    def _reconstruir_filas(self):
+        """Una lectura de la columna A para rehacer el mapa UID -> fila."""
+        ids = self.ws.col_values(1)
+        self.filas = {str(v): i + 1 for i, v in enumerate(ids) if i > 0 and v != ""}
+        self._guardar_filas()
+
+    def conectar(self, sheet, log_func):
+        """sheet: la hoja de asistencia (sheet1). Crea/abre la pestaña hermana."""
+        if not sheet:
+            return False
+        self.sheet = sheet
+        try:
+            libro = sheet.spreadsheet
+            # solo se crea si Google confirma que no existe; cuota, red o auth caen
+            # al except de abajo y sincronizar() reintenta conectar en el siguiente ciclo
+            try:
+                self.ws = libro.worksheet(NOMBRE_PESTANA_ESTADO)
+            except gspread.WorksheetNotFound:
+                self.ws = libro.add_worksheet(title=NOMBRE_PESTANA_ESTADO, rows=self.CRECIMIENTO, cols=len(self.ENCABEZADO))
+                self.ws.update(values=[self.ENCABEZADO], range_name="A1")
+            try:
+                with open(self.archivo_filas, 'r', encoding='utf-8') as f:
+                    self.filas = json.load(f)
+            except Exception:
+                self._reconstruir_filas()
+            # primera vez: todos los estados conocidos van a la pestaña
+            with self.lock:
+                self.pendientes.update(uid for uid in list(ESTADOS_USUARIOS) if uid not in self.filas)
+            return True
+        except Exception as e:
+            self.ws = None
+            log_func(f"⚠️ Pestaña {NOMBRE_PESTANA_ESTADO} no disponible: {e}")
+            return False
+
+    def sincronizar(self, log_func):
+        """Escribe todos los UIDs pendientes en una sola llamada. Regresa cuántos escribió."""
+        if not self.ws and not (self.sheet and self.conectar(self.sheet, log_func)):
+            return 0
+        with self.lock:
+            lote, self.pendientes = self.pendientes, set()
+        if not lote:
+            return 0
+        ultima_col = _letra_columna(len(self.ENCABEZADO))
+        siguiente = max(self.filas.values(), default=1) + 1
+        nuevas = {}
+        datos = []
+        for uid in sorted(lote):
+            info = ESTADOS_USUARIOS.get(uid)
+            if info is None:
+                continue  # archivado: su última fila se queda como está
+            fila = self.filas.get(uid) or nuevas.get(uid)
+            if fila is None:
+                fila = nuevas[uid] = siguiente
+                siguiente += 1
+            datos.append({
+                "range": f"A{fila}:{ultima_col}{fila}",
+                "values": [[uid, info.get("nombre", ""), info.get("tipo", ""), info.get("sucursal", ""),
+                            info.get("ultimo_estado", ""), info.get("ultima_actividad", ""),
+                            "SI" if info.get("alerta") else "NO"]],
+            })
+        if not datos:
+            return 0
+        try:
+            if siguiente - 1 > self.ws.row_count:
+                faltan = siguiente - 1 - self.ws.row_count
+                self.ws.add_rows(max(faltan, self.CRECIMIENTO))
+            self.ws.batch_update(datos, value_input_option="RAW")
+        except Exception as e:
+            with self.lock:
+                self.pendientes |= lote  # se reintenta el siguiente ciclo
+            log_func(f"⚠️ Error actualizando {NOMBRE_PESTANA_ESTADO}: {e}")
+            return 0
+        if nuevas:
+            self.filas.update(nuevas)
+            self._guardar_filas()
+        return len(datos)
+
+HOJA_ESTADO = HojaEstadoActual()
+
 # ==========================================
 # 🔔 Monitor de visitantes (alertas)
 # ==========================================
 def monitor_visitantes(log_func, stop_event):
     """Revisa periódicamente visitantes/reclusos que estén 'Dentro' sin registrar salida > ALERTA_HORAS_SIN_SALIDA."""
+    ultima_retencion = time.time()
     while not stop_event.is_set():
         try:
-            now = datetime.datetime.now()
+            # retención: archivar inactivos con menos frecuencia que las alertas
+            if time.time() - ultima_retencion >= RETENCION_CHECK_SECONDS:
+                ultima_retencion = time.time()
+                archivar_inactivos(log_func)
+
+            ahora_ts = a_epoch(datetime.datetime.now())
+            entrada_c = MODOS.codigo("Entrada")
+            tipos_alerta = (TIPOS.codigo("visitante"), TIPOS.codigo("recluso"))
             changed = False
             for uid, info in list(ESTADOS_USUARIOS.items()):
-                tipo = info.get("tipo", "")
-                ultimo_estado = info.get("ultimo_estado", "")
-                ultima_actividad = info.get("ultima_actividad")
-                alerta = info.get("alerta", False)
-
-                if tipo in ("visitante", "recluso") and ultimo_estado == "Entrada" and ultima_actividad:
-                    try:
-                        dt = datetime.datetime.strptime(ultima_actividad, "%Y-%m-%d %H:%M:%S")
-                        diff_hours = (now - dt).total_seconds() / 3600.0
-                        if diff_hours >= ALERTA_HORAS_SIN_SALIDA and not alerta:
-                            # marcar alerta y loggear
-                            ESTADOS_USUARIOS[uid]["alerta"] = True
-                            changed = True
-                            log_func(f"🚨 ALERTA: UID {uid} ({info.get('nombre')}) sin salida registrada desde {ultima_actividad} ({diff_hours:.1f}h).")
-                    except Exception:
-                        pass
+                # comparaciones sobre códigos/epoch: sin parsear fechas en cada vuelta
+                if info.alerta or info.ts is None or info.estado_c != entrada_c or info.tipo_c not in tipos_alerta:
+                    continue
+                diff_hours = (ahora_ts - info.ts) / 3600.0
+                if diff_hours >= ALERTA_HORAS_SIN_SALIDA:
+                    # marcar alerta y loggear
+                    info.alerta = True
+                    HOJA_ESTADO.marcar(uid)
+                    changed = True
+                    log_func(f"🚨 ALERTA: UID {uid} ({info.get('nombre')}) sin salida registrada desde {info.get('ultima_actividad')} ({diff_hours:.1f}h).")
             if changed:
                 guardar_estados()
         except Exception as e:
@@ -354,6 +1914,1256 @@ def monitor_visitantes(log_func, stop_event):
         # dormir
         stop_event.wait(ALERTA_CHECK_SECONDS)
 
+# ==========================================
+# 🚰 PIPELINE DE INGESTA (etapas + destinos)
+# ==========================================
+class Checada:
+    """Una checada del reloj conforme avanza por el pipeline."""
+    __slots__ = ("uid", "fecha", "fecha_str", "punch", "nombre", "tipo", "modo", "estado", "sucursal")
+
+    def __init__(self, uid, fecha, punch, sucursal=""):
+        self.uid = uid
+        self.fecha = fecha
+        self.fecha_str = fecha.strftime(FORMATO_FECHA)
+        self.punch = punch
+        self.sucursal = sucursal
+        self.nombre = self.tipo = self.modo = self.estado = None
+
+    @classmethod
+    def clasificada(cls, uid, fecha_str, punch, nombre, tipo, modo, estado, sucursal=""):
+        """Checada ya enriquecida/clasificada (p.ej. por un proceso del backfill)."""
+        c = cls.__new__(cls)
+        c.uid, c.fecha, c.fecha_str, c.punch, c.sucursal = uid, None, fecha_str, punch, sucursal
+        c.nombre, c.tipo, c.modo, c.estado = nombre, tipo, modo, estado
+        return c
+
+    def fila(self):
+        """Columnas extendidas: ID, Nombre, Fecha, Modo, Estado, Sucursal, Tipo, Ultimo_Estado, Ultima_Actividad."""
+        return [self.uid, self.nombre, self.fecha_str, self.modo, self.estado, self.sucursal, self.tipo, self.modo, self.fecha_str]
+
+def fuente_dispositivo(att, sucursal):
+    """Convierte los registros de pyzk en Checadas, uno a la vez."""
+    for a in att:
+        yield Checada(str(a.user_id), a.timestamp, a.punch, sucursal)
+
+def etapa_dedupe(checadas):
+    """Deja pasar solo las checadas que no están en HISTORIAL_PROCESADO."""
+    for c in checadas:
+        llave_unica = f"{c.uid}_{c.fecha_str}"
+        if llave_unica in HISTORIAL_PROCESADO:
+            continue  # ¡YA EXISTE! Lo saltamos
+        HISTORIAL_PROCESADO.add(llave_unica)
+        yield c
+
+def etapa_enriquecer(mapa, usuarios_local):
+    """Nombre y tipo. PRIORIDAD: nombre del sistema (usuarios_config) > nombre del dispositivo."""
+    def etapa(checadas):
+        for c in checadas:
+            c.nombre = mapa.get(c.uid, "Desconocido")
+            c.tipo = "visitante"
+            user_info = usuarios_local.get(c.uid)
+            if user_info:
+                c.nombre = user_info.get("nombre") or c.nombre
+                c.tipo = user_info.get("tipo", "visitante")
+            yield c
+    return etapa
+
+def etapa_clasificar(usuarios_local):
+    """Modo (Entrada/Salida) y análisis (A tiempo, Retardo, ...) con analizar_registro."""
+    def etapa(checadas):
+        for c in checadas:
+            c.modo, c.estado = analizar_registro(c.uid, c.fecha, c.punch, usuarios_local)
+            yield c
+    return etapa
+
+class Debounce:
+    """
+    Colapsa toques repetidos: si un UID vuelve a checar el mismo modo dentro de su
+    ventana (contada desde la checada conservada), la repetida no sigue por el
+    pipeline. Cada colapso queda en debounce_auditoria_YYYY-MM.jsonl (mes de la
+    repetida) con la checada conservada y el número acumulado de repeticiones; así
+    cada archivo se acota a un mes y solo se lee cuando se carga ese mes.
+    """
+
+    def __init__(self, archivo=ARCHIVO_AUDITORIA_DEBOUNCE):
+        self.archivo = archivo
+        self.lock = threading.Lock()
+        self.ultima = {}     # uid -> [epoch conservada, modo, repeticiones, fecha_str conservada]
+        self.colapsadas = 0
+
+    def ruta_mes(self, mes):
+        base, ext = os.path.splitext(self.archivo)
+        return f"{base}_{mes}{ext}"
+
+    def cargar(self, log_func):
+        """
+        Registra la auditoría como fuente del anti-duplicados: las checadas colapsadas
+        de cada mes se agregan cuando HISTORIAL_PROCESADO carga ese mes.
+        """
+        self._partir_legado(log_func)
+        antes = len(HISTORIAL_PROCESADO)
+        HISTORIAL_PROCESADO.agregar_fuente(self.llaves_de_mes)
+        n = len(HISTORIAL_PROCESADO) - antes
+        if n:
+            log_func(f"🧠 {n} checadas repetidas previas ignoradas (debounce).")
+
+    def llaves_de_mes(self, mes):
+        ruta = self.ruta_mes(mes)
+        if not os.path.exists(ruta):
+            return []
+        llaves = []
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                for linea in f:
+                    try:
+                        d = json.loads(linea)
+                        llaves.append(f"{d['uid']}_{d['colapsada']}")
+                    except (ValueError, KeyError):
+                        continue
+        except Exception as e:
+            print(f"No se pudo leer auditoría de debounce {ruta}:", e)
+        return llaves
+
+    def _partir_legado(self, log_func):
+        """El archivo único de antes se reparte en archivos mensuales (una sola vez)."""
+        if not os.path.exists(self.archivo):
+            return
+        try:
+            with open(self.archivo, 'r', encoding='utf-8') as f:
+                registros = []
+                for linea in f:
+                    try:
+                        registros.append(json.loads(linea))
+                    except ValueError:
+                        continue
+            # si se corta aquí, la siguiente corrida repite líneas: son llaves, no cuentan doble
+            self._auditar(registros)
+            os.remove(self.archivo)
+            log_func(f"🗓️ {self.archivo} repartido en archivos mensuales ({len(registros)} registros).")
+        except Exception as e:
+            log_func(f"⚠️ No se pudo repartir la auditoría de debounce: {e}")
+
+    def _auditar(self, registros):
+        if not registros:
+            return
+        por_mes = {}
+        for r in registros:
+            por_mes.setdefault(str(r.get("colapsada", ""))[:7], []).append(r)
+        try:
+            for mes, grupo in por_mes.items():
+                with open(self.ruta_mes(mes), 'a', encoding='utf-8') as f:
+                    for r in grupo:
+                        f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        except Exception as e:
+            print("Error guardando auditoría de debounce:", e)
+
+    def etapa(self, usuarios_local):
+        try:
+            ventana_global = int(cargar_config().get("debounce_segundos", DEBOUNCE_SEGUNDOS))
+        except (TypeError, ValueError):
+            ventana_global = DEBOUNCE_SEGUNDOS
+
+        def etapa(checadas):
+            auditoria = []
+            try:
+                for c in checadas:
+                    ts = a_epoch(c.fecha_str)
+                    ventana = ventana_global
+                    try:
+                        ventana = int((usuarios_local.get(c.uid) or {}).get("debounce_segundos", ventana_global))
+                    except (TypeError, ValueError):
+                        pass
+                    with self.lock:
+                        previa = self.ultima.get(c.uid)
+                        if previa and previa[1] == c.modo and 0 <= ts - previa[0] <= ventana:
+                            previa[2] += 1
+                            self.colapsadas += 1
+                            auditoria.append({"uid": c.uid, "modo": c.modo, "conservada": previa[3],
+                                              "colapsada": c.fecha_str, "repeticiones": previa[2]})
+                            if len(auditoria) >= 100:
+                                self._auditar(auditoria)
+                                auditoria = []
+                            continue
+                        self.ultima[c.uid] = [ts, c.modo, 0, c.fecha_str]
+                    yield c
+            finally:
+                self._auditar(auditoria)
+        return etapa
+
+DEBOUNCE = Debounce()
+
+def en_lotes(iterable, tam):
+    lote = []
+    for x in iterable:
+        lote.append(x)
+        if len(lote) >= tam:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+class Pipeline:
+    """
+    fuente -> etapas (generadores) -> lotes de 'tam_lote' -> cada destino.
+    Es de tipo pull: la fuente solo produce el siguiente lote cuando todos los
+    destinos terminaron con el actual, así que un atraso grande del reloj nunca
+    tiene más de un lote vivo en las etapas. Los destinos que conviene escribir
+    de golpe (Excel mensual, paquetes) acumulan hasta MAX_FILAS_BUFFER_DESTINO
+    filas: la memoria queda acotada por esa constante, no por el atraso.
+    Un destino es cualquier objeto con procesar(lote) y, opcional, cerrar().
+    """
+
+    def __init__(self, etapas, destinos, tam_lote=TAM_LOTE_PIPELINE, log_func=print):
+        self.etapas = list(etapas)
+        self.destinos = list(destinos)
+        self.tam_lote = tam_lote
+        self.log_func = log_func
+
+    def ejecutar(self, fuente):
+        flujo = fuente
+        for etapa in self.etapas:
+            flujo = etapa(flujo)
+        total = 0
+        try:
+            for lote in en_lotes(flujo, self.tam_lote):
+                total += len(lote)
+                for destino in self.destinos:
+                    try:
+                        destino.procesar(lote)
+                    except Exception as e:
+                        self.log_func(f"⚠️ Error en destino {type(destino).__name__}: {e}")
+        finally:
+            for destino in self.destinos:
+                cerrar = getattr(destino, "cerrar", None)
+                if cerrar:
+                    try:
+                        cerrar()
+                    except Exception as e:
+                        self.log_func(f"⚠️ Error cerrando {type(destino).__name__}: {e}")
+        return total
+
+class DestinoEstados:
+    """
+    Actualiza ESTADOS_USUARIOS/estancias/ocupación y guarda estados.json una vez por lote.
+    Las checadas más viejas que el estado vivo (backfill) no tocan el estado, pero se
+    emparejan entre sí, en el orden del flujo, para que sus estancias queden consultables.
+    """
+
+    def __init__(self):
+        self.abiertas_historicas = {}   # uid -> (inicio, tipo), entre lotes del mismo flujo
+
+    def procesar(self, lote):
+        for c in lote:
+            if not actualizar_estado_usuario(c.uid, c.nombre, c.tipo, c.modo, c.fecha_str, sucursal=c.sucursal, persistir=False):
+                ESTANCIAS.registrar_historica(self.abiertas_historicas, c.uid, c.tipo, c.modo, c.fecha_str)
+        guardar_estados()
+
+class DestinoGUI:
+    """Agrega filas a la tabla (add_row_func muestra los datos actualizados desde ESTADOS_USUARIOS)."""
+
+    def __init__(self, add_row_func):
+        self.add_row_func = add_row_func
+
+    def procesar(self, lote):
+        for c in lote:
+            self.add_row_func(c.uid, c.nombre, c.fecha_str, c.modo, c.estado)
+
+class DestinoExcelLocal:
+    """
+    Junta filas y escribe cada partición mensual al cerrar() o al juntar
+    MAX_FILAS_BUFFER_DESTINO: cada escritura relee y reescribe el .xlsx del mes
+    completo, así que hacerlo por lote de 500 volvería cuadrático un atraso grande,
+    y el tope evita que ese atraso se quede entero en memoria.
+    """
+
+    def __init__(self, max_filas=MAX_FILAS_BUFFER_DESTINO):
+        self.max_filas = max_filas
+        self.filas = []
+
+    def procesar(self, lote):
+        self.filas.extend(c.fila() for c in lote)
+        if len(self.filas) >= self.max_filas:
+            self.cerrar()
+
+    def cerrar(self):
+        filas, self.filas = self.filas, []
+        if filas:
+            guardar_excel_local(filas)
+
+class DestinoNube:
+    """
+    Sube filas a Google con append_rows. Si falla (o no hay hoja), las filas van
+    a un outbox local y se reintentan al inicio del siguiente ciclo.
+    """
+
+    def __init__(self, sheet, log_func, archivo_outbox=ARCHIVO_OUTBOX_NUBE):
+        self.sheet = sheet
+        self.hojas = HOJAS_MENSUALES.conectar(sheet) if sheet else None
+        self.log_func = log_func
+        self.archivo_outbox = archivo_outbox
+        self.vaciar_outbox()
+
+    def _encolar(self, filas):
+        with open(self.archivo_outbox, 'a', encoding='utf-8') as f:
+            for fila in filas:
+                f.write(json.dumps(fila, ensure_ascii=False) + "\n")
+
+    def vaciar_outbox(self):
+        if not self.sheet or not os.path.exists(self.archivo_outbox) or not ARRANQUE_NUBE.listo.is_set():
+            return
+        try:
+            with open(self.archivo_outbox, 'r', encoding='utf-8') as f:
+                filas = [json.loads(l) for l in f if l.strip()]
+            os.remove(self.archivo_outbox)
+        except Exception as e:
+            self.log_func(f"⚠️ Outbox ilegible (se reintenta luego): {e}")
+            return
+        # lo encolado mientras se sembraba el anti-duplicados puede ya existir en la nube
+        antes = len(filas)
+        filas = ARRANQUE_NUBE.filtrar(filas)
+        if ARRANQUE_NUBE.sembrar:
+            ARRANQUE_NUBE.llaves = set()  # ya están en HISTORIAL_PROCESADO
+        if antes != len(filas):
+            self.log_func(f"🌱 Outbox: {antes - len(filas)} filas ya estaban en la nube y se omitieron.")
+        subidas = 0
+        for lote in en_lotes(filas, TAM_LOTE_PIPELINE):
+            try:
+                self.hojas.agregar_filas(lote)
+                subidas += len(lote)
+            except ErrorSubidaParcial as e:
+                # lo que no subió regresa al outbox (sin duplicar lo que sí subió)
+                subidas += len(lote) - len(e.pendientes)
+                self._encolar(e.pendientes + filas[subidas + len(e.pendientes):])
+                self.log_func(f"⚠️ Outbox sin vaciar por completo (se reintenta luego): {e}")
+                break
+        if subidas:
+            self.log_func(f"☁️ Outbox: {subidas} filas pendientes subidas.")
+
+    def procesar(self, lote):
+        filas = ARRANQUE_NUBE.filtrar([c.fila() for c in lote])
+        if not filas:
+            return
+        if self.hojas and ARRANQUE_NUBE.listo.is_set():
+            try:
+                self.hojas.agregar_filas(filas)
+                return
+            except ErrorSubidaParcial as e:
+                self.log_func(f"⚠️ Error subiendo a nube: {e}")
+                filas = e.pendientes
+        self._encolar(filas)
+
+class DestinoRollups:
+    """Resumen diario {fecha: {entradas, salidas, retardos, anticipadas, por_tipo}} en rollups_diarios.json."""
+
+    def __init__(self, archivo=ARCHIVO_ROLLUPS):
+        self.archivo = archivo
+        self.sucio = False
+
+    def procesar(self, lote):
+        for c in lote:
+            # arranque desde la nube: lo que ya estaba allá ya está contado
+            if not ARRANQUE_NUBE.diferir_rollup(c):
+                sumar_a_rollups(c)
+        self.sucio = True
+
+    def cerrar(self):
+        if self.sucio:
+            guardar_json(self.archivo, ROLLUPS_DIARIOS, esperar=True, indent=2, ensure_ascii=False)
+            self.sucio = False
+
+def sumar_a_rollups(c):
+    """Cuenta una checada en el resumen de su día."""
+    dia = ROLLUPS_DIARIOS.setdefault(c.fecha_str[:10], {"entradas": 0, "salidas": 0, "retardos": 0, "anticipadas": 0, "por_tipo": {}})
+    dia["entradas" if c.modo == "Entrada" else "salidas"] += 1
+    if "Retardo" in c.estado:
+        dia["retardos"] += 1
+    elif "Anticipada" in c.estado:
+        dia["anticipadas"] += 1
+    dia["por_tipo"][c.tipo] = dia["por_tipo"].get(c.tipo, 0) + 1
+
+def cargar_rollups():
+    global ROLLUPS_DIARIOS
+    try:
+        with open(ARCHIVO_ROLLUPS, 'r', encoding='utf-8') as f:
+            ROLLUPS_DIARIOS = json.load(f)
+    except Exception:
+        ROLLUPS_DIARIOS = {}
+
+class IndiceChecadas:
+    """
+    Checadas en memoria por UID, ordenadas por fecha: [(epoch, modo, estado)].
+    Se alimenta del pipeline (DestinoIndiceChecadas) y, en segundo plano, de las
+    particiones mensuales; las consultas nunca abren un Excel.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.por_uid = {}
+        self.meses = set()       # meses completos en memoria
+        self.cargando = set()
+
+    def agregar(self, uid, fecha_str, modo, estado):
+        iv = (a_epoch(fecha_str), sys.intern(modo or ""), sys.intern(estado or ""))
+        with self.lock:
+            lista = self.por_uid.setdefault(uid, [])
+            if not lista or lista[-1] < iv:
+                lista.append(iv)
+                return
+            i = bisect.bisect_left(lista, iv)
+            if i == len(lista) or lista[i] != iv:
+                lista.insert(i, iv)
+
+    def _cargar_mes(self, mes):
+        ruta = ruta_particion_local(mes)
+        try:
+            if os.path.exists(ruta):
+                df = pd.read_excel(ruta, usecols=["ID", "Fecha", "Modo", "Estado"])
+                for uid, fecha, modo, estado in zip(df["ID"], df["Fecha"], df["Modo"], df["Estado"]):
+                    try:
+                        self.agregar(str(uid), str(fecha), str(modo), str(estado))
+                    except ValueError:
+                        continue
+            with self.lock:
+                self.meses.add(mes)
+        finally:
+            with self.lock:
+                self.cargando.discard(mes)
+
+    def precargar(self, meses):
+        """Carga meses en un hilo aparte (nunca en la ruta de una consulta)."""
+        with self.lock:
+            meses = [m for m in meses if m not in self.meses and m not in self.cargando]
+            self.cargando.update(meses)
+        if meses:
+            threading.Thread(target=lambda: [self._cargar_mes(m) for m in meses], daemon=True).start()
+
+    def de_usuario(self, uid, desde, hasta):
+        """Checadas de uid con desde <= fecha < hasta (epochs)."""
+        with self.lock:
+            lista = self.por_uid.get(uid, [])
+            i = bisect.bisect_left(lista, (desde,))
+            j = bisect.bisect_left(lista, (hasta,))
+            return lista[i:j]
+
+INDICE_CHECADAS = IndiceChecadas()
+
+class DestinoIndiceChecadas:
+    def procesar(self, lote):
+        for c in lote:
+            INDICE_CHECADAS.agregar(c.uid, c.fecha_str, c.modo, c.estado)
+
+class RecientesDelDia:
+    """
+    Cola acotada con las últimas filas del día, espejo de lo que ya se guardó en
+    la partición. Al arrancar se lee este archivo (unas cuantas filas) en lugar
+    del reporte del mes completo.
+    """
+
+    def __init__(self, archivo=ARCHIVO_RECIENTES, n=TABLA_MAX_FILAS):
+        self.archivo = archivo
+        self.lock = threading.Lock()
+        self.dia = None
+        self.filas = deque(maxlen=n)
+
+    def cargar(self):
+        hoy = datetime.date.today().strftime("%Y-%m-%d")
+        try:
+            with open(self.archivo, 'r', encoding='utf-8') as f:
+                d = json.load(f)
+        except FileNotFoundError:
+            d = self._desde_particion(hoy)
+        except Exception:
+            d = {}
+        with self.lock:
+            self.dia = hoy
+            self.filas.clear()
+            if d.get("dia") == hoy:
+                self.filas.extend(d.get("filas", []))
+
+    def _desde_particion(self, hoy):
+        """Sin archivo (primera vez): se recorre la partición del mes una sola vez."""
+        ruta = ruta_particion_local(hoy[:7])
+        filas = deque(maxlen=self.filas.maxlen)
+        try:
+            if os.path.exists(ruta):
+                for fila in _filas_particion(ruta):
+                    if str(fila[2])[:10] == hoy:
+                        filas.append([str(v) if v is not None else "" for v in fila])
+        except Exception as e:
+            print("Error leyendo checadas del día:", e)
+        return {"dia": hoy, "filas": list(filas)}
+
+    def agregar(self, filas):
+        if self.dia is None:
+            self.cargar()  # no perder lo del día si nadie cargó antes
+        hoy = datetime.date.today().strftime("%Y-%m-%d")
+        with self.lock:
+            if self.dia != hoy:
+                self.dia = hoy
+                self.filas.clear()
+            for fila in filas:
+                if fila[2][:10] == hoy:
+                    self.filas.append(fila)
+
+    def guardar(self):
+        with self.lock:
+            d = {"dia": self.dia, "filas": list(self.filas)}
+        try:
+            guardar_json(self.archivo, d, ensure_ascii=False)
+        except Exception as e:
+            print("Error guardando checadas recientes:", e)
+
+    def ultimas(self):
+        """Filas del día en orden cronológico."""
+        with self.lock:
+            return sorted(self.filas, key=lambda f: f[2])
+
+RECIENTES = RecientesDelDia()
+
+class DestinoRecientes:
+    def procesar(self, lote):
+        RECIENTES.agregar([c.fila() for c in lote])
+        RECIENTES.guardar()
+
+# ==========================================
+# 🌐 API LOCAL DE CONSULTA (solo lectura)
+# ==========================================
+def _paginar(datos, params):
+    try:
+        pagina = max(1, int(params.get("pagina", 1)))
+        tam = min(API_TAM_PAGINA_MAX, max(1, int(params.get("tam", API_TAM_PAGINA))))
+    except ValueError:
+        raise ValueError("pagina/tam deben ser enteros")
+    inicio = (pagina - 1) * tam
+    return {"total": len(datos), "pagina": pagina, "tam": tam, "datos": datos[inicio:inicio + tam]}
+
+def _fecha_param(params, clave, default):
+    valor = params.get(clave)
+    if not valor:
+        return default
+    try:
+        return datetime.datetime.strptime(valor, "%Y-%m-%d")
+    except ValueError:
+        return datetime.datetime.strptime(valor, FORMATO_FECHA)
+
+def _api_estados(params):
+    tipo, sucursal, estado = params.get("tipo"), params.get("sucursal"), params.get("estado")
+    datos = []
+    for uid, info in sorted(list(ESTADOS_USUARIOS.items())):
+        if tipo and info.get("tipo") != tipo:
+            continue
+        if sucursal and info.get("sucursal") != sucursal:
+            continue
+        if estado and info.get("ultimo_estado") != estado:
+            continue
+        datos.append({"uid": uid, **info.a_dict()})
+    return _paginar(datos, params)
+
+def _api_ocupacion(params):
+    res = OCUPACION.resumen()
+    if params.get("momento"):
+        dentro = ESTANCIAS.dentro_en(_fecha_param(params, "momento", None))
+        res["momento"] = params["momento"]
+        res["dentro"] = _paginar([{"uid": u, "inicio": desde_epoch(i), "fin": desde_epoch(f) if f is not None else None, "tipo": t}
+                                  for u, i, f, t in dentro], params)
+    return res
+
+def _api_checadas(params):
+    uid = params.get("uid")
+    if not uid:
+        raise ValueError("falta uid")
+    hoy = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    desde = _fecha_param(params, "desde", hoy)
+    hasta = _fecha_param(params, "hasta", desde) + datetime.timedelta(days=1)
+    # meses del rango que aún no están en memoria: se piden en segundo plano
+    meses, m = [], desde.replace(day=1)
+    while m < hasta:
+        meses.append(m.strftime("%Y-%m"))
+        m = (m + datetime.timedelta(days=32)).replace(day=1)
+    faltan = [x for x in meses if x not in INDICE_CHECADAS.meses and x in PARTICIONES.local]
+    INDICE_CHECADAS.precargar(faltan)
+    datos = [{"fecha": desde_epoch(ts), "modo": modo, "estado": estado}
+             for ts, modo, estado in INDICE_CHECADAS.de_usuario(uid, a_epoch(desde), a_epoch(hasta))]
+    res = _paginar(datos, params)
+    res["uid"] = uid
+    if faltan:
+        res["meses_cargando"] = faltan
+    return res
+
+def _api_rollups(params):
+    desde, hasta = params.get("desde", ""), params.get("hasta", "9999-12-31")
+    datos = [{"fecha": f, **d} for f, d in sorted(list(ROLLUPS_DIARIOS.items())) if desde <= f <= hasta]
+    return _paginar(datos, params)
+
+RUTAS_API = {
+    "/estados": _api_estados,
+    "/ocupacion": _api_ocupacion,
+    "/checadas": _api_checadas,
+    "/rollups": _api_rollups,
+}
+
+class _ManejadorAPI(BaseHTTPRequestHandler):
+    def _responder(self, codigo, cuerpo):
+        data = json.dumps(cuerpo, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        ruta = url.path.rstrip("/") or "/"
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        if ruta == "/":
+            return self._responder(200, {"rutas": sorted(RUTAS_API)})
+        funcion = RUTAS_API.get(ruta)
+        if not funcion:
+            return self._responder(404, {"error": f"ruta desconocida: {ruta}"})
+        try:
+            self._responder(200, funcion(params))
+        except ValueError as e:
+            self._responder(400, {"error": str(e)})
+        except Exception as e:
+            self._responder(500, {"error": str(e)})
+
+    def log_message(self, format, *args):
+        pass  # sin ruido en consola
+
+class ServidorAPI(HTTPServer):
+    """HTTPServer que atiende cada petición en un pool fijo de hilos."""
+    allow_reuse_address = True
+
+    def __init__(self, direccion, hilos=API_HILOS):
+        super().__init__(direccion, _ManejadorAPI)
+        self.pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="api")
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._atender, request, client_address)
+
+    def _atender(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+def iniciar_api(log_func, stop_event=None):
+    cfg = cargar_config()
+    host = cfg.get("api_host", API_HOST)
+    puerto = int(cfg.get("api_puerto", API_PUERTO))
+    try:
+        servidor = ServidorAPI((host, puerto))
+    except OSError as e:
+        log_func(f"⚠️ API local no iniciada en {host}:{puerto}: {e}")
+        return None
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    if stop_event:
+        threading.Thread(target=lambda: (stop_event.wait(), servidor.shutdown()), daemon=True).start()
+    log_func(f"🌐 API de consulta en http://{host}:{puerto}/ (estados, ocupacion, checadas, rollups)")
+    return servidor
+
+# ==========================================
+# ⏪ BACKFILL / REPLAY DE VOLCADOS HISTÓRICOS
+# ==========================================
+# Formatos: .dat/.txt (attlog del reloj: PIN<TAB>fecha<TAB>verif<TAB>punch...),
+# .csv (reportes con ID + Fecha / Fecha y Hora [+ Modo / Evento, Nombre]),
+# .xlsx/.xls (Reporte_Asistencia viejo). Parseo y clasificación van en un pool
+# de procesos; dedupe, estados y guardado se hacen en el proceso principal.
+TAM_TROZO_BACKFILL = 5000
+_BACKFILL_USUARIOS = {}
+
+def _init_backfill(usuarios_local):
+    global _BACKFILL_USUARIOS
+    _BACKFILL_USUARIOS = usuarios_local
+
+def _parsear_fecha(valor):
+    if isinstance(valor, datetime.datetime):
+        return valor.replace(microsecond=0)
+    if hasattr(valor, "to_pydatetime"):
+        return valor.to_pydatetime().replace(microsecond=0)
+    texto = str(valor).strip()
+    for fmt in (FORMATO_FECHA, "%Y-%m-%d %H:%M", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M"):
+        try:
+            return datetime.datetime.strptime(texto, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"fecha inválida: {texto!r}")
+
+def _punch_desde_modo(modo):
+    """Reportes viejos traen Modo/Evento en texto: se traduce a punch para reclasificar."""
+    modo = str(modo or "").strip().lower()
+    if modo.startswith("entrada"):
+        return 0
+    if modo.startswith("salida"):
+        return 1
+    return 255  # sin dato: la heurística de analizar_registro decide por la hora
+
+def _backfill_trozo(args):
+    """Proceso hijo: (formato, columnas, filas) -> ([(uid, fecha_str, punch, nombre, tipo, modo, estado)], errores)."""
+    formato, columnas, filas = args
+    usuarios_local = _BACKFILL_USUARIOS
+    salida, errores = [], 0
+    if formato == "csv":
+        filas = csv.reader(filas)
+    for fila in filas:
+        try:
+            if formato == "attlog":
+                partes = fila.strip().split("\t")
+                if len(partes) < 2:
+                    continue
+                uid, fecha = partes[0].strip(), _parsear_fecha(partes[1])
+                punch = int(partes[3]) if len(partes) > 3 and partes[3].strip() else 0
+                nombre = None
+            else:
+                if not fila:
+                    continue
+                valor = lambda col: fila[columnas[col]] if col in columnas and columnas[col] < len(fila) else None
+                uid = str(valor("id")).strip()
+                if uid.endswith(".0"):
+                    uid = uid[:-2]  # pandas lee IDs numéricos como float
+                fecha = _parsear_fecha(valor("fecha"))
+                punch = _punch_desde_modo(valor("modo")) if "modo" in columnas else 255
+                nombre = valor("nombre")
+            tipo = "visitante"
+            user_info = usuarios_local.get(uid)
+            if user_info:
+                nombre = user_info.get("nombre") or nombre
+                tipo = user_info.get("tipo", "visitante")
+            modo, estado = analizar_registro(uid, fecha, punch, usuarios_local)
+            salida.append((uid, fecha.strftime(FORMATO_FECHA), punch, nombre or "Desconocido", tipo, modo, estado))
+        except Exception:
+            errores += 1
+    return salida, errores
+
+_ALIAS_COLUMNAS = {
+    "id": ("ID", "Id", "PIN", "user_id"),
+    "fecha": ("Fecha y Hora", "Fecha", "timestamp"),
+    "modo": ("Modo", "Evento"),
+    "nombre": ("Nombre", "name"),
+}
+
+def _mapear_columnas(encabezado):
+    columnas = {}
+    limpio = [str(c).strip() for c in encabezado]
+    for clave, alias in _ALIAS_COLUMNAS.items():
+        for a in alias:
+            if a in limpio:
+                columnas[clave] = limpio.index(a)
+                break
+    if "id" not in columnas or "fecha" not in columnas:
+        raise ValueError(f"columnas ID/Fecha no encontradas en {limpio}")
+    return columnas
+
+def _trozos_de_archivo(ruta, tam=TAM_TROZO_BACKFILL):
+    """Genera (formato, columnas, filas) en trozos listos para el pool."""
+    ext = os.path.splitext(ruta)[1].lower()
+    if ext in (".xlsx", ".xls"):
+        df = pd.read_excel(ruta)
+        columnas = _mapear_columnas(df.columns)
+        for lote in en_lotes(df.itertuples(index=False, name=None), tam):
+            yield ("tabla", columnas, lote)
+        return
+    with open(ruta, 'r', encoding='utf-8-sig', errors='replace') as f:
+        if ext == ".csv":
+            columnas = _mapear_columnas(next(csv.reader([f.readline()])))
+            formato = "csv"
+        else:
+            columnas, formato = None, "attlog"
+        for lote in en_lotes(f, tam):
+            yield (formato, columnas, lote)
+
+def ejecutar_backfill(rutas, sucursal, procesos=None, subir_nube=False, tam_lote=20000, log_func=print):
+    """Reproduce volcados históricos con las mismas reglas que el ciclo en vivo. Regresa un resumen."""
+    ensure_files_exist()
+    usuarios_local = cargar_usuarios()
+    cargar_estados()
+    cargar_historial_existente(log_func)
+    cargar_rollups()
+
+    t0 = time.time()
+    leidos, errores, clasificados = 0, 0, []
+    with multiprocessing.Pool(processes=procesos, initializer=_init_backfill, initargs=(usuarios_local,)) as pool:
+        for ruta in rutas:
+            log_func(f"📂 Leyendo {ruta} ...")
+            for registros, err in pool.imap(_backfill_trozo, _trozos_de_archivo(ruta)):
+                leidos += len(registros)
+                errores += err
+                clasificados.extend(registros)
+    t_parseo = time.time() - t0
+
+    # orden cronológico para que estados y estancias queden como en vivo
+    clasificados.sort(key=lambda r: r[1])
+    sheet = conectar_google(log_func) if subir_nube else None
+    # recuperación sin reporte local: lo que ya está en la nube no se vuelve a subir
+    ARRANQUE_NUBE.iniciar(sheet, log_func, esperar=True, sembrar=False)
+    destinos = [DestinoEstados(), DestinoExcelLocal(), DestinoRollups()]
+    if subir_nube:
+        destinos.append(DestinoNube(sheet, log_func))
+    pipeline = Pipeline([etapa_dedupe, DEBOUNCE.etapa(usuarios_local)], destinos, tam_lote=tam_lote, log_func=log_func)
+    nuevos = pipeline.ejecutar(Checada.clasificada(*r[:7], sucursal=sucursal) for r in clasificados)
+    if subir_nube and HOJA_ESTADO.conectar(sheet, log_func):
+        HOJA_ESTADO.sincronizar(log_func)
+    total = time.time() - t0
+
+    resumen = {
+        "leidos": leidos, "errores": errores, "nuevos": nuevos, "duplicados": leidos - nuevos,
+        "segundos": round(total, 2),
+        "parseo_rps": round(leidos / t_parseo) if t_parseo > 0 else leidos,
+        "total_rps": round(leidos / total) if total > 0 else leidos,
+    }
+    log_func(f"⏪ Backfill: {leidos} leídos ({errores} con error), {nuevos} nuevos, {leidos - nuevos} duplicados "
+             f"en {total:.1f}s — parseo+clasificación {resumen['parseo_rps']} reg/s, total {resumen['total_rps']} reg/s")
+    return resumen
+
+# ==========================================
+# 📤 EXPORTACIÓN POR STREAMING
+# ==========================================
+def _filas_particion(ruta, reintentos=3):
+    """Lee una partición fila por fila (openpyxl read-only); reintenta si el colector la está reescribiendo."""
+    for intento in range(reintentos):
+        try:
+            wb = load_workbook(ruta, read_only=True)
+            break
+        except Exception:
+            if intento == reintentos - 1:
+                raise
+            time.sleep(1)
+    try:
+        filas = wb.active.iter_rows(values_only=True)
+        encabezado = [str(c).strip() if c is not None else "" for c in next(filas, ())]
+        indices = [encabezado.index(c) if c in encabezado else None for c in COLUMNAS_EXCEL]
+        for fila in filas:
+            yield [fila[i] if i is not None and i < len(fila) else None for i in indices]
+    finally:
+        wb.close()
+
+class _EscritorExportacion:
+    """CSV con csv.writer o .xlsx con openpyxl write-only; abre hoja nueva al llegar al límite de filas."""
+
+    def __init__(self, destino):
+        self.destino = destino
+        self.es_csv = destino.lower().endswith(".csv")
+        if self.es_csv:
+            self.f = open(destino, 'w', newline='', encoding='utf-8-sig')
+            self.w = csv.writer(self.f)
+            self.w.writerow(COLUMNAS_EXCEL)
+        else:
+            self.wb = Workbook(write_only=True)
+            self.hojas = 0
+            self._nueva_hoja()
+
+    def _nueva_hoja(self):
+        self.hojas += 1
+        self.ws = self.wb.create_sheet(f"Asistencia_{self.hojas}" if self.hojas > 1 else "Asistencia")
+        self.ws.append(COLUMNAS_EXCEL)
+        self.en_hoja = 0
+
+    def escribir(self, fila):
+        if self.es_csv:
+            self.w.writerow(fila)
+            return
+        if self.en_hoja >= EXPORTAR_MAX_FILAS_HOJA:
+            self._nueva_hoja()
+        self.ws.append(fila)
+        self.en_hoja += 1
+
+    def cerrar(self):
+        if self.es_csv:
+            self.f.close()
+        else:
+            self.wb.save(self.destino)
+
+def exportar_asistencia(destino, desde, hasta, sucursal=None, tipo=None, particiones=None, progreso=None):
+    """
+    Copia a destino (.xlsx o .csv) las checadas con fecha en [desde, hasta] ('YYYY-MM-DD'),
+    filtradas por sucursal y/o tipo, sin cargar nunca más de una fila en memoria.
+    particiones: [(mes, ruta, filas)]; por defecto las de PARTICIONES que traslapan el rango.
+    progreso(hechas, total) se llama cada EXPORTAR_AVISO_FILAS filas leídas.
+    """
+    if particiones is None:
+        particiones = [(m, PARTICIONES.local[m]["archivo"], PARTICIONES.local[m]["filas"])
+                       for m in PARTICIONES.meses_entre(desde, hasta + " 23:59:59")]
+    total = sum(n for _, _, n in particiones)
+    fin = hasta + " 23:59:59"
+    leidas, escritas = 0, 0
+    escritor = _EscritorExportacion(destino)
+    try:
+        for mes, ruta, _ in particiones:
+            if not os.path.exists(ruta):
+                continue
+            for fila in _filas_particion(ruta):
+                leidas += 1
+                if progreso and leidas % EXPORTAR_AVISO_FILAS == 0:
+                    progreso(leidas, total)
+                f = fila[2]
+                f = f.strftime(FORMATO_FECHA) if isinstance(f, datetime.datetime) else str(f)
+                if not (desde <= f <= fin):
+                    continue
+                if sucursal and fila[5] != sucursal:
+                    continue
+                if tipo and fila[6] != tipo:
+                    continue
+                fila[2] = f
+                escritor.escribir(fila)
+                escritas += 1
+    finally:
+        escritor.cerrar()
+    if progreso:
+        progreso(leidas, max(total, leidas))
+    return {"leidas": leidas, "escritas": escritas, "particiones": len(particiones), "destino": destino}
+
+def _proceso_exportar(cola, destino, desde, hasta, sucursal, tipo, particiones):
+    """Proceso hijo: reporta ("progreso", hechas, total), luego ("fin", resumen) o ("error", mensaje)."""
+    try:
+        resumen = exportar_asistencia(destino, desde, hasta, sucursal, tipo, particiones,
+                                      progreso=lambda h, t: cola.put(("progreso", h, t)))
+        cola.put(("fin", resumen))
+    except Exception as e:
+        cola.put(("error", str(e)))
+
+def iniciar_exportacion(destino, desde, hasta, sucursal=None, tipo=None):
+    """Lanza la exportación en otro proceso (el colector sigue su ritmo). Regresa (proceso, cola)."""
+    particiones = [(m, PARTICIONES.local[m]["archivo"], PARTICIONES.local[m]["filas"])
+                   for m in PARTICIONES.meses_entre(desde, hasta + " 23:59:59")]
+    cola = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_proceso_exportar,
+                                   args=(cola, destino, desde, hasta, sucursal, tipo, particiones), daemon=True)
+    proc.start()
+    return proc, cola
+
+# ==========================================
+# 🏢 CONSOLIDACIÓN MULTI-SUCURSAL (carpeta compartida)
+# ==========================================
+# Cada instancia con "carpeta_sync" en config_app.json deja, por ciclo con
+# checadas nuevas, un paquete <carpeta_sync>/<sucursal>/paquete_<instancia>_<seq>.json.gz:
+#   {"v": 1, "sucursal", "instancia", "seq", "creado", "base": epoch de la primera checada,
+#    "dic": [cadenas], "checadas": [[uid, delta_seg, i_nombre, i_modo, i_estado, i_tipo]],
+#    "estados": {uid: estado}}
+# Las checadas van ordenadas por fecha con la hora como diferencia contra la
+# anterior y los textos repetidos como índices a "dic".
+# "instancia" se genera al crear paquetes_sync/seq.json: si la cola local se
+# pierde (reinstalación) la instancia nueva reinicia seq sin pisar nombres viejos.
+# Los paquetes legados "paquete_<seq>.json.gz" cuentan como instancia "".
+
+def _nombre_carpeta(sucursal):
+    return re.sub(r"[^\w.-]+", "_", sucursal.strip()) or "sin_sucursal"
+
+def codificar_paquete(sucursal, seq, checadas, estados, instancia=""):
+    """checadas: [(uid, fecha_str, nombre, modo, estado, tipo)] -> bytes gzip."""
+    dic, indices = [], {}
+    def idx(texto):
+        texto = "" if texto is None else str(texto)
+        if texto not in indices:
+            indices[texto] = len(dic)
+            dic.append(texto)
+        return indices[texto]
+    filas, previo, base = [], None, None
+    for uid, fecha_str, nombre, modo, estado, tipo in sorted(checadas, key=lambda c: c[1]):
+        ts = a_epoch(fecha_str)
+        if base is None:
+            base = previo = ts
+        filas.append([uid, ts - previo, idx(nombre), idx(modo), idx(estado), idx(tipo)])
+        previo = ts
+    doc = {"v": 1, "sucursal": sucursal, "instancia": instancia, "seq": seq, "creado": datetime.datetime.now().strftime(FORMATO_FECHA),
+           "base": base, "dic": dic, "checadas": filas, "estados": estados}
+    return gzip.compress(json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def decodificar_paquete(datos):
+    """bytes -> (doc, [(uid, fecha_str, nombre, modo, estado, tipo)])."""
+    doc = json.loads(gzip.decompress(datos).decode("utf-8"))
+    dic, ts, checadas = doc["dic"], doc.get("base"), []
+    for uid, delta, i_nom, i_modo, i_est, i_tipo in doc["checadas"]:
+        ts += delta
+        checadas.append((uid, desde_epoch(ts), dic[i_nom], dic[i_modo], dic[i_est], dic[i_tipo]))
+    return doc, checadas
+
+class DestinoPaquetes:
+    """
+    Junta las checadas nuevas del ciclo y al cerrar deja un paquete en la cola
+    local (CARPETA_PAQUETES); luego intenta copiar todo lo pendiente a la carpeta
+    compartida. Sin red, los paquetes esperan y se copian en el siguiente ciclo.
+    Un atraso grande se parte en paquetes de hasta MAX_FILAS_BUFFER_DESTINO checadas.
+    """
+
+    def __init__(self, carpeta_sync, sucursal, log_func, cola=CARPETA_PAQUETES, max_checadas=MAX_FILAS_BUFFER_DESTINO):
+        self.max_checadas = max_checadas
+        self.destino = os.path.join(carpeta_sync, _nombre_carpeta(sucursal))
+        self.sucursal = sucursal
+        self.log_func = log_func
+        self.cola = cola
+        self.checadas = []
+        self.uids = set()
+
+    def procesar(self, lote):
+        for c in lote:
+            self.checadas.append((c.uid, c.fecha_str, c.nombre, c.modo, c.estado, c.tipo))
+            self.uids.add(c.uid)
+        if len(self.checadas) >= self.max_checadas:
+            self._sellar()
+
+    def _siguiente_seq(self):
+        """(instancia, seq) del siguiente paquete; sin seq.json se estrena instancia."""
+        ruta = os.path.join(self.cola, "seq.json")
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                previo = json.load(f)
+            seq = previo["seq"] + 1
+        except Exception:
+            previo, seq = {}, 1
+        instancia = previo.get("instancia") or uuid.uuid4().hex[:12]
+        guardar_json(ruta, {"instancia": instancia, "seq": seq}, esperar=True)
+        return instancia, seq
+
+    def _sellar(self):
+        """Deja las checadas acumuladas como un paquete en la cola local."""
+        os.makedirs(self.cola, exist_ok=True)
+        if self.checadas:
+            instancia, seq = self._siguiente_seq()
+            estados = {uid: ESTADOS_USUARIOS[uid].a_dict() for uid in self.uids if uid in ESTADOS_USUARIOS}
+            datos = codificar_paquete(self.sucursal, seq, self.checadas, estados, instancia)
+            _escribir_bytes_atomico(os.path.join(self.cola, f"paquete_{instancia}_{seq:08d}.json.gz"), datos)
+            self.checadas, self.uids = [], set()
+
+    def cerrar(self):
+        self._sellar()
+        os.makedirs(self.cola, exist_ok=True)
+        self.enviar_pendientes()
+
+    def enviar_pendientes(self):
+        pendientes = sorted(n for n in os.listdir(self.cola) if n.startswith("paquete_") and n.endswith(".json.gz"))
+        if not pendientes:
+            return
+        try:
+            os.makedirs(self.destino, exist_ok=True)
+            for nombre in pendientes:
+                origen = os.path.join(self.cola, nombre)
+                tmp = os.path.join(self.destino, nombre + ".tmp")
+                shutil.copyfile(origen, tmp)
+                os.replace(tmp, os.path.join(self.destino, nombre))
+                os.remove(origen)
+        except OSError as e:
+            self.log_func(f"⚠️ Carpeta de sincronización no disponible ({len(pendientes)} paquetes en espera): {e}")
+
+def _escribir_bytes_atomico(ruta, datos):
+    tmp = ruta + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(datos)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, ruta)
+
+class Consolidador:
+    """
+    Oficina central: lee los paquetes de todas las sucursales de la carpeta
+    compartida y los funde en un solo acervo en 'salida':
+      Consolidado_YYYY-MM.xlsx        checadas sin duplicados (llave sucursal+ID+fecha)
+      estados_sucursales.json         {sucursal: {uid: estado más reciente}}
+      marcas_sucursales.json          {sucursal: {"instancias": {instancia: seq}, "hasta",
+                                                   "actualizado", "revisado"}}
+    La marca es el último seq aplicado por instancia de la sucursal: cada paquete
+    se lee una vez, y si un paquete se repite la llave evita duplicar filas.
+    Un paquete con seq ya cubierto por la marca pero escrito después de la última
+    revisión ("revisado", epoch) indica que el seq retrocedió (cola local perdida
+    con nombres legados): se avisa y se aplica de nuevo en lugar de ignorarlo.
+    """
+
+    def __init__(self, carpeta_sync, salida):
+        self.carpeta_sync = carpeta_sync
+        self.salida = salida
+        os.makedirs(salida, exist_ok=True)
+        self.ruta_marcas = os.path.join(salida, "marcas_sucursales.json")
+        self.ruta_estados = os.path.join(salida, "estados_sucursales.json")
+        self.marcas = self._leer(self.ruta_marcas)
+        self.estados = self._leer(self.ruta_estados)
+        self.llaves = {}  # mes -> {(sucursal, uid, fecha)}
+
+    @staticmethod
+    def _leer(ruta):
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def ruta_mes(self, mes):
+        return os.path.join(self.salida, f"Consolidado_{mes}.xlsx")
+
+    def _llaves_mes(self, mes):
+        if mes not in self.llaves:
+            llaves = set()
+            ruta = self.ruta_mes(mes)
+            if os.path.exists(ruta):
+                df = pd.read_excel(ruta, usecols=["ID", "Fecha", "Sucursal"], dtype=str)
+                llaves.update(zip(df["Sucursal"], df["ID"], df["Fecha"]))
+            self.llaves[mes] = llaves
+        return self.llaves[mes]
+
+    def _marcas_instancias(self, carpeta):
+        """{instancia: seq}; una marca legada {"seq"} cuenta como instancia ""."""
+        marca = self.marcas.get(carpeta, {})
+        instancias = dict(marca.get("instancias", {}))
+        if "seq" in marca:
+            instancias.setdefault("", marca["seq"])
+        return instancias
+
+    def _paquetes_nuevos(self, carpeta, log_func=print):
+        """{instancia: [(seq, ruta)]} con seq mayor a la marca de la instancia, o escritos tras la última revisión."""
+        instancias = self._marcas_instancias(carpeta)
+        revisado = self.marcas.get(carpeta, {}).get("revisado")
+        paquetes = {}
+        for nombre in os.listdir(os.path.join(self.carpeta_sync, carpeta)):
+            m = re.fullmatch(r"paquete_(?:([0-9a-f]+)_)?(\d+)\.json\.gz", nombre)
+            if not m:
+                continue
+            instancia, seq = m.group(1) or "", int(m.group(2))
+            ruta = os.path.join(self.carpeta_sync, carpeta, nombre)
+            marca = instancias.get(instancia, 0)
+            if seq <= marca:
+                if revisado is None or os.path.getmtime(ruta) < revisado:
+                    continue
+                log_func(f"⚠️ {carpeta}: {nombre} tiene seq {seq} ≤ marca {marca} pero es posterior "
+                         f"a la última consolidación (¿reinstalación?); se aplica de nuevo")
+            paquetes.setdefault(instancia, []).append((seq, ruta))
+        return {instancia: sorted(lista) for instancia, lista in paquetes.items()}
+
+    def ejecutar(self, log_func=print):
+        resumen = {}
+        for carpeta in sorted(os.listdir(self.carpeta_sync)):
+            if not os.path.isdir(os.path.join(self.carpeta_sync, carpeta)):
+                continue
+            # se toma antes de listar: un paquete copiado durante la corrida queda posterior a la marca
+            revisado = time.time()
+            por_instancia = self._paquetes_nuevos(carpeta, log_func)
+            if not por_instancia:
+                continue
+            filas, leidas, aplicados = [], 0, 0
+            instancias = self._marcas_instancias(carpeta)
+            hasta = self.marcas.get(carpeta, {}).get("hasta", "")
+            pendientes = False
+            for instancia, paquetes in sorted(por_instancia.items()):
+                for seq, ruta in paquetes:
+                    try:
+                        with open(ruta, 'rb') as f:
+                            doc, checadas = decodificar_paquete(f.read())
+                    except Exception as e:
+                        # paquete dañado: se detiene la instancia aquí para no saltarlo con la marca
+                        log_func(f"⚠️ {ruta} ilegible, se reintenta en la próxima consolidación: {e}")
+                        pendientes = True
+                        break
+                    sucursal = doc.get("sucursal") or carpeta
+                    for uid, fecha, nombre, modo, estado, tipo in checadas:
+                        leidas += 1
+                        llaves = self._llaves_mes(fecha[:7])
+                        if (sucursal, uid, fecha) in llaves:
+                            continue
+                        llaves.add((sucursal, uid, fecha))
+                        filas.append([uid, nombre, fecha, modo, estado, sucursal, tipo, modo, fecha])
+                        hasta = max(hasta, fecha)
+                    por_uid = self.estados.setdefault(sucursal, {})
+                    for uid, d in doc.get("estados", {}).items():
+                        if d.get("ultima_actividad", "") >= por_uid.get(uid, {}).get("ultima_actividad", ""):
+                            por_uid[uid] = d
+                    instancias[instancia] = max(instancias.get(instancia, 0), seq)
+                    aplicados += 1
+            if not aplicados:
+                continue
+            # orden de escritura: filas -> estados -> marca (si algo falla se relee y la llave deduplica)
+            for mes, grupo in agrupar_por_mes(filas).items():
+                ruta = self.ruta_mes(mes)
+                df_new = pd.DataFrame(grupo, columns=COLUMNAS_EXCEL)
+                if os.path.exists(ruta):
+                    df_new = pd.concat([pd.read_excel(ruta, dtype=str), df_new], ignore_index=True)
+                df_new.to_excel(ruta, index=False)
+            guardar_json(self.ruta_estados, self.estados, indent=2, ensure_ascii=False)
+            previa = self.marcas.get(carpeta, {})
+            self.marcas[carpeta] = {"instancias": instancias, "hasta": hasta,
+                                    "actualizado": datetime.datetime.now().strftime(FORMATO_FECHA),
+                                    # con un paquete dañado la revisión no avanza: se reintenta aunque su seq ya esté cubierto
+                                    "revisado": previa.get("revisado") if pendientes else revisado}
+            guardar_json(self.ruta_marcas, self.marcas, indent=2, ensure_ascii=False)
+            resumen[carpeta] = {"paquetes": aplicados, "leidas": leidas, "nuevas": len(filas), "seq": instancias}
+            marcas_txt = ", ".join(f"{i or 'legado'}:{n}" for i, n in sorted(instancias.items()))
+            log_func(f"🏢 {carpeta}: {aplicados} paquetes, {leidas} checadas, {len(filas)} nuevas (marca seq {marcas_txt})")
+        if not resumen:
+            log_func("🏢 Sin paquetes nuevos.")
+        return resumen
+
+# ==========================================
+# ⏱️ SONDEO ADAPTATIVO
+# ==========================================
+class PlanificadorSondeo:
+    """
+    Decide cuánto dormir entre ciclos: rápido cerca de horarios de entrada/salida
+    (globales y por usuario) o si la tasa de checadas es alta; se va alejando
+    (x1.5 por ciclo vacío) cuando no llega nada. Siempre dentro de [mínimo, máximo].
+    """
+
+    def __init__(self, minimo=SONDEO_MIN_SECONDS, base=SONDEO_BASE_SECONDS, maximo=SONDEO_MAX_SECONDS,
+                 ventana_min=SONDEO_VENTANA_TURNO_MIN, tasa_alta=SONDEO_TASA_ALTA):
+        self.minimo, self.base, self.maximo = minimo, base, maximo
+        self.ventana_min = ventana_min
+        self.tasa_alta = tasa_alta
+        self.fronteras = []   # minutos del día
+        self.tasa = 0.0       # checadas/minuto (promedio móvil)
+        self.vacios = 0
+        self.intervalo = base
+
+    @staticmethod
+    def _minutos(valor):
+        if isinstance(valor, datetime.time):
+            return valor.hour * 60 + valor.minute
+        h, m = map(int, str(valor).split(":"))
+        return h * 60 + m
+
+    def actualizar_fronteras(self, usuarios_local):
+        fronteras = {
+            self._minutos(HORARIOS_CONFIG['entrada']),
+            self._minutos(HORARIOS_CONFIG['entrada']) + HORARIOS_CONFIG['tolerancia'],
+            self._minutos(HORARIOS_CONFIG['salida']),
+        }
+        for info in usuarios_local.values():
+            for clave in ("hora_entrada", "hora_salida"):
+                try:
+                    if info.get(clave):
+                        fronteras.add(self._minutos(info[clave]))
+                except (ValueError, AttributeError):
+                    pass
+        self.fronteras = sorted(fronteras)
+
+    def _distancia_turno(self, ahora):
+        """Minutos a la frontera de turno más cercana (circular en el día)."""
+        m = ahora.hour * 60 + ahora.minute
+        if not self.fronteras:
+            return None
+        i = bisect.bisect_left(self.fronteras, m)
+        candidatos = (self.fronteras[i % len(self.fronteras)], self.fronteras[i - 1])
+        return min(min(abs(m - f), 1440 - abs(m - f)) for f in candidatos)
+
+    def siguiente(self, nuevos, ahora=None):
+        """Registra el resultado del ciclo y regresa los segundos a dormir."""
+        ahora = ahora or datetime.datetime.now()
+        tasa_ciclo = nuevos / (max(self.intervalo, 1) / 60.0)
+        self.tasa = 0.5 * self.tasa + 0.5 * tasa_ciclo
+        if nuevos:
+            self.vacios = 0
+        elif self.base * (1.5 ** self.vacios) < self.maximo:
+            # deja de contar al llegar al máximo: 1.5 ** vacios desborda tras ~1750 ciclos vacíos
+            self.vacios += 1
+
+        intervalo = self.base
+        distancia = self._distancia_turno(ahora)
+        if distancia is not None and distancia <= self.ventana_min:
+            # más cerca de la frontera -> más rápido
+            intervalo = self.minimo + (self.base - self.minimo) * distancia / self.ventana_min
+        if self.tasa >= self.tasa_alta:
+            intervalo = min(intervalo, self.base * self.tasa_alta / self.tasa)
+        elif self.vacios and (distancia is None or distancia > self.ventana_min):
+            intervalo = self.base * (1.5 ** self.vacios)
+        self.intervalo = int(max(self.minimo, min(self.maximo, intervalo)))
+        return self.intervalo
+
 # ==========================================
 # 🔌 HILO PRINCIPAL
 # ==========================================
@@ -370,18 +3180,40 @@ def hilo_proceso(ip, sucursal, log_func, update_status_func, add_row_func, stop_
     # sincronizar nombres y tipos en caso de cambios manuales
     sync_nombres_con_usuarios(usuarios_local)
 
+    # archivar visitantes/externos inactivos para mantener chico el estado en RAM
+    archivar_inactivos(log_func)
+
     # 1. Cargar historial previo para anti-duplicados
     cargar_historial_existente(log_func)
+    cargar_rollups()
+    # índice de checadas para la API: mes actual y anterior, en segundo plano
+    hoy = datetime.date.today()
+    INDICE_CHECADAS.precargar([(hoy.replace(day=1) - datetime.timedelta(days=1)).strftime("%Y-%m"), hoy.strftime("%Y-%m")])
 
     sheet = conectar_google(log_func)
     if sheet:
         update_status_func("google", True)
         log_func("☁️ Nube Conectada")
+        HOJA_ESTADO.conectar(sheet, log_func)
+        # sin reporte local: sembrar anti-duplicados desde la nube en segundo plano
+        ARRANQUE_NUBE.iniciar(sheet, log_func)
     else:
         update_status_func("google", False)
         log_func("⚠️ MODO OFFLINE")
 
+    planificador = PlanificadorSondeo()
+    planificador.actualizar_fronteras(usuarios_local)
+    DIAGNOSTICO.desde_entorno()
+    # multi-sucursal: paquetes para la oficina central en una carpeta compartida
+    carpeta_sync = cargar_config().get("carpeta_sync")
+    # un solo destino de nube para todos los ciclos: su outbox se vacía en cada
+    # vuelta, lleguen o no checadas (y aunque el reloj no responda)
+    nube = DestinoNube(sheet, log_func)
+
     while True:
+        nuevos_contador = 0
+        DIAGNOSTICO.inicio_ciclo(log_func)
+        nube.vaciar_outbox()
         try:
             conn = ZK(ip, port=4370, timeout=10, password=0, force_udp=True, ommit_ping=True)
             conn.connect()
@@ -394,74 +3226,174 @@ def hilo_proceso(ip, sucursal, log_func, update_status_func, add_row_func, stop_
             conn.enable_device()
 
             if att:
-                batch_local = []
-                batch_nube = []
-                nuevos_contador = 0
-
                 # reload usuarios each loop so GUI edits are respected
                 usuarios_local = cargar_usuarios()
-                # sync names and types
-                sync_nombres_con_usuarios(usuarios_local)
-
-                for a in att:
-                    fecha_str = a.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-                    uid = str(a.user_id)
-
-                    # --- FILTRO MAESTRO ---
-                    llave_unica = f"{uid}_{fecha_str}"
-
-                    if llave_unica in HISTORIAL_PROCESADO:
-                        continue  # ¡YA EXISTE! Lo saltamos
-
-                    # Si llegamos aquí, es NUEVO
-                    HISTORIAL_PROCESADO.add(llave_unica)
-                    nuevos_contador += 1
-
-                    raw_nom = mapa.get(uid, "Desconocido")
-                    user_info = usuarios_local.get(uid)
-                    # PRIORIDAD: nombre del sistema (usuarios_config) > nombre del dispositivo
-                    display_name = raw_nom
-                    tipo = "visitante"
-                    if user_info:
-                        nombre_conf = user_info.get("nombre")
-                        if nombre_conf:
-                            display_name = nombre_conf
-                        tipo = user_info.get("tipo", "visitante")
-
-                    modo, est = analizar_registro(uid, a.timestamp, a.punch, usuarios_local)
-
-                    # Actualizar estado en RAM y persistir (usa display_name)
-                    actualizar_estado_usuario(uid, display_name, tipo, modo, fecha_str)
-
-                    # Agregar a GUI (Visual) - add_row_func mostrará los datos actualizados desde ESTADOS_USUARIOS
-                    add_row_func(uid, display_name, fecha_str, modo, est)
-
-                    # Agregar a listas de guardado (notar columnas extendidas)
-                    batch_local.append([uid, display_name, fecha_str, modo, est, sucursal, tipo, modo, fecha_str])
-                    batch_nube.append([uid, display_name, fecha_str, modo, est, sucursal, tipo, modo, fecha_str])
+                # sync names and types (solo si cambió el padrón del reloj o la configuración)
+                if PADRON.cambio(mapa, usuarios_local):
+                    sync_nombres_con_usuarios(usuarios_local)
+                    planificador.actualizar_fronteras(usuarios_local)
+
+                # fuente -> dedupe -> enriquecer -> clasificar -> destinos (por lotes)
+                pipeline = Pipeline(
+                    etapas=[etapa_dedupe, etapa_enriquecer(mapa, usuarios_local), etapa_clasificar(usuarios_local),
+                            DEBOUNCE.etapa(usuarios_local)],
+                    destinos=[DestinoEstados(), DestinoGUI(add_row_func), DestinoExcelLocal(),
+                              nube, DestinoRollups(), DestinoIndiceChecadas(), DestinoRecientes()]
+                             + ([DestinoPaquetes(carpeta_sync, sucursal, log_func)] if carpeta_sync else []),
+                    log_func=log_func,
+                )
+                nuevos_contador = pipeline.ejecutar(fuente_dispositivo(att, sucursal))
+                del att
 
                 if nuevos_contador > 0:
                     log_func(f"✅ Se detectaron {nuevos_contador} registros NUEVOS.")
-                    guardar_excel_local(batch_local)
-                    if sheet:
-                        try:
-                            sheet.append_rows(batch_nube)
-                        except Exception as e:
-                            log_func(f"⚠️ Error subiendo a nube: {e}")
-                else:
-                    pass
+
+            # estado vigente por UID (incluye alertas del monitor): un solo batch por ciclo
+            HOJA_ESTADO.sincronizar(log_func)
 
             conn.disconnect()
+            DIAGNOSTICO.fin_ciclo(log_func)
             # permitir salida ordenada si stop_event está activo (útil en pruebas)
             if stop_event and stop_event.is_set():
                 break
-            time.sleep(60)
+            espera = planificador.siguiente(nuevos_contador)
+            update_status_func("sondeo", espera)
+            if stop_event:
+                stop_event.wait(espera)
+            else:
+                time.sleep(espera)
 
         except Exception as e:
+            DIAGNOSTICO.fin_ciclo(log_func)
             update_status_func("reloj", False)
             log_func(f"Reintentando: {e}")
             time.sleep(20)
 
+# ==========================================
+# 🩺 DIAGNÓSTICO (cProfile / tracemalloc)
+# ==========================================
+class Diagnostico:
+    """
+    Perfilado del colector sin depurador, para la PC de producción:
+    - cProfile por ciclo; cada n_ciclos se escribe un .prof acumulado con su
+      resumen .txt, y un ciclo más lento que PERFIL_CICLO_LENTO_SECONDS se guarda aparte.
+    - tracemalloc: cada PERFIL_MEMORIA_SECONDS, top de asignaciones y diferencias
+      contra la instantánea anterior y contra la primera.
+    Se pide desde cualquier hilo (solicitado); el colector lo aplica al iniciar su ciclo.
+    """
+
+    def __init__(self, carpeta=CARPETA_DIAGNOSTICO, n_ciclos=PERFIL_CICLOS):
+        self.carpeta = carpeta
+        self.n_ciclos = n_ciclos
+        self.solicitado = False
+        self.activo = False
+        self.perfil = None
+        self.acumulado = None
+        self.ciclos = 0
+        self.t_ciclo = 0
+        self.base = self.previa = None
+        self.t_memoria = 0
+
+    def desde_entorno(self):
+        v = os.environ.get("ACCESSPRO_PERFIL", "").strip().lower()
+        if v and v not in ("0", "no", "false"):
+            self.solicitado = True
+            if v.isdigit() and int(v) > 1:
+                self.n_ciclos = int(v)
+        return self.solicitado
+
+    def alternar(self):
+        self.solicitado = not self.solicitado
+        return self.solicitado
+
+    def _ruta(self, nombre):
+        os.makedirs(self.carpeta, exist_ok=True)
+        return os.path.join(self.carpeta, f"{nombre}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+    def inicio_ciclo(self, log_func):
+        if self.solicitado and not self.activo:
+            self.activo = True
+            self.ciclos, self.acumulado = 0, None
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(PERFIL_MARCOS)
+            self.base = self.previa = self._tomar_instantanea()
+            self.t_memoria = time.time()
+            log_func(f"🩺 Perfilado activo ({self.n_ciclos} ciclos por archivo) en {os.path.abspath(self.carpeta)}")
+        elif not self.solicitado and self.activo:
+            self._volcar_perfil(log_func)
+            self._volcar_memoria(log_func)
+            tracemalloc.stop()
+            self.activo = False
+            self.base = self.previa = None
+            log_func("🩺 Perfilado detenido.")
+        if self.activo:
+            self.perfil = cProfile.Profile()
+            self.t_ciclo = time.perf_counter()
+            self.perfil.enable()
+
+    def fin_ciclo(self, log_func):
+        if self.perfil is None:
+            return
+        self.perfil.disable()
+        duracion = time.perf_counter() - self.t_ciclo
+        perfil, self.perfil = self.perfil, None
+        try:
+            if duracion >= PERFIL_CICLO_LENTO_SECONDS:
+                ruta = self._ruta(f"ciclo_lento_{duracion:.0f}s") + ".prof"
+                perfil.dump_stats(ruta)
+                log_func(f"🩺 Ciclo lento ({duracion:.1f}s) guardado en {ruta}")
+            if self.acumulado is None:
+                self.acumulado = pstats.Stats(perfil)
+            else:
+                self.acumulado.add(perfil)
+            self.ciclos += 1
+            if self.ciclos >= self.n_ciclos:
+                self._volcar_perfil(log_func)
+            if time.time() - self.t_memoria >= PERFIL_MEMORIA_SECONDS:
+                self._volcar_memoria(log_func)
+        except Exception as e:
+            log_func(f"⚠️ Diagnóstico: {e}")
+
+    def _volcar_perfil(self, log_func):
+        if self.acumulado is None:
+            return
+        ruta = self._ruta(f"ciclos_x{self.ciclos}")
+        self.acumulado.dump_stats(ruta + ".prof")
+        with open(ruta + ".txt", 'w', encoding='utf-8') as f:
+            self.acumulado.stream = f
+            self.acumulado.sort_stats("cumulative").print_stats(PERFIL_TOP)
+        log_func(f"🩺 Perfil de {self.ciclos} ciclos: {ruta}.prof")
+        self.acumulado, self.ciclos = None, 0
+
+    @staticmethod
+    def _tomar_instantanea():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def _volcar_memoria(self, log_func):
+        if self.base is None:
+            return
+        actual = self._tomar_instantanea()
+        total = sum(st.size for st in actual.statistics("filename"))
+        inicial = sum(st.size for st in self.base.statistics("filename"))
+        ruta = self._ruta("memoria") + ".txt"
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(f"Total rastreado: {total / 2**20:.1f} MiB (inicio: {inicial / 2**20:.1f} MiB)\n")
+            for titulo, stats in (("Top asignaciones", actual.statistics("lineno")),
+                                  ("Cambio desde la instantánea anterior", actual.compare_to(self.previa, "lineno")),
+                                  ("Cambio desde el inicio del perfilado", actual.compare_to(self.base, "lineno"))):
+                f.write(f"\n== {titulo} ==\n")
+                for st in stats[:PERFIL_TOP]:
+                    f.write(f"{st}\n")
+        self.previa = actual
+        self.t_memoria = time.time()
+        log_func(f"🩺 Memoria: {total / 2**20:.1f} MiB ({(total - inicial) / 2**20:+.1f} desde el inicio) -> {ruta}")
+
+DIAGNOSTICO = Diagnostico()
+
 # ==========================================
 # 🖥️ INTERFAZ GRÁFICA + GESTOR DE USUARIOS
 # ==========================================
@@ -488,6 +3420,16 @@ def start_gui():
     frame_top.pack(fill="x")
     tk.Label(frame_top, text="ZKTECO MANAGER", fg="white", bg="#2c3e50", font=("Segoe UI", 16, "bold")).pack(side="left", padx=20, pady=10)
 
+    # Ocupación en vivo (lectura O(1) de los contadores)
+    lbl_ocupacion = tk.Label(frame_top, text="", fg="white", bg="#2c3e50", font=("Segoe UI", 11))
+    lbl_ocupacion.pack(side="right", padx=20)
+
+    def refrescar_ocupacion():
+        t = OCUPACION.por_tipo()
+        lbl_ocupacion.config(text=f"Dentro: {OCUPACION.total}  |  👷 {t.get('empleado', 0)}  🧑‍💼 {t.get('visitante', 0)}  🔒 {t.get('recluso', 0)}")
+        root.after(1000, refrescar_ocupacion)
+    refrescar_ocupacion()
+
     # Config
     cfg = cargar_config()
     frame_cfg = tk.Frame(root, pady=10, bg="#ecf0f1")
@@ -505,10 +3447,25 @@ def start_gui():
 
     # Botón para gestionar usuarios
     def abrir_gestor_usuarios():
-        usuarios = cargar_usuarios()
+        repo = RepositorioUsuarios().cargar()
         win = tk.Toplevel(root)
         win.title("Gestor de Usuarios")
-        win.geometry("700x450")
+        win.geometry("760x500")
+
+        # búsqueda al teclear (ID o nombre, sin acentos) + filtro por tipo
+        frame_busq = tk.Frame(win)
+        frame_busq.pack(fill="x", padx=10, pady=(10, 0))
+        tk.Label(frame_busq, text="Buscar:").pack(side="left")
+        var_busq = tk.StringVar()
+        entry_busq = tk.Entry(frame_busq, textvariable=var_busq, width=30)
+        entry_busq.pack(side="left", padx=5)
+        tk.Label(frame_busq, text="Tipo:").pack(side="left", padx=(10, 0))
+        var_tipo = tk.StringVar(value="todos")
+        combo_tipo = ttk.Combobox(frame_busq, textvariable=var_tipo, state="readonly", width=12,
+                                  values=["todos", "empleado", "visitante", "recluso", "externo"])
+        combo_tipo.pack(side="left", padx=5)
+        lbl_total = tk.Label(frame_busq, text="", fg="#7f8c8d")
+        lbl_total.pack(side="right")
 
         cols = ("ID", "Nombre", "Tipo", "Entrada", "Salida")
         tree_u = ttk.Treeview(win, columns=cols, show="headings")
@@ -517,25 +3474,43 @@ def start_gui():
             tree_u.column(c, width=120, anchor="center")
         tree_u.pack(fill="both", expand=True, padx=10, pady=10)
 
-        def refrescar_tree():
+        MAX_VISIBLES = 500
+
+        def refrescar_tree(*_):
             for i in tree_u.get_children():
                 tree_u.delete(i)
-            u = cargar_usuarios()
-            for k, v in u.items():
+            tipo = var_tipo.get()
+            uids = repo.buscar(var_busq.get(), tipo=None if tipo == "todos" else tipo)
+            for k in uids[:MAX_VISIBLES]:
+                v = repo.obtener(k)
                 tree_u.insert("", "end", values=(k, v.get("nombre",""), v.get("tipo","visitante"), v.get("hora_entrada",""), v.get("hora_salida","")))
+            extra = f" (mostrando {MAX_VISIBLES})" if len(uids) > MAX_VISIBLES else ""
+            lbl_total.config(text=f"{len(uids)} de {len(repo)} usuarios{extra}" + (" • sin guardar" if repo.sucio else ""))
 
-        def validar_hhmm(h):
-            if not h:
-                return True
-            try:
-                parts = h.split(":")
-                if len(parts) != 2:
-                    return False
-                hh = int(parts[0])
-                mm = int(parts[1])
-                return 0 <= hh < 24 and 0 <= mm < 60
-            except:
-                return False
+        var_busq.trace_add("write", refrescar_tree)
+        combo_tipo.bind("<<ComboboxSelected>>", refrescar_tree)
+
+        # escrituras en lote: varios cambios seguidos -> una sola escritura
+        guardado_pendiente = [None]
+
+        def guardar_ahora():
+            guardado_pendiente[0] = None
+            if repo.guardar():
+                # sincronizar nombres y tipos en estados
+                sync_nombres_con_usuarios(repo.usuarios)
+            refrescar_tree()
+
+        def programar_guardado():
+            if guardado_pendiente[0] is None:
+                guardado_pendiente[0] = win.after(1500, guardar_ahora)
+            refrescar_tree()
+
+        def cerrar():
+            if guardado_pendiente[0] is not None:
+                win.after_cancel(guardado_pendiente[0])
+            guardar_ahora()
+            win.destroy()
+        win.protocol("WM_DELETE_WINDOW", cerrar)
 
         def add_user():
             uid = simpledialog.askstring("ID usuario", "ID único (ej. 23):", parent=win)
@@ -553,14 +3528,11 @@ def start_gui():
             if hora_salida and not validar_hhmm(hora_salida):
                 messagebox.showerror("Error", "Formato hora salida inválido. Usa HH:MM", parent=win)
                 return
-            usuarios = cargar_usuarios()
-            usuarios[uid] = {"nombre": nombre, "tipo": tipo}
-            if hora_entrada: usuarios[uid]["hora_entrada"] = hora_entrada
-            if hora_salida: usuarios[uid]["hora_salida"] = hora_salida
-            guardar_usuarios(usuarios)
-            # sincronizar nombres y tipos en estados
-            sync_nombres_con_usuarios(usuarios)
-            refrescar_tree()
+            perfil = {"nombre": nombre, "tipo": tipo}
+            if hora_entrada: perfil["hora_entrada"] = hora_entrada
+            if hora_salida: perfil["hora_salida"] = hora_salida
+            repo.poner(uid, perfil)
+            programar_guardado()
 
         def edit_user():
             sel = tree_u.selection()
@@ -569,8 +3541,7 @@ def start_gui():
                 return
             vals = tree_u.item(sel[0])["values"]
             uid = str(vals[0])
-            usuarios = cargar_usuarios()
-            u = usuarios.get(uid, {})
+            u = repo.obtener(uid) or {}
             nombre = simpledialog.askstring("Nombre", "Nombre completo:", parent=win, initialvalue=u.get("nombre",""))
             tipo = simpledialog.askstring("Tipo", "Tipo (empleado/visitante/recluso/externo):", parent=win, initialvalue=u.get("tipo","visitante"))
             hora_entrada = simpledialog.askstring("Hora entrada", "Formato HH:MM (dejar vacío para visitante):", parent=win, initialvalue=u.get("hora_entrada",""))
@@ -581,17 +3552,13 @@ def start_gui():
             if hora_salida and not validar_hhmm(hora_salida):
                 messagebox.showerror("Error", "Formato hora salida inválido. Usa HH:MM", parent=win)
                 return
-            usuarios[uid] = {"nombre": nombre, "tipo": tipo}
-            if hora_entrada: usuarios[uid]["hora_entrada"] = hora_entrada
-            elif "hora_entrada" in usuarios[uid]:
-                usuarios[uid].pop("hora_entrada", None)
-            if hora_salida: usuarios[uid]["hora_salida"] = hora_salida
-            elif "hora_salida" in usuarios[uid]:
-                usuarios[uid].pop("hora_salida", None)
-            guardar_usuarios(usuarios)
-            # sincronizar nombres y tipos en estados (inmediato)
-            sync_nombres_con_usuarios(usuarios)
-            refrescar_tree()
+            # conservar claves extra del perfil (p.ej. debounce_segundos)
+            perfil = {k: v for k, v in u.items() if k not in ("hora_entrada", "hora_salida")}
+            perfil.update({"nombre": nombre, "tipo": tipo})
+            if hora_entrada: perfil["hora_entrada"] = hora_entrada
+            if hora_salida: perfil["hora_salida"] = hora_salida
+            repo.poner(uid, perfil)
+            programar_guardado()
 
         def del_user():
             sel = tree_u.selection()
@@ -600,21 +3567,71 @@ def start_gui():
                 return
             vals = tree_u.item(sel[0])["values"]
             uid = str(vals[0])
-            usuarios = cargar_usuarios()
-            if uid in usuarios:
-                if messagebox.askyesno("Confirmar", f"Eliminar usuario {uid} - {usuarios[uid].get('nombre')} ?", parent=win):
-                    usuarios.pop(uid)
-                    guardar_usuarios(usuarios)
-                    refrescar_tree()
+            if uid in repo:
+                if messagebox.askyesno("Confirmar", f"Eliminar usuario {uid} - {repo.obtener(uid).get('nombre')} ?", parent=win):
+                    repo.quitar(uid)
+                    programar_guardado()
+
+        def importar_csv():
+            ruta = filedialog.askopenfilename(parent=win, filetypes=[("CSV", "*.csv")])
+            if not ruta:
+                return
+            try:
+                nuevos, actualizados, errores = repo.importar_csv(ruta)
+            except Exception as e:
+                messagebox.showerror("Importar", f"No se pudo leer el CSV: {e}", parent=win)
+                return
+            guardar_ahora()
+            msg = f"{nuevos} nuevos, {actualizados} actualizados."
+            if errores:
+                msg += f"\n\n{len(errores)} filas con error:\n" + "\n".join(errores[:15])
+            messagebox.showinfo("Importar", msg, parent=win)
+
+        def exportar_csv():
+            ruta = filedialog.asksaveasfilename(parent=win, defaultextension=".csv", initialfile="usuarios.csv",
+                                                filetypes=[("CSV", "*.csv")])
+            if ruta:
+                n = repo.exportar_csv(ruta)
+                messagebox.showinfo("Exportar", f"{n} usuarios exportados a {ruta}", parent=win)
 
         btn_frame = tk.Frame(win)
         btn_frame.pack(fill="x", padx=10, pady=(0,10))
         tk.Button(btn_frame, text="Agregar", command=add_user).pack(side="left", padx=5)
         tk.Button(btn_frame, text="Editar", command=edit_user).pack(side="left", padx=5)
         tk.Button(btn_frame, text="Eliminar", command=del_user).pack(side="left", padx=5)
-        tk.Button(btn_frame, text="Actualizar", command=refrescar_tree).pack(side="left", padx=5)
+        tk.Button(btn_frame, text="Importar CSV", command=importar_csv).pack(side="left", padx=5)
+        tk.Button(btn_frame, text="Exportar CSV", command=exportar_csv).pack(side="left", padx=5)
+        def conciliar_reloj():
+            if not PADRON.reloj:
+                messagebox.showinfo("Conciliar", "Aún no hay padrón del reloj: inicia el sistema para leerlo.", parent=win)
+                return
+            dif = diferencias_padron(PADRON.reloj, repo.usuarios)
+            altas, renombres, bajas = dif["altas"], dif["renombres"], dif["bajas"]
+            if not (altas or renombres or bajas):
+                messagebox.showinfo("Conciliar", f"Configuración y reloj coinciden ({len(PADRON.reloj)} usuarios).", parent=win)
+                return
+            muestra = lambda xs: "\n".join(f"  {x}" for x in list(xs)[:10]) + ("\n  ..." if len(xs) > 10 else "")
+            messagebox.showinfo("Conciliar", f"Padrón del reloj ({PADRON.tomado}):\n\n"
+                                f"Altas (en reloj, no configurados): {len(altas)}\n{muestra([f'{u} - {n}' for u, n in altas.items()])}\n\n"
+                                f"Nombres distintos: {len(renombres)}\n{muestra([f'{u}: {a} → {b}' for u, (a, b) in renombres.items()])}\n\n"
+                                f"Ya no están en el reloj: {len(bajas)}\n{muestra(bajas)}", parent=win)
+            n = aplicar_padron(repo, dif,
+                               altas=bool(altas) and messagebox.askyesno("Conciliar", f"¿Agregar {len(altas)} usuarios del reloj como visitantes?", parent=win),
+                               renombres=bool(renombres) and messagebox.askyesno("Conciliar", f"¿Usar el nombre del reloj en {len(renombres)} usuarios?", parent=win),
+                               bajas=bool(bajas) and messagebox.askyesno("Conciliar", f"¿Eliminar {len(bajas)} usuarios que ya no están en el reloj?", parent=win))
+            if n:
+                guardar_ahora()
+
+        def recargar():
+            guardar_ahora()  # no perder cambios en lote antes de releer el archivo
+            repo.cargar()
+            refrescar_tree()
+
+        tk.Button(btn_frame, text="Conciliar con reloj", command=conciliar_reloj).pack(side="left", padx=5)
+        tk.Button(btn_frame, text="Recargar", command=recargar).pack(side="left", padx=5)
 
         refrescar_tree()
+        entry_busq.focus_set()
 
     tk.Button(frame_cfg, text="Gestionar Usuarios", command=abrir_gestor_usuarios, bg="#f39c12", fg="white").pack(side="right", padx=10)
 
@@ -625,8 +3642,14 @@ def start_gui():
     lbl_reloj.pack(side="left", padx=10)
     lbl_cloud = tk.Label(frame_status, text="● NUBE", fg="#bdc3c7", bg="#ecf0f1", font=("Arial", 10, "bold"))
     lbl_cloud.pack(side="left", padx=10)
+    lbl_sondeo = tk.Label(frame_status, text="⏱ --", fg="#7f8c8d", bg="#ecf0f1", font=("Arial", 9))
+    lbl_sondeo.pack(side="left", padx=10)
 
     def update_status(tipo, online):
+        if tipo == "sondeo":
+            # aquí 'online' trae los segundos hasta la siguiente lectura
+            lbl_sondeo.config(text=f"⏱ {online}s")
+            return
         color = "#27ae60" if online else "#c0392b"
         if tipo == "reloj": lbl_reloj.config(fg=color)
         if tipo == "google": lbl_cloud.config(fg=color)
@@ -660,11 +3683,16 @@ def start_gui():
         ultimo_estado = s.get("ultimo_estado", "")
         ultima_act = s.get("ultima_actividad", "")
         # LIMITADOR DE FILAS
-        if len(tree.get_children()) > 200:
+        if len(tree.get_children()) > TABLA_MAX_FILAS:
             tree.delete(tree.get_children()[-1])
         tag = "late" if "Retardo" in estado or "Anticipada" in estado else "ok"
         tree.insert("", 0, values=(uid, nom, hora, evento, estado, tipo, ultimo_estado, ultima_act), tags=(tag,))
 
+    # Arranque en caliente: las checadas del día ya guardadas (el primer ciclo solo agrega nuevas)
+    RECIENTES.cargar()
+    for fila in RECIENTES.ultimas():
+        add_row_to_table(fila[0], fila[1], fila[2], fila[3], fila[4])
+
     # Log
     frame_log = tk.Frame(root, height=100)
     frame_log.pack(fill="x", padx=10, pady=5)
@@ -690,6 +3718,20 @@ def start_gui():
         t2 = threading.Thread(target=monitor_visitantes, args=(log, stop_event))
         t2.daemon = True
         t2.start()
+        # reconciliación de contadores de ocupación
+        t3 = threading.Thread(target=reconciliador_ocupacion, args=(log, stop_event))
+        t3.daemon = True
+        t3.start()
+        # API local de consulta (lee solo memoria)
+        iniciar_api(log, stop_event)
+
+    # Perfilado oculto: Ctrl+Shift+P (se aplica al siguiente ciclo del colector)
+    def alternar_diagnostico(_evento=None):
+        if DIAGNOSTICO.alternar():
+            log(f"🩺 Perfilado solicitado: resultados en {os.path.abspath(DIAGNOSTICO.carpeta)}")
+        else:
+            log("🩺 Perfilado se detendrá al siguiente ciclo.")
+    root.bind("<Control-P>", alternar_diagnostico)
 
     btn_start = tk.Button(root, text="INICIAR SISTEMA", command=run, bg="#2980b9", fg="white", font=("Arial", 11, "bold"), height=2)
     btn_start.pack(fill="x", padx=20, pady=10)
@@ -728,17 +3770,181 @@ def start_gui():
             tipo = user_info.get("tipo", ESTADOS_USUARIOS.get(uid, {}).get("tipo", "visitante"))
             nombre = user_info.get("nombre", ESTADOS_USUARIOS.get(uid, {}).get("nombre", uid))
             # marcar salida
-            actualizar_estado_usuario(uid, nombre, tipo, "Salida", now)
+            actualizar_estado_usuario(uid, nombre, tipo, "Salida", now, manual=True,
+                                      sucursal=cargar_config().get("sucursal", ""))
             messagebox.showinfo("Salida marcada", f"Salida manual marcada para {uid} - {nombre} a las {now}", parent=win)
             refrescar()
 
         tk.Button(win, text="Marcar salida manual", command=marcar_salida_manual).pack(pady=(0,5))
 
+        # consulta histórica: quién estaba dentro en un momento dado
+        def consultar_dentro_en():
+            momento = simpledialog.askstring("¿Quién estaba dentro?", "Fecha y hora (YYYY-MM-DD HH:MM):", parent=win,
+                                             initialvalue=datetime.datetime.now().strftime("%Y-%m-%d %H:%M"))
+            if not momento:
+                return
+            try:
+                dt = datetime.datetime.strptime(momento.strip(), "%Y-%m-%d %H:%M")
+            except ValueError:
+                messagebox.showerror("Error", "Formato inválido. Usa YYYY-MM-DD HH:MM", parent=win)
+                return
+            dentro = ESTANCIAS.dentro_en(dt)
+            lineas = []
+            for uid, ini, fin, tipo in sorted(dentro, key=lambda r: r[1]):
+                nombre = ESTADOS_USUARIOS.get(uid, {}).get("nombre", uid)
+                hasta = desde_epoch(fin) if fin is not None else "sigue dentro"
+                lineas.append(f"{uid} - {nombre} ({tipo}): {desde_epoch(ini)} → {hasta}")
+            messagebox.showinfo("Ocupación", f"{len(dentro)} personas dentro a las {momento}:\n\n" + "\n".join(lineas[:40]), parent=win)
+
+        tk.Button(win, text="¿Quién estaba dentro?", command=consultar_dentro_en).pack(pady=(0,5))
+
+        def buscar_archivado():
+            uid = simpledialog.askstring("Buscar en archivo", "ID del usuario archivado:", parent=win)
+            if not uid:
+                return
+            d = ARCHIVO_INACTIVOS.buscar(uid.strip())
+            if not d:
+                messagebox.showinfo("Archivo", f"UID {uid} no está en el archivo de inactivos.", parent=win)
+                return
+            messagebox.showinfo("Archivo", "\n".join(f"{k}: {v}" for k, v in d.items()), parent=win)
+
+        tk.Button(win, text=f"Buscar archivado ({len(ARCHIVO_INACTIVOS)})", command=buscar_archivado).pack(pady=(0,5))
+
         refrescar()
 
     tk.Button(frame_cfg, text="Panel Estados", command=abrir_panel_estados, bg="#16a085", fg="white").pack(side="right", padx=5)
 
+    # Exportación para nómina: corre en otro proceso y reporta avance por una cola
+    def abrir_exportar():
+        hoy = datetime.date.today()
+        desde = simpledialog.askstring("Exportar", "Desde (YYYY-MM-DD):", parent=root,
+                                       initialvalue=hoy.replace(day=1).strftime("%Y-%m-%d"))
+        if not desde:
+            return
+        hasta = simpledialog.askstring("Exportar", "Hasta (YYYY-MM-DD):", parent=root, initialvalue=hoy.strftime("%Y-%m-%d"))
+        if not hasta:
+            return
+        try:
+            for v in (desde, hasta):
+                datetime.datetime.strptime(v.strip(), "%Y-%m-%d")
+        except ValueError:
+            messagebox.showerror("Error", "Formato inválido. Usa YYYY-MM-DD", parent=root)
+            return
+        sucursal = simpledialog.askstring("Exportar", "Sucursal (vacío = todas):", parent=root) or None
+        tipo = simpledialog.askstring("Exportar", "Tipo (empleado/visitante/recluso/externo, vacío = todos):", parent=root) or None
+        destino = filedialog.asksaveasfilename(parent=root, defaultextension=".xlsx",
+                                               initialfile=f"Asistencia_{desde.strip()}_{hasta.strip()}.xlsx",
+                                               filetypes=[("Excel", "*.xlsx"), ("CSV", "*.csv")])
+        if not destino:
+            return
+
+        win = tk.Toplevel(root)
+        win.title("Exportando...")
+        win.geometry("400x110")
+        lbl = tk.Label(win, text=f"Leyendo particiones de {desde} a {hasta}...")
+        lbl.pack(pady=(15, 5))
+        barra = ttk.Progressbar(win, length=360, mode="determinate")
+        barra.pack(padx=20)
+
+        proc, cola = iniciar_exportacion(destino, desde.strip(), hasta.strip(), sucursal, tipo)
+
+        def revisar():
+            try:
+                while not cola.empty():
+                    msg = cola.get_nowait()
+                    if msg[0] == "progreso":
+                        _, hechas, total = msg
+                        barra.config(maximum=max(total, 1), value=hechas)
+                        lbl.config(text=f"{hechas:,} / {total:,} filas leídas")
+                    elif msg[0] == "fin":
+                        r = msg[1]
+                        barra.config(maximum=1, value=1)
+                        log(f"📤 Exportadas {r['escritas']} filas ({r['leidas']} leídas de {r['particiones']} meses) a {r['destino']}")
+                        win.destroy()
+                        return
+                    else:
+                        log(f"❌ Error exportando: {msg[1]}")
+                        messagebox.showerror("Exportar", msg[1], parent=root)
+                        win.destroy()
+                        return
+            except Exception:
+                pass
+            if not proc.is_alive() and cola.empty():
+                log("❌ La exportación terminó sin resultado.")
+                win.destroy()
+                return
+            root.after(200, revisar)
+        revisar()
+
+    tk.Button(frame_cfg, text="Exportar", command=abrir_exportar, bg="#8e44ad", fg="white").pack(side="right", padx=5)
+
     root.mainloop()
 
+# ==========================================
+# ⌨️ LÍNEA DE COMANDOS
+# ==========================================
+def main_cli(argv):
+    parser = argparse.ArgumentParser(prog="accesspro", description="ZKTECO SYNC PRO - modo consola")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_bf = sub.add_parser("backfill", help="reproduce volcados históricos (.dat/.csv/.xlsx) sin conectar al reloj")
+    p_bf.add_argument("archivos", nargs="+")
+    p_bf.add_argument("--sucursal", default=None, help="sucursal a registrar (por defecto la de config_app.json)")
+    p_bf.add_argument("--procesos", type=int, default=None, help="procesos del pool (por defecto: núcleos del CPU)")
+    p_bf.add_argument("--nube", action="store_true", help="subir también a Google Sheets")
+    p_bf.add_argument("--lote", type=int, default=20000, help="filas por escritura a Excel/nube")
+
+    p_ex = sub.add_parser("exportar", help="exporta checadas a .xlsx/.csv leyendo las particiones fila por fila")
+    p_ex.add_argument("destino")
+    p_ex.add_argument("--desde", required=True, help="YYYY-MM-DD")
+    p_ex.add_argument("--hasta", required=True, help="YYYY-MM-DD")
+    p_ex.add_argument("--sucursal", default=None)
+    p_ex.add_argument("--tipo", default=None)
+
+    p_co = sub.add_parser("consolidar", help="funde los paquetes de todas las sucursales de una carpeta compartida")
+    p_co.add_argument("carpeta_sync")
+    p_co.add_argument("--salida", default="consolidado", help="carpeta del acervo central (por defecto: consolidado)")
+
+    p_pa = sub.add_parser("padron", help="compara el padrón del reloj con usuarios_config.json")
+    p_pa.add_argument("--ip", default=None, help="IP del reloj (por defecto la de config_app.json)")
+    p_pa.add_argument("--aplicar", nargs="*", default=[], choices=["altas", "renombres", "bajas"])
+
+    args = parser.parse_args(argv)
+    if args.comando == "padron":
+        conn = ZK(args.ip or cargar_config().get("ip"), port=4370, timeout=10, password=0, force_udp=True, ommit_ping=True)
+        conn.connect()
+        try:
+            mapa = {str(u.user_id): u.name for u in conn.get_users()}
+        finally:
+            conn.disconnect()
+        repo = RepositorioUsuarios().cargar()
+        dif = diferencias_padron(mapa, repo.usuarios)
+        print(f"Reloj: {len(mapa)} | configurados: {len(repo)} | altas: {len(dif['altas'])} | "
+              f"renombres: {len(dif['renombres'])} | bajas: {len(dif['bajas'])}")
+        for uid, nombre in dif["altas"].items():
+            print(f"  + {uid} {nombre}")
+        for uid, (antes, despues) in dif["renombres"].items():
+            print(f"  ~ {uid} {antes} -> {despues}")
+        for uid in dif["bajas"]:
+            print(f"  - {uid} {repo.obtener(uid).get('nombre', '')}")
+        if args.aplicar:
+            n = aplicar_padron(repo, dif, altas="altas" in args.aplicar, renombres="renombres" in args.aplicar,
+                               bajas="bajas" in args.aplicar)
+            repo.guardar()
+            print(f"✅ {n} cambios aplicados a {ARCHIVO_USUARIOS}")
+    elif args.comando == "consolidar":
+        Consolidador(args.carpeta_sync, args.salida).ejecutar()
+    elif args.comando == "exportar":
+        r = exportar_asistencia(args.destino, args.desde, args.hasta, sucursal=args.sucursal, tipo=args.tipo,
+                                progreso=lambda h, t: print(f"\r{h:,} / {t:,} filas", end="", flush=True))
+        print(f"\n📤 {r['escritas']} filas exportadas a {r['destino']}")
+    elif args.comando == "backfill":
+        sucursal = args.sucursal or cargar_config().get("sucursal", "")
+        ejecutar_backfill(args.archivos, sucursal, procesos=args.procesos, subir_nube=args.nube, tam_lote=args.lote)
+    return 0
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # necesario para el pool dentro del .exe
+    if len(sys.argv) > 1:
+        sys.exit(main_cli(sys.argv[1:]))
     start_gui()
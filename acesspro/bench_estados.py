@@ -0,0 +1,52 @@
+"""
+Benchmark de memoria de ESTADOS_USUARIOS: dict por UID (formato anterior)
+contra EstadoUsuario (slots + catálogos + epoch).
+
+Uso:  python bench_estados.py            (100k y 1M IDs)
+      python bench_estados.py 250000     (tamaños a elección)
+"""
+import datetime
+import gc
+import sys
+import tracemalloc
+
+from accesspro import EstadoUsuario
+
+def generar(n):
+    base = datetime.datetime(2025, 1, 1, 8, 0, 0)
+    tipos = ("empleado", "visitante", "recluso", "externo")
+    for i in range(n):
+        fecha = (base + datetime.timedelta(seconds=i * 37)).strftime("%Y-%m-%d %H:%M:%S")
+        yield str(i), {
+            "nombre": f"Usuario {i}",
+            "tipo": tipos[i % 4],
+            "ultimo_estado": "Entrada" if i % 3 else "Salida",
+            "ultima_actividad": fecha,
+            "alerta": False,
+            "sucursal": "Matriz",
+        }
+
+def medir(n, compacto):
+    gc.collect()
+    tracemalloc.start()
+    if compacto:
+        estados = {uid: EstadoUsuario.desde_dict(d) for uid, d in generar(n)}
+    else:
+        # json.load crea cadenas nuevas por cada valor: se copian para simularlo
+        estados = {uid: {k: (v[:1] + v[1:] if isinstance(v, str) else v) for k, v in d.items()} for uid, d in generar(n)}
+    actual, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del estados
+    return actual
+
+def main():
+    tamanos = [int(a) for a in sys.argv[1:]] or [100_000, 1_000_000]
+    for n in tamanos:
+        antes = medir(n, compacto=False)
+        despues = medir(n, compacto=True)
+        print(f"{n:>9,} IDs | dict: {antes / 2**20:8.1f} MiB ({antes / n:5.0f} B/ID) | "
+              f"EstadoUsuario: {despues / 2**20:8.1f} MiB ({despues / n:5.0f} B/ID) | "
+              f"ahorro {100 * (1 - despues / antes):.0f}%")
+
+if __name__ == "__main__":
+    main()
@@ -12,8 +12,12 @@ Fecha: 2025
 import json
 import datetime
 import os
+import re
 import sys
-from typing import List, Dict, Optional
+import bisect
+import shutil
+import unicodedata
+from typing import List, Dict, Optional, Iterator
 
 # Códigos de colores ANSI para mejorar la interfaz
 class Colors:
@@ -52,33 +56,275 @@ def safe_input(prompt: str) -> str:
             # Si todo falla, devolver cadena vacía
             return ""
 
-class TaskManager:
-    """Gestor de tareas con funcionalidades básicas de CRUD."""
-    
+def tokenize(text: str) -> List[str]:
+    """Palabras en minúsculas y sin acentos ('Revisión Técnica' -> ['revision', 'tecnica'])."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return re.findall(r"\w+", text)
+
+class TaskStore:
+    """
+    Almacén de tareas indexado.
+
+    - ``by_id``: id -> tarea (conserva el orden de creación), búsquedas O(1).
+    - ``indexes``: por ``status`` y ``priority``, valor -> {id: None} (conjunto ordenado).
+    - ``next_id``: contador monotónico que se guarda con las tareas; un id
+      borrado nunca se vuelve a usar.
+
+    Búsqueda: índice invertido ``words`` (palabra -> {id}) sobre título y
+    descripción, con ``vocabulary`` ordenado para buscar por prefijo.
+
+    Estadísticas: ``counts[(priority, status)]`` se suma y resta en cada
+    mutación, así que ``stats()`` no recorre las tareas; ``verify_counts()``
+    las recalcula desde cero al cargar.
+
+    Persistencia con bitácora:
+
+    - ``tareas.json`` es la instantánea: ``{"next_id": N, "tasks": [...]}``
+      (también se lee el formato anterior, una lista de tareas).
+    - ``tareas.json.journal`` recibe una línea JSON por operación
+      (add/update/delete). ``save()`` solo agrega las operaciones pendientes:
+      I/O proporcional al cambio, no al total de tareas.
+    - Cada ``COMPACT_EVERY`` operaciones (y con ``compact()``) la bitácora se
+      funde en una instantánea nueva y se vacía. Reaplicar una operación es
+      inofensivo, así que un corte entre ambos pasos no pierde ni duplica nada.
+    - Para escribir desde otro hilo, ``take_pending()``/``snapshot()`` toman los
+      datos (en el hilo dueño del store) y ``append_journal()``/``write_snapshot()``
+      hacen el I/O, en el mismo orden en que se tomaron.
+    """
+
+    INDEXED_FIELDS = ("status", "priority")
+    COMPACT_EVERY = 1000
+
     def __init__(self, data_file: str = "tareas.json"):
         self.data_file = data_file
-        self.tasks = self.load_tasks()
-    
-    def load_tasks(self) -> List[Dict]:
-        """Cargar tareas desde archivo JSON."""
+        self.journal_file = data_file + ".journal"
+        self.by_id: Dict[int, Dict] = {}
+        self.indexes: Dict[str, Dict[str, Dict[int, None]]] = {f: {} for f in self.INDEXED_FIELDS}
+        self.next_id = 1
+        self.counts: Dict[tuple, int] = {}
+        self.words: Dict[str, set] = {}
+        self.vocabulary: List[str] = []
+        self.pending: List[Dict] = []
+        self.journal_ops = 0
+        self.journal_errors: List[int] = []
+        self.load()
+
+    def load(self) -> None:
+        """Cargar la instantánea, reaplicar la bitácora y reconstruir los índices."""
+        data = []
         if os.path.exists(self.data_file):
             try:
                 with open(self.data_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    data = json.load(f)
             except (json.JSONDecodeError, FileNotFoundError):
+                data = []
+        tasks = data.get("tasks", []) if isinstance(data, dict) else data
+        self.by_id = {}
+        self.indexes = {f: {} for f in self.INDEXED_FIELDS}
+        self.counts = {}
+        self.words, self.vocabulary = {}, []
+        for task in tasks:
+            self.by_id[task["id"]] = task
+            self._index(task)
+        stored_next = data.get("next_id", 1) if isinstance(data, dict) else 1
+        self.next_id = max(stored_next, max(self.by_id, default=0) + 1)
+        self.pending = []
+        self.journal_ops = self._replay_journal()
+        self.verify_counts()
+
+    def _replay_journal(self) -> int:
+        """
+        Reaplicar operaciones de la bitácora.
+
+        Una línea ilegible o con una operación mal formada al final (corte a
+        medio escribir) se descarta truncando el archivo. Si está en medio,
+        las operaciones válidas que la siguen se conservan: se salta, se
+        guarda una copia en ``<bitácora>.corrupto`` y se avisa con su número
+        de línea (también quedan en ``journal_errors``).
+        """
+        self.journal_errors = []
+        if not os.path.exists(self.journal_file):
+            return 0
+        ops, good, bad = 0, 0, []
+        with open(self.journal_file, 'rb') as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    op = json.loads(line.decode('utf-8'))
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    op = None
+                if not self._valid_op(op):
+                    bad.append(number)
+                    continue
+                self.journal_errors.extend(bad)
+                bad = []
+                self._apply(op)
+                ops += 1
+                good = f.tell()
+            truncated = f.seek(0, os.SEEK_END) != good
+        if self.journal_errors:
+            shutil.copyfile(self.journal_file, self.journal_file + ".corrupto")
+            lines = ", ".join(str(n) for n in self.journal_errors)
+            print(f"{Colors.WARNING}⚠️ Bitácora {self.journal_file}: se omitieron líneas inválidas ({lines}); "
+                  f"copia en {self.journal_file}.corrupto{Colors.END}")
+        if truncated:
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(good)
+        return ops
+
+    @staticmethod
+    def _valid_op(op) -> bool:
+        """Forma mínima de una operación de la bitácora (lo que ``_apply`` necesita)."""
+        if not isinstance(op, dict):
+            return False
+        if op.get("op") == "add":
+            task = op.get("task")
+            return isinstance(task, dict) and type(task.get("id")) is int
+        if op.get("op") == "update":
+            return type(op.get("id")) is int and isinstance(op.get("fields"), dict)
+        if op.get("op") == "delete":
+            return type(op.get("id")) is int
+        return False
+
+    def _apply(self, op: Dict) -> None:
+        if op["op"] == "add":
+            task = op["task"]
+            if task["id"] in self.by_id:
+                self._unindex(self.by_id[task["id"]])
+            self.by_id[task["id"]] = task
+            self._index(task)
+            self.next_id = max(self.next_id, task["id"] + 1)
+        elif op["op"] == "update":
+            task = self.by_id.get(op["id"])
+            if task is not None:
+                self._unindex(task)
+                task.update(op["fields"])
+                self._index(task)
+        elif op["op"] == "delete":
+            task = self.by_id.pop(op["id"], None)
+            if task is not None:
+                self._unindex(task)
+
+    def save(self) -> None:
+        """Agregar a la bitácora las operaciones pendientes (y compactar si toca)."""
+        self.append_journal(self.take_pending())
+        if self.journal_ops >= self.COMPACT_EVERY:
+            self.compact()
+
+    def take_pending(self) -> List[Dict]:
+        """Entregar (y dar por escritas) las operaciones pendientes, para guardarlas aparte."""
+        ops, self.pending = self.pending, []
+        self.journal_ops += len(ops)
+        return ops
+
+    def append_journal(self, ops: List[Dict]) -> None:
+        """Escribir operaciones al final de la bitácora (no toca el estado en memoria)."""
+        if not ops:
+            return
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            for op in ops:
+                f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_json(self, path: str, data) -> None:
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def compact(self) -> None:
+        """Fundir la bitácora (y lo pendiente) en una instantánea nueva de tareas.json y vaciarla."""
+        self.write_snapshot(self.snapshot())
+
+    def snapshot(self) -> Dict:
+        """
+        Copia del estado para ``write_snapshot``; lo pendiente queda incluido,
+        así que se descarta y la bitácora vuelve a contar desde cero.
+        """
+        self.pending = []
+        self.journal_ops = 0
+        return {"next_id": self.next_id, "tasks": [dict(task) for task in self.by_id.values()]}
+
+    def write_snapshot(self, snapshot: Dict) -> None:
+        """Reemplazar tareas.json por la instantánea y borrar la bitácora que ya contiene."""
+        self._write_json(self.data_file, snapshot)
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+
+    def export_json(self, path: str) -> int:
+        """Exportar como lista JSON simple (formato clásico de tareas.json)."""
+        self._write_json(path, list(self.by_id.values()))
+        return len(self.by_id)
+
+    def _index(self, task: Dict) -> None:
+        for field in self.INDEXED_FIELDS:
+            self.indexes[field].setdefault(task.get(field), {})[task["id"]] = None
+        key = (task.get("priority"), task.get("status"))
+        self.counts[key] = self.counts.get(key, 0) + 1
+        for word in self._task_words(task):
+            ids = self.words.get(word)
+            if ids is None:
+                ids = self.words[word] = set()
+                bisect.insort(self.vocabulary, word)
+            ids.add(task["id"])
+
+    def _unindex(self, task: Dict) -> None:
+        for field in self.INDEXED_FIELDS:
+            bucket = self.indexes[field].get(task.get(field))
+            if bucket is not None:
+                bucket.pop(task["id"], None)
+                if not bucket:
+                    del self.indexes[field][task.get(field)]
+        key = (task.get("priority"), task.get("status"))
+        self.counts[key] -= 1
+        if not self.counts[key]:
+            del self.counts[key]
+        for word in self._task_words(task):
+            ids = self.words.get(word)
+            if ids is not None:
+                ids.discard(task["id"])
+                if not ids:
+                    del self.words[word]
+                    del self.vocabulary[bisect.bisect_left(self.vocabulary, word)]
+
+    @staticmethod
+    def _task_words(task: Dict) -> set:
+        return set(tokenize(task.get("title", ""))) | set(tokenize(task.get("description", "")))
+
+    def search(self, query: str) -> List[Dict]:
+        """
+        Tareas cuyo título o descripción tiene, para cada palabra de la consulta,
+        una palabra que empieza con ella ('revi tec' encuentra 'Revisión técnica').
+        """
+        found = None
+        for term in tokenize(query):
+            ids = set()
+            i = bisect.bisect_left(self.vocabulary, term)
+            while i < len(self.vocabulary) and self.vocabulary[i].startswith(term):
+                ids |= self.words[self.vocabulary[i]]
+                i += 1
+            found = ids if found is None else found & ids
+            if not found:
                 return []
-        return []
-    
-    def save_tasks(self) -> None:
-        """Guardar tareas en archivo JSON."""
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(self.tasks, f, indent=2, ensure_ascii=False)
-    
-    def add_task(self, title: str, description: str = "", priority: str = "media") -> int:
-        """Agregar nueva tarea."""
-        task_id = len(self.tasks) + 1
-        new_task = {
-            "id": task_id,
+        return [self.by_id[i] for i in sorted(found or ())]
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.by_id.values())
+
+    def get(self, task_id: int) -> Optional[Dict]:
+        """Obtener tarea por ID (O(1))."""
+        return self.by_id.get(task_id)
+
+    def add(self, title: str, description: str = "", priority: str = "media") -> Dict:
+        """Crear tarea con el siguiente id del contador."""
+        task = {
+            "id": self.next_id,
             "title": title,
             "description": description,
             "priority": priority,
@@ -86,77 +332,163 @@ class TaskManager:
             "created": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "completed": None
         }
-        self.tasks.append(new_task)
+        self.next_id += 1
+        self.by_id[task["id"]] = task
+        self._index(task)
+        self.pending.append({"op": "add", "task": dict(task)})
+        return task
+
+    def update(self, task_id: int, **fields) -> bool:
+        """Actualizar campos existentes de una tarea, manteniendo los índices al día."""
+        task = self.by_id.get(task_id)
+        if task is None:
+            return False
+        self._unindex(task)
+        changed = {key: value for key, value in fields.items() if key in task}
+        task.update(changed)
+        self._index(task)
+        if changed:
+            self.pending.append({"op": "update", "id": task_id, "fields": changed})
+        return True
+
+    def delete(self, task_id: int) -> bool:
+        """Eliminar tarea."""
+        task = self.by_id.pop(task_id, None)
+        if task is None:
+            return False
+        self._unindex(task)
+        self.pending.append({"op": "delete", "id": task_id})
+        return True
+
+    def find(self, field: str, value: str) -> List[Dict]:
+        """Tareas con ``field == value`` usando el índice secundario (en orden de id)."""
+        return [self.by_id[i] for i in sorted(self.indexes[field].get(value, {}))]
+
+    def stats(self) -> Dict:
+        """Totales, completadas, pendientes y desglose por prioridad, leídos de los contadores."""
+        by_priority: Dict[str, Dict[str, int]] = {}
+        completed = 0
+        for (priority, status), n in self.counts.items():
+            p = by_priority.setdefault(priority, {"total": 0, "completed": 0, "pending": 0})
+            p["total"] += n
+            if status == "completada":
+                p["completed"] += n
+                completed += n
+            else:
+                p["pending"] += n
+        total = len(self.by_id)
+        return {
+            "total": total,
+            "completed": completed,
+            "pending": total - completed,
+            "completion_rate": (completed / total * 100) if total > 0 else 0,
+            "by_priority": by_priority
+        }
+
+    def verify_counts(self) -> bool:
+        """Recalcular contadores desde las tareas; si no cuadran, se corrigen. Regresa si cuadraban."""
+        expected: Dict[tuple, int] = {}
+        for task in self.by_id.values():
+            key = (task.get("priority"), task.get("status"))
+            expected[key] = expected.get(key, 0) + 1
+        if expected == self.counts:
+            return True
+        print(f"{Colors.WARNING}⚠️ Contadores de tareas inconsistentes; se recalcularon.{Colors.END}")
+        self.counts = expected
+        return False
+
+    def count(self, field: str, value: str) -> int:
+        """Cuántas tareas tienen ``field == value`` (O(1))."""
+        return len(self.indexes[field].get(value, {}))
+
+class TaskManager:
+    """Gestor de tareas con funcionalidades básicas de CRUD."""
+    
+    def __init__(self, data_file: str = "tareas.json"):
+        self.data_file = data_file
+        self.store = TaskStore(data_file)
+    
+    @property
+    def tasks(self) -> List[Dict]:
+        """Todas las tareas en orden de creación."""
+        return list(self.store)
+    
+    def load_tasks(self) -> List[Dict]:
+        """Cargar tareas desde archivo JSON."""
+        self.store.load()
+        return self.tasks
+    
+    def save_tasks(self) -> None:
+        """Guardar cambios (se agregan a la bitácora; la instantánea se compacta sola)."""
+        self.store.save()
+    
+    def export_tasks(self, path: str) -> int:
+        """Exportar todas las tareas a un JSON simple (lista), como el tareas.json clásico."""
+        return self.store.export_json(path)
+    
+    def add_task(self, title: str, description: str = "", priority: str = "media") -> int:
+        """Agregar nueva tarea."""
+        task = self.store.add(title, description, priority)
         self.save_tasks()
-        return task_id
+        return task["id"]
     
     def complete_task(self, task_id: int) -> bool:
         """Marcar tarea como completada."""
-        for task in self.tasks:
-            if task["id"] == task_id:
-                task["status"] = "completada"
-                task["completed"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.save_tasks()
-                return True
+        if self.store.update(task_id, status="completada",
+                             completed=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")):
+            self.save_tasks()
+            return True
         return False
     
     def delete_task(self, task_id: int) -> bool:
         """Eliminar tarea."""
-        for i, task in enumerate(self.tasks):
-            if task["id"] == task_id:
-                del self.tasks[i]
-                self.save_tasks()
-                return True
+        if self.store.delete(task_id):
+            self.save_tasks()
+            return True
         return False
     
     def get_tasks(self, status: Optional[str] = None) -> List[Dict]:
         """Obtener tareas filtradas por estado."""
         if status:
-            return [task for task in self.tasks if task["status"] == status]
+            return self.store.find("status", status)
         return self.tasks
     
+    def get_tasks_by_priority(self, priority: str) -> List[Dict]:
+        """Obtener tareas de una prioridad."""
+        return self.store.find("priority", priority)
+    
     def get_task_by_id(self, task_id: int) -> Optional[Dict]:
         """Obtener tarea por ID."""
-        for task in self.tasks:
-            if task["id"] == task_id:
-                return task
-        return None
+        return self.store.get(task_id)
+    
+    def search(self, query: str) -> List[Dict]:
+        """Buscar tareas por título/descripción (sin acentos, por prefijo)."""
+        return self.store.search(query)
     
     def update_task(self, task_id: int, **kwargs) -> bool:
         """Actualizar tarea existente."""
-        for task in self.tasks:
-            if task["id"] == task_id:
-                for key, value in kwargs.items():
-                    if key in task:
-                        task[key] = value
-                self.save_tasks()
-                return True
+        if self.store.update(task_id, **kwargs):
+            self.save_tasks()
+            return True
         return False
     
     def get_stats(self) -> Dict:
-        """Obtener estadísticas de tareas."""
-        total = len(self.tasks)
-        completed = len([t for t in self.tasks if t["status"] == "completada"])
-        pending = total - completed
-        
-        return {
-            "total": total,
-            "completed": completed,
-            "pending": pending,
-            "completion_rate": (completed / total * 100) if total > 0 else 0
-        }
+        """Obtener estadísticas de tareas (contadores incrementales, O(1))."""
+        return self.store.stats()
     
-    def display_tasks(self, status: Optional[str] = None) -> None:
-        """Mostrar tareas en consola con colores."""
-        tasks = self.get_tasks(status)
+    def display_tasks(self, status: Optional[str] = None, tasks: Optional[List[Dict]] = None,
+                      label: Optional[str] = None) -> None:
+        """Mostrar tareas en consola con colores (las de un estado o una lista dada)."""
+        if tasks is None:
+            tasks = self.get_tasks(status)
         
         if not tasks:
             print(f"{Colors.WARNING}📝 No hay tareas para mostrar.{Colors.END}")
             return
         
         status_text = f"({len(tasks)} tareas)"
-        if status:
-            status_text = f"- {status.title()} {status_text}"
+        if label or status:
+            status_text = f"- {label or status.title()} {status_text}"
         
         print(f"\n{Colors.TITLE}📋 Lista de Tareas {status_text}{Colors.END}")
         print(f"{Colors.BLUE}{'=' * 60}{Colors.END}")
@@ -205,10 +537,12 @@ def main():
             print(f"{Colors.WHITE}6.{Colors.END} {Colors.INFO}✏️  Editar tarea existente{Colors.END}")
             print(f"{Colors.WHITE}7.{Colors.END} {Colors.ERROR}🗑️  Eliminar tarea{Colors.END}")
             print(f"{Colors.WHITE}8.{Colors.END} {Colors.CYAN}📊 Estadísticas detalladas{Colors.END}")
-            print(f"{Colors.WHITE}9.{Colors.END} {Colors.ERROR}🚪 Salir del programa{Colors.END}")
+            print(f"{Colors.WHITE}9.{Colors.END} {Colors.INFO}🔍 Buscar tareas{Colors.END}")
+            print(f"{Colors.WHITE}10.{Colors.END} {Colors.CYAN}📤 Exportar tareas (JSON){Colors.END}")
+            print(f"{Colors.WHITE}11.{Colors.END} {Colors.ERROR}🚪 Salir del programa{Colors.END}")
             print(f"{Colors.BLUE}{'='*70}{Colors.END}")
             
-            choice = safe_input("Selecciona una opción (1-9): ").strip()
+            choice = safe_input("Selecciona una opción (1-11): ").strip()
             
             if choice == "1":
                 print(f"\n{Colors.SUCCESS}📝 AGREGAR NUEVA TAREA{Colors.END}")
@@ -304,6 +638,13 @@ def main():
                 print(f"{Colors.WARNING}⏳ Pendientes: {stats['pending']}{Colors.END}")
                 print(f"{Colors.INFO}📊 Tasa de completado: {stats['completion_rate']:.1f}%{Colors.END}")
                 
+                # Desglose por prioridad
+                for priority in ("alta", "media", "baja"):
+                    p = stats['by_priority'].get(priority)
+                    if p:
+                        print(f"   {Colors.TASK}{priority.title()}: {p['total']}{Colors.END} "
+                              f"({Colors.SUCCESS}✅ {p['completed']}{Colors.END} / {Colors.WARNING}⏳ {p['pending']}{Colors.END})")
+                
                 # Barra de progreso visual
                 if stats['total'] > 0:
                     progress_bar = "█" * int(stats['completion_rate'] / 5) + "░" * (20 - int(stats['completion_rate'] / 5))
@@ -312,12 +653,32 @@ def main():
                 input(f"\n{Colors.INFO}Presiona Enter para continuar...{Colors.END}")
             
             elif choice == "9":
+                print(f"\n{Colors.INFO}🔍 BUSCAR TAREAS{Colors.END}")
+                print(f"{Colors.BLUE}{'='*25}{Colors.END}")
+                query = safe_input("Palabras a buscar (título o descripción): ").strip()
+                if query:
+                    task_manager.display_tasks(tasks=task_manager.search(query), label=f"Búsqueda '{query}'")
+                input(f"\n{Colors.INFO}Presiona Enter para continuar...{Colors.END}")
+            
+            elif choice == "10":
+                print(f"\n{Colors.CYAN}📤 EXPORTAR TAREAS{Colors.END}")
+                print(f"{Colors.BLUE}{'='*25}{Colors.END}")
+                path = safe_input("Archivo destino [tareas_export.json]: ").strip() or "tareas_export.json"
+                try:
+                    count = task_manager.export_tasks(path)
+                    print(f"\n{Colors.SUCCESS}📤 {count} tareas exportadas a {path}{Colors.END}")
+                except OSError as e:
+                    print(f"\n{Colors.ERROR}❌ No se pudo exportar: {e}{Colors.END}")
+                input(f"\n{Colors.INFO}Presiona Enter para continuar...{Colors.END}")
+            
+            elif choice == "11":
+                task_manager.store.compact()
                 print(f"\n{Colors.SUCCESS}👋 ¡Gracias por usar el Gestor de Tareas!{Colors.END}")
                 print(f"{Colors.INFO}¡Hasta la próxima!{Colors.END}")
                 break
             
             else:
-                print(f"\n{Colors.ERROR}❌ Opción inválida. Por favor, selecciona un número del 1 al 9.{Colors.END}")
+                print(f"\n{Colors.ERROR}❌ Opción inválida. Por favor, selecciona un número del 1 al 11.{Colors.END}")
                 input(f"\n{Colors.INFO}Presiona Enter para continuar...{Colors.END}")
     
     except (EOFError, RuntimeError, KeyboardInterrupt) as e:
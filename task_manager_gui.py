@@ -9,37 +9,188 @@ Autor: Usuario
 Fecha: 2025
 """
 
-import json
 import datetime
-import os
+import bisect
+import threading
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+from tkinter import ttk, messagebox, filedialog
 from typing import List, Dict, Optional
 
+from task_manager import TaskStore, tokenize
+
+# Filas que se cargan en el Treeview por tanda; al llegar al final del scroll se agrega otra
+PAGE_SIZE = 500
+
+PRIORITY_ICONS = {"alta": "🔴", "media": "🟡", "baja": "🟢"}
+
+# Espera del guardado en segundo plano para juntar cambios seguidos en una sola escritura
+SAVE_DELAY = 0.5
+
+class BackgroundSaver:
+    """
+    Escritor de tareas en un hilo aparte para no congelar la ventana en discos lentos.
+    
+    El hilo de Tk llama ``request()`` tras cada cambio: pasa las operaciones
+    pendientes del store (o una instantánea si toca compactar) a un búfer.
+    El hilo escritor espera ``SAVE_DELAY``, toma todo lo acumulado y lo escribe
+    de una vez; la instantánea se escribe con reemplazo atómico.
+    """
+    
+    def __init__(self, store: TaskStore, delay: float = SAVE_DELAY):
+        self.store = store
+        self.delay = delay
+        self.ops: List[Dict] = []
+        self.snapshot: Optional[Dict] = None
+        self.writing = False
+        self.closing = False
+        self.error: Optional[str] = None
+        self.cond = threading.Condition()
+        self.start()
+    
+    def start(self) -> None:
+        """Arrancar (o volver a arrancar tras ``close()``) el hilo escritor."""
+        self.closing = False
+        self.thread = threading.Thread(target=self._run, name="guardado-tareas", daemon=True)
+        self.thread.start()
+    
+    @property
+    def busy(self) -> bool:
+        """¿Hay cambios sin escribir todavía?"""
+        with self.cond:
+            return self.writing or bool(self.ops) or self.snapshot is not None
+    
+    @property
+    def unsaved(self) -> str:
+        """Descripción de lo que sigue en el búfer sin escribir (para avisar al cerrar)."""
+        with self.cond:
+            parts = []
+            if self.snapshot is not None:
+                parts.append(f"instantánea de {len(self.snapshot['tasks'])} tareas")
+            if self.ops:
+                parts.append(f"{len(self.ops)} cambios")
+            return " y ".join(parts)
+    
+    def request(self) -> None:
+        """Encolar los cambios del store (llamar desde el hilo de Tk)."""
+        ops = self.store.take_pending()
+        with self.cond:
+            if self.store.journal_ops >= self.store.COMPACT_EVERY:
+                # La instantánea ya incluye todo lo encolado antes
+                self.snapshot, self.ops = self.store.snapshot(), []
+            else:
+                self.ops.extend(ops)
+            self.cond.notify()
+    
+    def close(self) -> None:
+        """Escribir lo pendiente y terminar el hilo."""
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+        self.thread.join()
+    
+    def _run(self) -> None:
+        while True:
+            with self.cond:
+                while not (self.ops or self.snapshot) and not self.closing:
+                    self.cond.wait()
+                if not (self.ops or self.snapshot):
+                    return
+                deadline = time.monotonic() + self.delay
+                while not self.closing and time.monotonic() < deadline:
+                    self.cond.wait(deadline - time.monotonic())
+                snapshot, ops = self.snapshot, self.ops
+                self.snapshot, self.ops = None, []
+                self.writing = True
+            try:
+                if snapshot is not None:
+                    self.store.write_snapshot(snapshot)
+                    snapshot = None
+                self.store.append_journal(ops)
+                self.error = None
+            except Exception as e:
+                # Cualquier error (disco, datos no serializables...) deja el hilo vivo y
+                # los datos en el búfer: "Guardando…" no se queda colgado y al cerrar se avisa
+                self.error = f"{type(e).__name__}: {e}"
+                with self.cond:
+                    # Se devuelve al búfer y se reintenta tras una pausa; si ya hay una
+                    # instantánea más nueva en cola, esta ya los incluye y se descartan
+                    # (escribirlos después de ella regresaría las tareas a valores viejos)
+                    if self.snapshot is None:
+                        if snapshot is not None:
+                            self.snapshot = snapshot
+                        self.ops = ops + self.ops
+                if self.closing:
+                    return
+                time.sleep(self.delay)
+            finally:
+                with self.cond:
+                    self.writing = False
+
 class TaskManagerGUI:
     """Gestor de tareas con interfaz gráfica usando Tkinter."""
     
     def __init__(self):
         self.data_file = "tareas.json"
-        self.tasks = self.load_tasks()
+        self.store = TaskStore(self.data_file)
+        # Filas visibles: ids en orden (el iid del Treeview es str(id)) y sus valores actuales
+        self.shown: List[int] = []
+        self.rows: Dict[int, tuple] = {}
+        self.matching: List[int] = []
+        self.page_limit = PAGE_SIZE
+        self.saver = BackgroundSaver(self.store)
         self.root = tk.Tk()
         self.setup_gui()
         self.refresh_task_list()
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        if self.store.journal_errors:
+            lines = ", ".join(str(n) for n in self.store.journal_errors)
+            messagebox.showwarning("Advertencia",
+                                   f"La bitácora {self.store.journal_file} tenía líneas inválidas ({lines}) "
+                                   f"que se omitieron.\nCopia en {self.store.journal_file}.corrupto")
+    
+    @property
+    def tasks(self) -> List[Dict]:
+        """Todas las tareas en orden de creación."""
+        return list(self.store)
     
     def load_tasks(self) -> List[Dict]:
         """Cargar tareas desde archivo JSON."""
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                return []
-        return []
+        self.store.load()
+        return self.tasks
     
     def save_tasks(self) -> None:
-        """Guardar tareas en archivo JSON."""
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(self.tasks, f, indent=2, ensure_ascii=False)
+        """Guardar tareas en segundo plano (los cambios seguidos se escriben juntos)."""
+        self.saver.request()
+        self.save_label.config(text="💾 Guardando…")
+        self.root.after(150, self.poll_saving)
+    
+    def poll_saving(self):
+        """Actualizar el indicador de guardado hasta que el escritor termine."""
+        if self.saver.busy:
+            if self.saver.error:
+                self.save_label.config(text="⚠️ Error al guardar, reintentando…")
+            self.root.after(150, self.poll_saving)
+        elif self.saver.error:
+            self.save_label.config(text="⚠️ Error al guardar")
+        else:
+            self.save_label.config(text="")
+    
+    def on_close(self):
+        """Escribir lo pendiente, compactar la bitácora y cerrar."""
+        self.saver.close()
+        if self.saver.error or self.saver.busy:
+            unsaved = self.saver.unsaved
+            detail = f"\n\nSin guardar: {unsaved} (se perderán)." if unsaved else ""
+            if not messagebox.askyesno("Error", f"❌ No se pudieron guardar los cambios: {self.saver.error}{detail}\n\n¿Cerrar de todos modos?"):
+                self.saver.start()
+                return
+        else:
+            try:
+                self.store.compact()
+            except OSError:
+                pass
+        self.root.destroy()
     
     def setup_gui(self):
         """Configurar la interfaz gráfica."""
@@ -83,6 +234,8 @@ class TaskManagerGUI:
                   command=self.show_stats).pack(fill=tk.X, pady=2)
         ttk.Button(button_frame, text="🔄 Actualizar", 
                   command=self.refresh_task_list).pack(fill=tk.X, pady=2)
+        ttk.Button(button_frame, text="📤 Exportar", 
+                  command=self.export_tasks).pack(fill=tk.X, pady=2)
         
         # Frame de la lista de tareas
         list_frame = ttk.LabelFrame(main_frame, text="📋 Lista de Tareas", padding="5")
@@ -110,14 +263,18 @@ class TaskManagerGUI:
         self.task_tree.column('Estado', width=100)
         self.task_tree.column('Creada', width=120)
         
-        # Scrollbar
+        # Scrollbar (al llegar al final se carga la siguiente tanda de filas)
         scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.task_tree.yview)
-        self.task_tree.configure(yscrollcommand=scrollbar.set)
+        self.task_tree.configure(yscrollcommand=lambda first, last: (scrollbar.set(first, last),
+                                                                     self.on_scroll(last)))
         
         # Grid para treeview y scrollbar
         self.task_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
         
+        self.page_label = ttk.Label(list_frame, text="", font=('Arial', 9))
+        self.page_label.grid(row=1, column=0, sticky=tk.W)
+        
         # Frame de filtros
         filter_frame = ttk.Frame(main_frame)
         filter_frame.grid(row=2, column=0, columnspan=3, pady=(10, 0), sticky=(tk.W, tk.E))
@@ -131,72 +288,128 @@ class TaskManagerGUI:
         filter_combo.pack(side=tk.LEFT, padx=(0, 10))
         filter_combo.bind('<<ComboboxSelected>>', self.filter_tasks)
         
+        # Búsqueda en vivo (título/descripción, sin acentos, por prefijo)
+        ttk.Label(filter_frame, text="🔍 Buscar:").pack(side=tk.LEFT, padx=(0, 5))
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *_: self.filter_tasks())
+        ttk.Entry(filter_frame, textvariable=self.search_var, width=25).pack(side=tk.LEFT, padx=(0, 10))
+        
         # Estadísticas rápidas
         self.stats_label = ttk.Label(filter_frame, text="", font=('Arial', 10))
         self.stats_label.pack(side=tk.RIGHT)
         
+        # Indicador de guardado en segundo plano
+        self.save_label = ttk.Label(filter_frame, text="", font=('Arial', 10))
+        self.save_label.pack(side=tk.RIGHT, padx=(0, 10))
+        
         self.update_stats()
     
-    def refresh_task_list(self):
-        """Actualizar la lista de tareas en el Treeview."""
-        # Limpiar lista actual
-        for item in self.task_tree.get_children():
-            self.task_tree.delete(item)
-        
-        # Agregar tareas
-        for task in self.tasks:
-            status_icon = "✅" if task["status"] == "completada" else "⏳"
-            priority_icon = {
-                "alta": "🔴",
-                "media": "🟡", 
-                "baja": "🟢"
-            }.get(task["priority"], "⚪")
-            
-            self.task_tree.insert('', tk.END, values=(
-                task['id'],
-                task['title'],
-                task['description'][:50] + "..." if len(task['description']) > 50 else task['description'],
-                f"{priority_icon} {task['priority'].title()}",
-                f"{status_icon} {task['status'].title()}",
-                task['created']
-            ))
+    def row_values(self, task: Dict) -> tuple:
+        """Valores de la fila de una tarea (iconos y descripción recortada)."""
+        status_icon = "✅" if task["status"] == "completada" else "⏳"
+        priority_icon = PRIORITY_ICONS.get(task["priority"], "⚪")
+        return (
+            task['id'],
+            task['title'],
+            task['description'][:50] + "..." if len(task['description']) > 50 else task['description'],
+            f"{priority_icon} {task['priority'].title()}",
+            f"{status_icon} {task['status'].title()}",
+            task['created']
+        )
     
-    def filter_tasks(self, event=None):
-        """Filtrar tareas por estado."""
+    def matches_filter(self, task: Dict) -> bool:
+        """¿La tarea pasa el filtro de estado y la búsqueda actuales?"""
         filter_value = self.filter_var.get()
+        if filter_value != "Todas" and task["status"] != filter_value.lower():
+            return False
+        terms = tokenize(self.search_var.get())
+        if not terms:
+            return True
+        words = TaskStore._task_words(task)
+        return all(any(w.startswith(term) for w in words) for term in terms)
+    
+    def refresh_task_list(self):
+        """Recalcular qué tareas pasan el filtro y aplicar al Treeview solo las diferencias."""
+        filter_value = self.filter_var.get()
+        query = self.search_var.get().strip()
         
-        # Limpiar lista actual
-        for item in self.task_tree.get_children():
-            self.task_tree.delete(item)
-        
-        # Filtrar y agregar tareas
-        filtered_tasks = self.tasks
-        if filter_value != "Todas":
-            filtered_tasks = [task for task in self.tasks if task["status"] == filter_value.lower()]
-        
-        for task in filtered_tasks:
-            status_icon = "✅" if task["status"] == "completada" else "⏳"
-            priority_icon = {
-                "alta": "🔴",
-                "media": "🟡", 
-                "baja": "🟢"
-            }.get(task["priority"], "⚪")
-            
-            self.task_tree.insert('', tk.END, values=(
-                task['id'],
-                task['title'],
-                task['description'][:50] + "..." if len(task['description']) > 50 else task['description'],
-                f"{priority_icon} {task['priority'].title()}",
-                f"{status_icon} {task['status'].title()}",
-                task['created']
-            ))
+        if query:
+            self.matching = [t["id"] for t in self.store.search(query)
+                             if filter_value == "Todas" or t["status"] == filter_value.lower()]
+        elif filter_value != "Todas":
+            self.matching = [t["id"] for t in self.store.find("status", filter_value.lower())]
+        else:
+            self.matching = sorted(self.store.by_id)
+        
+        target = self.matching[:self.page_limit]
+        wanted = set(target)
+        gone = [i for i in self.shown if i not in wanted]
+        if gone:
+            self.task_tree.delete(*map(str, gone))
+            for task_id in gone:
+                del self.rows[task_id]
+        
+        for index, task_id in enumerate(target):
+            values = self.row_values(self.store.get(task_id))
+            if task_id not in self.rows:
+                self.task_tree.insert('', index, iid=str(task_id), values=values)
+            elif self.rows[task_id] != values:
+                self.task_tree.item(str(task_id), values=values)
+            self.rows[task_id] = values
+        self.shown = target
+        self.update_page_label()
+    
+    def filter_tasks(self, event=None):
+        """Filtrar tareas por estado y por el texto de búsqueda."""
+        self.page_limit = PAGE_SIZE
+        self.refresh_task_list()
+    
+    def on_scroll(self, last):
+        """Cargar la siguiente tanda de filas al llegar al final de la lista."""
+        if float(last) >= 1.0 and len(self.shown) < len(self.matching):
+            self.page_limit += PAGE_SIZE
+            self.root.after_idle(self.refresh_task_list)
+    
+    def update_page_label(self):
+        """Indicar cuántas filas se muestran cuando la lista está paginada."""
+        text = ""
+        if len(self.shown) < len(self.matching):
+            text = f"Mostrando {len(self.shown)} de {len(self.matching)} (desplázate para ver más)"
+        self.page_label.config(text=text)
+    
+    def apply_task_change(self, task_id: int):
+        """Reflejar en el Treeview el alta, cambio o baja de una sola tarea."""
+        task = self.store.get(task_id)
+        visible = task is not None and self.matches_filter(task)
+        pos = bisect.bisect_left(self.matching, task_id)
+        listed = pos < len(self.matching) and self.matching[pos] == task_id
+        if visible and not listed:
+            self.matching.insert(pos, task_id)
+        elif listed and not visible:
+            del self.matching[pos]
+        
+        if task_id in self.rows:
+            if not visible:
+                self.task_tree.delete(str(task_id))
+                del self.rows[task_id]
+                self.shown.remove(task_id)
+            else:
+                values = self.row_values(task)
+                if self.rows[task_id] != values:
+                    self.task_tree.item(str(task_id), values=values)
+                    self.rows[task_id] = values
+        elif visible and (len(self.shown) < self.page_limit or (self.shown and task_id < self.shown[-1])):
+            index = bisect.bisect_left(self.shown, task_id)
+            self.rows[task_id] = self.row_values(task)
+            self.task_tree.insert('', index, iid=str(task_id), values=self.rows[task_id])
+            self.shown.insert(index, task_id)
+        self.update_page_label()
     
     def update_stats(self):
         """Actualizar estadísticas rápidas."""
-        total = len(self.tasks)
-        completed = len([t for t in self.tasks if t["status"] == "completada"])
-        pending = total - completed
-        completion_rate = (completed / total * 100) if total > 0 else 0
+        stats = self.store.stats()
+        total, completed, pending = stats["total"], stats["completed"], stats["pending"]
+        completion_rate = stats["completion_rate"]
         
         stats_text = f"📊 Total: {total} | ✅ Completadas: {completed} | ⏳ Pendientes: {pending} | 📈 Progreso: {completion_rate:.1f}%"
         self.stats_label.config(text=stats_text)
@@ -205,19 +418,10 @@ class TaskManagerGUI:
         """Mostrar diálogo para agregar nueva tarea."""
         dialog = TaskDialog(self.root, "Agregar Nueva Tarea")
         if dialog.result:
-            task_id = len(self.tasks) + 1
-            new_task = {
-                "id": task_id,
-                "title": dialog.result["title"],
-                "description": dialog.result["description"],
-                "priority": dialog.result["priority"],
-                "status": "pendiente",
-                "created": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "completed": None
-            }
-            self.tasks.append(new_task)
+            task_id = self.store.add(dialog.result["title"], dialog.result["description"],
+                                     dialog.result["priority"])["id"]
             self.save_tasks()
-            self.refresh_task_list()
+            self.apply_task_change(task_id)
             self.update_stats()
             messagebox.showinfo("Éxito", f"✅ Tarea agregada exitosamente con ID: {task_id}")
     
@@ -232,18 +436,14 @@ class TaskManagerGUI:
         task_id = int(item['values'][0])
         
         # Encontrar la tarea
-        task = None
-        for t in self.tasks:
-            if t['id'] == task_id:
-                task = t
-                break
+        task = self.store.get(task_id)
         
         if task:
             dialog = TaskDialog(self.root, "Editar Tarea", task)
             if dialog.result:
-                task.update(dialog.result)
+                self.store.update(task_id, **dialog.result)
                 self.save_tasks()
-                self.refresh_task_list()
+                self.apply_task_change(task_id)
                 self.update_stats()
                 messagebox.showinfo("Éxito", "✅ Tarea actualizada exitosamente")
     
@@ -257,18 +457,18 @@ class TaskManagerGUI:
         item = self.task_tree.item(selected[0])
         task_id = int(item['values'][0])
         
-        for task in self.tasks:
-            if task["id"] == task_id:
-                if task["status"] == "completada":
-                    messagebox.showinfo("Info", "Esta tarea ya está completada.")
-                    return
-                task["status"] = "completada"
-                task["completed"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.save_tasks()
-                self.refresh_task_list()
-                self.update_stats()
-                messagebox.showinfo("Éxito", "✅ Tarea marcada como completada")
+        task = self.store.get(task_id)
+        if task:
+            if task["status"] == "completada":
+                messagebox.showinfo("Info", "Esta tarea ya está completada.")
                 return
+            self.store.update(task_id, status="completada",
+                              completed=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            self.save_tasks()
+            self.apply_task_change(task_id)
+            self.update_stats()
+            messagebox.showinfo("Éxito", "✅ Tarea marcada como completada")
+            return
         
         messagebox.showerror("Error", "❌ Tarea no encontrada")
     
@@ -284,23 +484,25 @@ class TaskManagerGUI:
         task_title = item['values'][1]
         
         if messagebox.askyesno("Confirmar", f"¿Estás seguro de que quieres eliminar la tarea '{task_title}'?"):
-            for i, task in enumerate(self.tasks):
-                if task["id"] == task_id:
-                    del self.tasks[i]
-                    self.save_tasks()
-                    self.refresh_task_list()
-                    self.update_stats()
-                    messagebox.showinfo("Éxito", "🗑️ Tarea eliminada exitosamente")
-                    return
+            if self.store.delete(task_id):
+                self.save_tasks()
+                self.apply_task_change(task_id)
+                self.update_stats()
+                messagebox.showinfo("Éxito", "🗑️ Tarea eliminada exitosamente")
+                return
             
             messagebox.showerror("Error", "❌ Tarea no encontrada")
     
     def show_stats(self):
         """Mostrar estadísticas detalladas."""
-        total = len(self.tasks)
-        completed = len([t for t in self.tasks if t["status"] == "completada"])
-        pending = total - completed
-        completion_rate = (completed / total * 100) if total > 0 else 0
+        stats = self.store.stats()
+        total, completed, pending = stats["total"], stats["completed"], stats["pending"]
+        completion_rate = stats["completion_rate"]
+        by_priority = "\n".join(
+            f"{icon} {priority.title()}: {p['total']} (✅ {p['completed']} / ⏳ {p['pending']})"
+            for priority, icon in (("alta", "🔴"), ("media", "🟡"), ("baja", "🟢"))
+            for p in [stats["by_priority"].get(priority)] if p
+        )
         
         stats_text = f"""📊 ESTADÍSTICAS DETALLADAS
 
@@ -309,11 +511,27 @@ class TaskManagerGUI:
 ⏳ Pendientes: {pending}
 📊 Tasa de completado: {completion_rate:.1f}%
 
+{by_priority}
+
 Progreso visual:
 {'█' * int(completion_rate / 5)}{'░' * (20 - int(completion_rate / 5))} {completion_rate:.1f}%"""
         
         messagebox.showinfo("Estadísticas", stats_text)
     
+    def export_tasks(self):
+        """Exportar todas las tareas a un JSON simple (lista), como el tareas.json clásico."""
+        path = filedialog.asksaveasfilename(parent=self.root, title="Exportar tareas",
+                                            defaultextension=".json", initialfile="tareas_export.json",
+                                            filetypes=[("JSON", "*.json")])
+        if not path:
+            return
+        try:
+            count = self.store.export_json(path)
+        except OSError as e:
+            messagebox.showerror("Error", f"❌ No se pudo exportar: {e}")
+            return
+        messagebox.showinfo("Éxito", f"📤 {count} tareas exportadas a {path}")
+    
     def run(self):
         """Ejecutar la aplicación."""
         self.root.mainloop()
@@ -9,104 +9,73 @@ Autor: Usuario
 Fecha: 2025
 """
 
-import json
 import datetime
-import os
 from typing import List, Dict, Optional
 
+from task_manager import TaskStore
+
 class TaskManager:
-    """Gestor de tareas con funcionalidades básicas de CRUD."""
+    """Gestor de tareas con funcionalidades básicas de CRUD (sobre el TaskStore compartido)."""
     
     def __init__(self, data_file: str = "tareas.json"):
         self.data_file = data_file
-        self.tasks = self.load_tasks()
+        self.store = TaskStore(data_file)
+    
+    @property
+    def tasks(self) -> List[Dict]:
+        """Todas las tareas en orden de creación."""
+        return list(self.store)
     
     def load_tasks(self) -> List[Dict]:
         """Cargar tareas desde archivo JSON."""
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, FileNotFoundError):
-                return []
-        return []
+        self.store.load()
+        return self.tasks
     
     def save_tasks(self) -> None:
-        """Guardar tareas en archivo JSON."""
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(self.tasks, f, indent=2, ensure_ascii=False)
+        """Guardar cambios (bitácora + instantánea de tareas.json)."""
+        self.store.save()
     
     def add_task(self, title: str, description: str = "", priority: str = "media") -> int:
         """Agregar nueva tarea."""
-        task_id = len(self.tasks) + 1
-        new_task = {
-            "id": task_id,
-            "title": title,
-            "description": description,
-            "priority": priority,
-            "status": "pendiente",
-            "created": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "completed": None
-        }
-        self.tasks.append(new_task)
+        task = self.store.add(title, description, priority)
         self.save_tasks()
-        return task_id
+        return task["id"]
     
     def complete_task(self, task_id: int) -> bool:
         """Marcar tarea como completada."""
-        for task in self.tasks:
-            if task["id"] == task_id:
-                task["status"] = "completada"
-                task["completed"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                self.save_tasks()
-                return True
+        if self.store.update(task_id, status="completada",
+                             completed=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")):
+            self.save_tasks()
+            return True
         return False
     
     def delete_task(self, task_id: int) -> bool:
         """Eliminar tarea."""
-        for i, task in enumerate(self.tasks):
-            if task["id"] == task_id:
-                del self.tasks[i]
-                self.save_tasks()
-                return True
+        if self.store.delete(task_id):
+            self.save_tasks()
+            return True
         return False
     
     def get_tasks(self, status: Optional[str] = None) -> List[Dict]:
         """Obtener tareas filtradas por estado."""
         if status:
-            return [task for task in self.tasks if task["status"] == status]
+            return self.store.find("status", status)
         return self.tasks
     
     def get_task_by_id(self, task_id: int) -> Optional[Dict]:
         """Obtener tarea por ID."""
-        for task in self.tasks:
-            if task["id"] == task_id:
-                return task
-        return None
+        return self.store.get(task_id)
     
     def update_task(self, task_id: int, **kwargs) -> bool:
         """Actualizar tarea existente."""
-        for task in self.tasks:
-            if task["id"] == task_id:
-                for key, value in kwargs.items():
-                    if key in task:
-                        task[key] = value
-                self.save_tasks()
-                return True
+        if self.store.update(task_id, **kwargs):
+            self.save_tasks()
+            return True
         return False
     
     def get_stats(self) -> Dict:
         """Obtener estadísticas de tareas."""
-        total = len(self.tasks)
-        completed = len([t for t in self.tasks if t["status"] == "completada"])
-        pending = total - completed
-        
-        return {
-            "total": total,
-            "completed": completed,
-            "pending": pending,
-            "completion_rate": (completed / total * 100) if total > 0 else 0
-        }
+        return self.store.stats()
     
     def display_tasks(self, status: Optional[str] = None) -> None:
         """Mostrar tareas en consola."""
@@ -234,6 +203,7 @@ def main():
             print(f"Tasa de completado: {stats['completion_rate']:.1f}%")
         
         elif choice == "9":
+            task_manager.store.compact()
             print("👋 ¡Hasta luego!")
             break
         